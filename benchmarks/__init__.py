@@ -0,0 +1,7 @@
+"""
+Package: benchmarks
+
+Performance benchmarks for the Product service. The ones that
+populate the product table drop it first, so they run against a scratch
+SQLite database unless BENCHMARK_DATABASE_URI names another database.
+"""
@@ -0,0 +1,69 @@
+"""
+Catalog Snapshot Benchmark
+
+Loads a large number of products into the catalog snapshot, reports how
+much memory it takes, and measures the latency of the find_by_* lookups
+it answers without querying the database
+
+Usage:
+    python -m benchmarks.catalog --products 1000000
+"""
+import sys
+import time
+import random
+import string
+import argparse
+import tracemalloc
+from decimal import Decimal
+from service.common.catalog import Catalog
+
+
+def random_record(item_id: int, names: list) -> tuple:
+    """Returns an (id, name, price, available, category, version) record"""
+    price = Decimal(random.randint(100, 100000)) / 100
+    return (item_id, random.choice(names), price, random.random() < 0.5, random.randint(0, 5), 1)
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Returns the sample below which a fraction of the sorted samples fall"""
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def main(argv=None):
+    """Prints the memory of the catalog and the latency percentiles of its lookups"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1000000, help="number of products in the catalog")
+    parser.add_argument("--names", type=int, default=50000, help="number of distinct product names")
+    parser.add_argument("--lookups", type=int, default=100, help="number of lookups to time")
+    args = parser.parse_args(argv)
+
+    names = ["".join(random.choices(string.ascii_lowercase, k=8)).title() for _ in range(args.names)]
+    records = [random_record(item_id, names) for item_id in range(1, args.products + 1)]
+    catalog = Catalog(enabled=True)
+    tracemalloc.start()
+    start = time.perf_counter()
+    catalog.load(records)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"Loaded {args.products} products in {elapsed:.2f} s, {memory / 2 ** 20:.1f} MB traced")
+    print(f"Columns take {catalog.stats()['bytes'] / 2 ** 20:.1f} MB")
+
+    for label, lookup in (
+        ("name", lambda: catalog.find(name=random.choice(names))),
+        ("price", lambda: catalog.find(price=random.choice(records)[2])),
+        ("category", lambda: catalog.find(category=random.randint(0, 5))),
+        ("available", lambda: catalog.find(available=random.random() < 0.5)),
+    ):
+        samples = []
+        for _ in range(args.lookups):
+            start = time.perf_counter()
+            lookup()
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        print(f"find by {label}: p50 {percentile(samples, 0.50):.2f} ms, p99 {percentile(samples, 0.99):.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Facet Count Benchmark
+
+Compares counting the products by category and availability for a
+combination of filters from the in-memory bitmap index with counting
+them in the database with a grouped query, as Product.facets() does when
+a filter the bitmaps cannot answer is given.
+
+Usage:
+    python -m benchmarks.facets --rows 10000,100000,1000000
+"""
+import sys
+import time
+import logging
+import argparse
+from decimal import Decimal
+
+# the benchmark database is chosen when query_plans is imported
+from benchmarks.query_plans import populate, reconnect
+from service import app
+from service.models import Product, Category
+
+PATHS = {
+    "bitmap": lambda: Product.facets(category=Category.FOOD, available=True),
+    "sql": lambda: Product.facets(category=Category.FOOD, available=True, min_price=Decimal("0")),
+}
+
+
+def timed(path, repeat: int = 5) -> tuple:
+    """Returns the best time in seconds to count the facets, and the counts"""
+    best = float("inf")
+    facets = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        facets = path()
+        best = min(best, time.perf_counter() - start)
+    return best, facets
+
+
+def main(argv=None):
+    """Prints the time to count the facets both ways at each number of rows"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000,1000000", help="comma separated numbers of products")
+    args = parser.parse_args(argv)
+    app.logger.setLevel(logging.WARNING)
+
+    print(f"{'rows':>8}{'path':>8}{'ms':>10}")
+    for count in (int(value) for value in args.rows.split(",")):
+        populate(count)
+        reconnect()
+        Product.load_indexes()
+        results = []
+        for name, path in PATHS.items():
+            elapsed, facets = timed(path)
+            results.append(facets)
+            print(f"{count:>8}{name:>8}{elapsed * 1000:>10.3f}")
+        if results[0] != results[1]:
+            print("the counts differ!")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
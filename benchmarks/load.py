@@ -0,0 +1,244 @@
+"""
+Load Generator
+
+Drives a running Product service with many concurrent clients. Each
+client is a thread with its own keep-alive session that sends a weighted
+mix of operations on products made by the ProductFactory of the tests:
+
+    create  POST /products
+    read    GET /products/<id>
+    list    GET /products?limit=<n>
+    update  PUT /products/<id>
+    delete  DELETE /products/<id>
+
+The products read, updated and deleted are picked from those seeded at
+the start with POST /products/batch and those created since. A read,
+update or delete of a product another client just deleted is counted as
+a miss rather than an error. The seeded and created products are removed
+with DELETE /products/batch at the end.
+
+It reports the throughput and the p50, p95 and p99 latency of each
+operation, and can save them as JSON.
+
+Usage:
+    python -m benchmarks.load --url http://localhost:8080 --clients 32 --duration 30 \\
+        --mix create=1,read=6,list=2,update=1,delete=1
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from tests.factories import ProductFactory
+
+OPERATIONS = ("create", "read", "list", "update", "delete")
+BATCH_SIZE = 1000
+
+
+def parse_mix(text: str) -> dict:
+    """Returns the weight of each operation from a list like create=1,read=6"""
+    mix = {}
+    for item in text.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in OPERATIONS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"Invalid operation weight: {item}")
+        mix[operation] = int(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("The mix needs at least one operation with a weight")
+    return mix
+
+
+def new_product() -> dict:
+    """Returns the body of a new Product"""
+    data = ProductFactory().serialize()
+    del data["id"]
+    return data
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Returns the sample below which a fraction of the sorted samples fall"""
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)] if samples else 0.0
+
+
+class ProductIds:
+    """The ids of the products the clients can read, update and delete"""
+
+    def __init__(self, ids: list):
+        self._lock = threading.Lock()
+        self._ids = list(ids)
+        self.all = set(ids)  # every id seeded or created, for the clean up
+
+    def add(self, product_id: int):
+        """Adds a product that was created"""
+        with self._lock:
+            self._ids.append(product_id)
+            self.all.add(product_id)
+
+    def pick(self):
+        """Returns a random product id, or None if there are none"""
+        with self._lock:
+            return random.choice(self._ids) if self._ids else None
+
+    def take(self):
+        """Removes a random product id so that no other client deletes it, or returns None"""
+        with self._lock:
+            if not self._ids:
+                return None
+            position = random.randrange(len(self._ids))
+            self._ids[position], self._ids[-1] = self._ids[-1], self._ids[position]
+            return self._ids.pop()
+
+
+class Client:
+    """Sends a mix of operations over one keep-alive session and records their latency"""
+
+    def __init__(self, url: str, ids: ProductIds, mix: dict, list_limit: int):
+        self.url = url
+        self.ids = ids
+        self.list_limit = list_limit
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.session = requests.Session()
+        self.session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.latencies = {operation: [] for operation in OPERATIONS}
+        self.errors = dict.fromkeys(OPERATIONS, 0)
+        self.misses = dict.fromkeys(OPERATIONS, 0)
+
+    def run(self, deadline: float, max_requests: int = None):
+        """Sends operations until the deadline or the number of requests is reached"""
+        sent = 0
+        with self.session:
+            while time.monotonic() < deadline and (max_requests is None or sent < max_requests):
+                self.send(random.choices(self.operations, self.weights)[0])
+                sent += 1
+        return self
+
+    def send(self, operation: str):
+        """Sends one operation and records its latency and outcome"""
+        product_id = None
+        if operation in ("read", "update"):
+            product_id = self.ids.pick()
+        elif operation == "delete":
+            product_id = self.ids.take()
+        if operation in ("read", "update", "delete") and product_id is None:
+            operation, product_id = "create", None  # nothing left to work on
+        start = time.perf_counter()
+        try:
+            response = self.request(operation, product_id)
+        except requests.RequestException:
+            self.errors[operation] += 1
+            return
+        self.latencies[operation].append((time.perf_counter() - start) * 1000)
+        if response.status_code == 404 and product_id is not None:
+            self.misses[operation] += 1
+        elif response.status_code >= 400:
+            self.errors[operation] += 1
+        elif operation == "create":
+            self.ids.add(response.json()["id"])
+
+    def request(self, operation: str, product_id: int = None):
+        """Returns the response of the service to one operation"""
+        products = f"{self.url}/products"
+        if operation == "create":
+            return self.session.post(products, json=new_product())
+        if operation == "read":
+            return self.session.get(f"{products}/{product_id}")
+        if operation == "list":
+            return self.session.get(products, params={"limit": self.list_limit})
+        if operation == "update":
+            return self.session.put(f"{products}/{product_id}", json=new_product())
+        return self.session.delete(f"{products}/{product_id}")
+
+
+def seed(session: requests.Session, url: str, count: int) -> list:
+    """Creates products with POST /products/batch and returns their ids"""
+    ids = []
+    for start in range(0, count, BATCH_SIZE):
+        body = [new_product() for _ in range(min(BATCH_SIZE, count - start))]
+        response = session.post(f"{url}/products/batch", json=body)
+        response.raise_for_status()
+        ids.extend(response.json()["ids"])
+    return ids
+
+
+def clean_up(session: requests.Session, url: str, ids: list):
+    """Deletes products with DELETE /products/batch"""
+    ids = sorted(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        session.delete(f"{url}/products/batch", json={"ids": ids[start:start + BATCH_SIZE]}).raise_for_status()
+
+
+def report(clients: list, elapsed: float) -> dict:
+    """Returns the throughput, latency percentiles, errors and misses of each operation"""
+    results = {}
+    for operation in OPERATIONS + ("total",):
+        if operation == "total":
+            operations = OPERATIONS
+        else:
+            operations = (operation,)
+        latencies = sorted(value for client in clients for name in operations for value in client.latencies[name])
+        errors = sum(client.errors[name] for client in clients for name in operations)
+        misses = sum(client.misses[name] for client in clients for name in operations)
+        if not latencies and not errors:
+            continue
+        results[operation] = {
+            "requests": len(latencies),
+            "throughput": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": latencies[-1] if latencies else 0.0,
+            "errors": errors,
+            "misses": misses,
+        }
+    return results
+
+
+def main(argv=None):
+    """Runs the clients against the service and prints what each operation cost"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8080", help="base url of the service")
+    parser.add_argument("--clients", type=int, default=16, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to send requests for")
+    parser.add_argument("--requests", type=int, help="requests sent by each client, instead of a duration")
+    parser.add_argument(
+        "--mix", type=parse_mix, default="create=1,read=6,list=2,update=1,delete=1", help="weight of each operation"
+    )
+    parser.add_argument("--seed", type=int, default=1000, help="products created before the clients start")
+    parser.add_argument("--list-limit", type=int, default=20, help="products per page of a list")
+    parser.add_argument("--keep", action="store_true", help="leave the products in the service")
+    parser.add_argument("--output", help="file to save the results to as JSON")
+    args = parser.parse_args(argv)
+    url = args.url.rstrip("/")
+
+    with requests.Session() as session:
+        ids = ProductIds(seed(session, url, args.seed))
+        clients = [Client(url, ids, args.mix, args.list_limit) for _ in range(args.clients)]
+        deadline = time.monotonic() + (args.duration if args.requests is None else float("inf"))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as pool:
+            list(pool.map(lambda client: client.run(deadline, args.requests), clients))
+        elapsed = time.perf_counter() - start
+        if not args.keep:
+            clean_up(session, url, ids.all)
+
+    results = report(clients, elapsed)
+    print(f"{args.clients} clients for {elapsed:.1f} s against {url}")
+    print(f"{'operation':<10}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'misses':>8}")
+    for operation, result in results.items():
+        print(
+            f"{operation:<10}{result['requests']:>9}{result['throughput']:>9.1f}{result['p50_ms']:>9.1f}"
+            f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['errors']:>8}{result['misses']:>8}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"clients": args.clients, "elapsed": elapsed, "mix": args.mix, "results": results}, file, indent=2)
+    return 1 if results.get("total", {}).get("errors") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
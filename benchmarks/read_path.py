@@ -0,0 +1,78 @@
+"""
+Read Path Benchmark
+
+Compares the cost per row of serving a product listing from Product
+instances, from plain rows of their columns, and from rows joined with
+the cached JSON encoding of each product, as GET /products does now.
+Every path produces the same JSON body.
+
+Usage:
+    python -m benchmarks.read_path --rows 1000,10000,100000
+"""
+import sys
+import time
+import logging
+import argparse
+
+# the benchmark database is chosen when query_plans is imported
+from benchmarks.query_plans import populate, reconnect
+from service import app
+from service.models import db, Product
+from service.indexes import fragment_cache
+from service.routes import encode_products
+
+
+def rows() -> list:
+    """Returns the rows of every product"""
+    return Product.sorted_by(Product.find_rows_by_filters(), "id").all()
+
+
+PATHS = {
+    "orm": lambda: app.json.dumps(
+        [product.serialize() for product in Product.sorted_by(Product.query, "id").all()], separators=(",", ":")
+    ),
+    "rows": lambda: app.json.dumps([Product.serialize_row(row) for row in rows()], separators=(",", ":")),
+    "cached": lambda: encode_products(rows()),
+}
+
+
+def timed(path, repeat: int = 3) -> tuple:
+    """Returns the best time in seconds to read and encode a listing, and the body
+
+    The first run fills the fragment cache, so the best time is a warm one
+    """
+    best = float("inf")
+    body = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = path()
+        best = min(best, time.perf_counter() - start)
+        db.session.expunge_all()
+    return best, body
+
+
+def main(argv=None):
+    """Prints the cost per row of both read paths at each number of rows"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1000,10000,100000", help="comma separated numbers of products")
+    args = parser.parse_args(argv)
+    app.logger.setLevel(logging.WARNING)
+    fragment_cache.configure(maxsize=max(int(value) for value in args.rows.split(",")))
+
+    print(f"{'rows':>8}{'path':>8}{'total ms':>10}{'us/row':>8}")
+    for count in (int(value) for value in args.rows.split(",")):
+        populate(count)
+        reconnect()
+        bodies = set()
+        for name, path in PATHS.items():
+            elapsed, body = timed(path)
+            bodies.add(body)
+            print(f"{count:>8}{name:>8}{elapsed * 1000:>10.1f}{elapsed / count * 1e6:>8.2f}")
+        if len(bodies) != 1:
+            print("the bodies differ!")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
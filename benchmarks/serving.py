@@ -0,0 +1,162 @@
+"""
+WSGI vs ASGI Serving Benchmark
+
+Serves the product API from the Flask (WSGI) app and from the async
+(ASGI) app side by side, adds an artificial latency to every query on the
+product table, and sends the same concurrent reads to both. A WSGI worker
+serves at most one request per thread, so its throughput stops growing at
+threads / latency. The ASGI app keeps taking requests while earlier ones
+wait on the database.
+
+The benchmark adds and removes its own products, so like the other
+benchmarks it uses a scratch SQLite database in the temporary directory
+and never the DATABASE_URI of the service. Set BENCHMARK_DATABASE_URI to
+run it on another database whose contents can be thrown away.
+
+Usage:
+    python -m benchmarks.serving --latency 20 --threads 4 --concurrency 1,8,32,64
+"""
+import os
+import sys
+import time
+import socket
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCRATCH_DATABASE_URI = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'benchmark.db')}"
+
+# The service reads the databases to use from the environment when it is
+# imported, and the ASGI app must reach the same one as the Flask app
+os.environ["DATABASE_URI"] = os.getenv("BENCHMARK_DATABASE_URI", SCRATCH_DATABASE_URI)
+os.environ.pop("ASYNC_DATABASE_URI", None)
+
+# pylint: disable=wrong-import-position
+import requests  # noqa: E402
+import uvicorn  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+from service import app  # noqa: E402
+from service.asgi import app as asgi_app, engine as async_engine  # noqa: E402
+from service.models import db, create_schema, Product  # noqa: E402
+from service.indexes import product_cache  # noqa: E402
+from tests.factories import ProductFactory  # noqa: E402
+
+
+def add_latency(engine, seconds: float):
+    """Makes every statement on the product table take at least seconds longer
+
+    The delay runs in the thread that executes the statement, which for
+    aiosqlite is the thread of the connection and not the event loop
+    """
+
+    def delay(sql):
+        if "product" in sql:
+            time.sleep(seconds)
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+        if hasattr(dbapi_connection, "run_async"):
+            dbapi_connection.run_async(lambda connection: connection.set_trace_callback(delay))
+        else:
+            dbapi_connection.set_trace_callback(delay)
+
+
+def limit_threads(wsgi_app, threads: int):
+    """Serves at most threads requests at a time like a gthread worker"""
+    semaphore = threading.BoundedSemaphore(threads)
+
+    def limited(environ, start_response):
+        with semaphore:
+            return list(wsgi_app(environ, start_response))
+
+    return limited
+
+
+def free_port() -> int:
+    """Returns a TCP port that nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_wsgi(threads: int) -> str:
+    """Starts the Flask app in a background thread and returns its url"""
+    port = free_port()
+    server = make_server("127.0.0.1", port, limit_threads(app, threads), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+def serve_asgi() -> str:
+    """Starts the ASGI app in a background thread and returns its url"""
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+def load(url: str, ids: list, concurrency: int, requests_per_client: int) -> tuple:
+    """Reads random products from concurrent clients
+
+    Returns the throughput in requests per second and the sorted latencies in ms
+    """
+    def client(_):
+        latencies = []
+        with requests.Session() as session:
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                session.get(f"{url}/products/{random.choice(ids)}").raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = sorted(value for result in pool.map(client, range(concurrency)) for value in result)
+    return len(latencies) / (time.perf_counter() - start), latencies
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Returns the sample below which a fraction of the sorted samples fall"""
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def main(argv=None):
+    """Prints the throughput and latency of both apps at each concurrency"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=20, help="milliseconds added to every query")
+    parser.add_argument("--threads", type=int, default=4, help="threads of the WSGI worker")
+    parser.add_argument("--concurrency", default="1,8,32,64", help="comma separated numbers of clients")
+    parser.add_argument("--requests", type=int, default=20, help="requests sent by each client")
+    args = parser.parse_args(argv)
+    app.logger.setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    product_cache.configure(enabled=False)  # every read must reach the database
+
+    create_schema()
+    ids = Product.create_many([ProductFactory() for _ in range(100)])
+    add_latency(db.engine, args.latency / 1000)
+    add_latency(async_engine.sync_engine, args.latency / 1000)
+    db.engine.dispose()
+    servers = {"wsgi": serve_wsgi(args.threads), "asgi": serve_asgi()}
+
+    print(f"{args.latency:g} ms per query, {args.threads} WSGI threads, {db.engine.dialect.name}")
+    print(f"{'app':<6}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        for name, url in servers.items():
+            throughput, latencies = load(url, ids, concurrency, args.requests)
+            print(
+                f"{name:<6}{concurrency:>8}{throughput:>10.1f}"
+                f"{percentile(latencies, 0.50):>10.1f}{percentile(latencies, 0.99):>10.1f}"
+            )
+    Product.delete_many(ids=ids)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Name Suggestion Benchmark
+
+Measures the latency of the prefix index behind GET /products/suggest
+for random prefixes typed against a large number of product names
+
+Usage:
+    python -m benchmarks.suggest --names 1000000
+"""
+import sys
+import time
+import random
+import string
+import argparse
+
+from service.common.prefix_index import PrefixIndex
+
+
+def random_name() -> str:
+    """Returns a name of one or two random words"""
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9))) for _ in range(random.randint(1, 2))]
+    return " ".join(words).title()
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Returns the sample below which a fraction of the sorted samples fall"""
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def main(argv=None):
+    """Prints the latency percentiles of suggest() and add()"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--names", type=int, default=1000000, help="number of names in the index")
+    parser.add_argument("--lookups", type=int, default=100000, help="number of suggestions to time")
+    args = parser.parse_args(argv)
+
+    names = [random_name() for _ in range(args.names)]
+    index = PrefixIndex()
+    start = time.perf_counter()
+    index.load(enumerate(names))
+    print(f"Loaded {args.names} names in {time.perf_counter() - start:.2f} s")
+
+    for label, operation in (
+        ("suggest", lambda: index.suggest(random.choice(names)[:random.randint(1, 4)], 10)),
+        ("add", lambda: index.add(random.randrange(args.names), random_name())),
+    ):
+        samples = []
+        for _ in range(args.lookups):
+            start = time.perf_counter()
+            operation()
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        print(
+            f"{label}: p50 {percentile(samples, 0.50):.4f} ms, p99 {percentile(samples, 0.99):.4f} ms, "
+            f"max {samples[-1]:.4f} ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,397 @@
+"""
+Benchmark Suite
+
+Times the Product model and every route of the service on a local SQLite
+database and saves the results as JSON, so that two versions of the
+service can be compared:
+
+    startup     importing the service, create_app(), loading the indexes and the
+                first request, each in a fresh interpreter at each number of rows
+    model       Product.serialize(), Product.deserialize() and
+                product_validator.validate_many()
+    finders     every find_* classmethod of Product at each number of rows
+    routes      every route of service/routes.py through the Flask test client
+
+Each benchmark is run until it has taken --min-time seconds, at least 3
+and at most 50 times after a warm up run, and reports the median and the
+fastest time per call. The read-through product cache is disabled while
+the finders are timed, so they measure the queries.
+
+Usage:
+    python -m benchmarks.suite run --rows 1000,100000,1000000 --output baseline.json
+    python -m benchmarks.suite run --rows 1000 --output current.json --baseline baseline.json
+    python -m benchmarks.suite compare baseline.json current.json --tolerance 0.25
+
+compare exits with 1 when a benchmark is slower than its baseline by more
+than the tolerance, so it can fail a CI job.
+"""
+import os
+import sys
+import json
+import time
+import random
+import inspect
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+from decimal import Decimal
+
+# the benchmark database is chosen when query_plans is imported
+from benchmarks.query_plans import populate, reconnect
+import sqlalchemy
+from sqlalchemy import select
+from service import app
+from service.models import db, Product, product_validator
+from service.indexes import product_cache
+from service.common.query_log import query_log
+from tests.factories import ProductFactory
+
+MIN_RUNS = 3
+MAX_RUNS = 50
+
+# Routes whose response grows with the table, which are only timed up to --unbounded-rows
+UNBOUNDED = "unbounded"
+
+
+def timed(function, min_time: float) -> dict:
+    """Returns the median and fastest time per call of a function in milliseconds"""
+    function()  # warm up
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < MIN_RUNS or (len(samples) < MAX_RUNS and time.perf_counter() < deadline):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(samples), "min_ms": min(samples), "runs": len(samples)}
+
+
+######################################################################
+# S T A R T U P
+######################################################################
+# Run in a fresh interpreter, prints the milliseconds each step of a cold start took
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import service.models
+imported = time.perf_counter()
+from service import create_app
+app = create_app()
+created = time.perf_counter()
+service.models.Product.load_indexes()
+loaded = time.perf_counter()
+app.test_client().get("/products", query_string={"limit": 20})
+served = time.perf_counter()
+print(json.dumps({
+    "import service.models": (imported - start) * 1000,
+    "create_app": (created - imported) * 1000,
+    "load_indexes": (loaded - created) * 1000,
+    "first request": (served - loaded) * 1000,
+    "cold start": (served - start) * 1000,
+}))
+"""
+
+
+def startup_benchmarks(runs: int) -> dict:
+    """Returns the median and fastest time of each step of a cold start, over fresh interpreters"""
+    samples = {}
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True, check=True,
+        ).stdout
+        for step, milliseconds in json.loads(output.splitlines()[-1]).items():
+            samples.setdefault(f"startup {step}", []).append(milliseconds)
+    return {
+        name: {"median_ms": statistics.median(values), "min_ms": min(values), "runs": len(values)}
+        for name, values in samples.items()
+    }
+
+
+######################################################################
+# M O D E L
+######################################################################
+def model_benchmarks() -> dict:
+    """Returns the functions timing the serialization of 1000 Products"""
+    products = ProductFactory.build_batch(1000)
+    for product_id, product in enumerate(products, start=1):
+        product.id = product_id
+    bodies = [product.serialize() for product in products]
+    return {
+        "model serialize x1000": lambda: [product.serialize() for product in products],
+        "model deserialize x1000": lambda: [Product().deserialize(data) for data in bodies],
+        "model validate_many x1000": lambda: product_validator.validate_many(bodies),
+    }
+
+
+######################################################################
+# F I N D E R S
+######################################################################
+# How to call each finder with the values of a sample Product
+FINDERS = {
+    "find": lambda sample: Product.find(sample.id),
+    "find_by_name": lambda sample: list(Product.find_by_name(sample.name)),
+    "find_by_price": lambda sample: list(Product.find_by_price(sample.price)),
+    "find_by_price_range": lambda sample: list(
+        Product.find_by_price_range(sample.price, sample.price + Decimal("1.00"))
+    ),
+    "find_by_availability": lambda sample: list(Product.find_by_availability(sample.available)),
+    "find_by_category": lambda sample: list(Product.find_by_category(sample.category)),
+    "find_by_filters": lambda sample: list(
+        Product.find_by_filters(name=sample.name, category=sample.category, available=sample.available)
+    ),
+    "find_rows_by_filters": lambda sample: Product.find_rows_by_filters(
+        name=sample.name, category=sample.category, available=sample.available
+    ).all(),
+}
+
+
+def finder_names() -> list:
+    """Returns the names of the find_* classmethods of Product"""
+    return sorted(name for name, _ in inspect.getmembers(Product, inspect.ismethod) if name.startswith("find"))
+
+
+def finder_benchmarks(sample: Product) -> dict:
+    """Returns the functions timing every finder"""
+
+    def call(finder):
+        def run():
+            finder(sample)
+            db.session.expunge_all()
+        return run
+
+    return {f"finder {name}": call(FINDERS[name]) for name in finder_names() if name in FINDERS}
+
+
+######################################################################
+# R O U T E S
+######################################################################
+class RouteContext:
+    """The sample Products the routes read and change"""
+
+    def __init__(self, sample: Product):
+        self.sample = sample
+        self.created = []  # ids for DELETE /products/<id>
+        self.batches = []  # lists of ids for DELETE /products/batch
+
+    def prepare_deletes(self):
+        """Creates the Products deleted by the DELETE routes"""
+        products = ProductFactory.build_batch((MAX_RUNS + 1) * 11)
+        ids = Product.create_many(products)
+        self.created = ids[:MAX_RUNS + 1]
+        self.batches = [ids[start:start + 10] for start in range(MAX_RUNS + 1, len(ids), 10)]
+
+
+def new_product() -> dict:
+    """Returns the body of a new Product"""
+    data = ProductFactory().serialize()
+    del data["id"]
+    return data
+
+
+# label, method, rule, request, and UNBOUNDED for the responses that grow with the table
+ROUTES = [
+    ("GET /health", "GET", "/health", lambda client, ctx: client.get("/health"), None),
+    ("GET /", "GET", "/", lambda client, ctx: client.get("/"), None),
+    ("GET /stats", "GET", "/stats", lambda client, ctx: client.get("/stats"), None),
+    ("GET /metrics", "GET", "/metrics", lambda client, ctx: client.get("/metrics"), None),
+    ("GET /admin/slow-queries", "GET", "/admin/slow-queries",
+     lambda client, ctx: client.get("/admin/slow-queries"), None),
+    ("DELETE /admin/slow-queries", "DELETE", "/admin/slow-queries",
+     lambda client, ctx: client.delete("/admin/slow-queries"), None),
+    ("GET /products?limit=100", "GET", "/products",
+     lambda client, ctx: client.get("/products", query_string={"limit": 100}), None),
+    ("GET /products?name&category&available", "GET", "/products",
+     lambda client, ctx: client.get("/products", query_string={
+         "name": ctx.sample.name, "category": ctx.sample.category.name, "available": "true", "limit": 100,
+     }), None),
+    ("GET /products", "GET", "/products", lambda client, ctx: client.get("/products"), UNBOUNDED),
+    ("GET /products?stream=1", "GET", "/products",
+     lambda client, ctx: client.get("/products", query_string={"stream": 1}).get_data(), UNBOUNDED),
+    ("POST /products", "POST", "/products", lambda client, ctx: client.post("/products", json=new_product()), None),
+    ("GET /products/search", "GET", "/products/search",
+     lambda client, ctx: client.get("/products/search", query_string={"q": ctx.sample.name}), None),
+    ("GET /products/suggest", "GET", "/products/suggest",
+     lambda client, ctx: client.get("/products/suggest", query_string={"prefix": ctx.sample.name[:2]}), None),
+    ("GET /products/facets", "GET", "/products/facets",
+     lambda client, ctx: client.get("/products/facets", query_string={"category": "food", "available": "true"}), None),
+    ("GET /products/<id>", "GET", "/products/<int:product_id>",
+     lambda client, ctx: client.get(f"/products/{ctx.sample.id}"), None),
+    ("PUT /products/<id>", "PUT", "/products/<int:product_id>",
+     lambda client, ctx: client.put(f"/products/{ctx.sample.id}", json=ctx.sample.serialize()), None),
+    ("POST /products/batch", "POST", "/products/batch",
+     lambda client, ctx: client.post("/products/batch", json=[new_product() for _ in range(10)]), None),
+    ("PATCH /products/batch", "PATCH", "/products/batch",
+     lambda client, ctx: client.patch("/products/batch", json={
+         "ids": ctx.batches[0], "changes": {"available": True},
+     }), None),
+    ("DELETE /products/<id>", "DELETE", "/products/<int:product_id>",
+     lambda client, ctx: client.delete(f"/products/{ctx.created.pop()}"), None),
+    ("DELETE /products/batch", "DELETE", "/products/batch",
+     lambda client, ctx: client.delete("/products/batch", json={"ids": ctx.batches.pop()}), None),
+]
+
+
+def route_keys() -> set:
+    """Returns the (method, rule) of every route of the service"""
+    return {
+        (method, rule.rule)
+        for rule in app.url_map.iter_rules()
+        if rule.endpoint != "static"
+        for method in rule.methods - {"HEAD", "OPTIONS"}
+    }
+
+
+def route_benchmarks(sample: Product, rows: int, unbounded_rows: int) -> dict:
+    """Returns the functions timing every route, the DELETE routes last"""
+    client = app.test_client()
+    context = RouteContext(sample)
+    context.prepare_deletes()
+    benchmarks = {}
+    for label, _, _, call, kind in ROUTES:
+        if kind == UNBOUNDED and rows > unbounded_rows:
+            continue
+
+        def run(call=call):
+            response = call(client, context)
+            if hasattr(response, "status_code") and response.status_code >= 400:
+                raise RuntimeError(f"{response.status_code} {response.get_data(as_text=True)}")
+
+        benchmarks[f"route {label}"] = run
+    return benchmarks
+
+
+######################################################################
+# R U N   A N D   C O M P A R E
+######################################################################
+def sample_product() -> Product:
+    """Returns a Product from the middle of the table"""
+    count = db.session.scalar(select(sqlalchemy.func.count()).select_from(Product))
+    return db.session.scalars(select(Product).order_by(Product.id).offset(count // 2).limit(1)).one()
+
+
+def add_result(results: dict, name: str, result: dict):
+    """Adds the result of a benchmark and prints it"""
+    results[name] = result
+    print(f"{name:<60}{result['median_ms']:>12.3f} ms{result['runs']:>6} runs", flush=True)
+
+
+def run_benchmarks(benchmarks: dict, suffix: str, min_time: float, results: dict):
+    """Times each benchmark and adds its result under its name and the suffix"""
+    for name, function in benchmarks.items():
+        add_result(results, f"{name}{suffix}", timed(function, min_time))
+
+
+def run(args) -> int:
+    """Runs the whole suite, saves the results and compares them with a baseline"""
+    app.logger.setLevel(logging.WARNING)
+    query_log.configure(threshold=float("inf"))
+    random.seed(0)
+    sizes = [int(value) for value in args.rows.split(",")]
+    results = {}
+    run_benchmarks(model_benchmarks(), "", args.min_time, results)
+
+    skipped = [f"finder {name}" for name in finder_names() if name not in FINDERS]
+    skipped += [f"route {method} {rule}" for method, rule in sorted(route_keys() - {r[1:3] for r in ROUTES})]
+    for rows in sizes:
+        print(f"Populating {rows} products...", flush=True)
+        populate(rows)
+        reconnect()
+        for name, result in startup_benchmarks(args.startup_runs).items():
+            add_result(results, f"{name} @{rows}", result)
+        Product.load_indexes()
+        sample = sample_product()
+        product_cache.configure(enabled=False)
+        run_benchmarks(finder_benchmarks(sample), f" @{rows}", args.min_time, results)
+        product_cache.configure(enabled=app.config["PRODUCT_CACHE_ENABLED"])
+        run_benchmarks(route_benchmarks(sample, rows, args.unbounded_rows), f" @{rows}", args.min_time, results)
+    for name in skipped:
+        print(f"{name:<60}{'no benchmark':>15}")
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "database": db.engine.dialect.name,
+            "platform": platform.platform(),
+            "rows": sizes,
+            "min_time": args.min_time,
+            "skipped": skipped,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+        print(f"Results saved to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            return compare_reports(json.load(file), report, args.tolerance, args.min_delta)
+    return 0
+
+
+def compare_reports(baseline: dict, current: dict, tolerance: float, min_delta: float) -> int:
+    """Prints the change of every benchmark in both reports and returns 1 if any regressed
+
+    A benchmark regressed when its median is more than tolerance slower
+    than its baseline and by more than min_delta milliseconds, so that
+    noise on sub-millisecond timings is not flagged
+    """
+    regressions = 0
+    print(f"{'benchmark':<60}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        before = baseline["results"].get(name)
+        after = current["results"].get(name)
+        if before is None or after is None:
+            print(f"{name:<60}{'only in ' + ('current' if before is None else 'baseline'):>33}")
+            continue
+        change = after["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+        regressed = change > tolerance and after["median_ms"] - before["median_ms"] > min_delta
+        regressions += regressed
+        print(
+            f"{name:<60}{before['median_ms']:>12.3f}{after['median_ms']:>12.3f}{change:>+9.1%}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    print(f"{regressions} regressions beyond {tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+def compare(args) -> int:
+    """Compares two saved reports"""
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    with open(args.current, encoding="utf-8") as file:
+        current = json.load(file)
+    return compare_reports(baseline, current, args.tolerance, args.min_delta)
+
+
+def main(argv=None):
+    """Runs the suite or compares two of its reports"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="time the model, finders and routes")
+    run_parser.add_argument("--rows", default="1000,100000,1000000", help="comma separated numbers of products")
+    run_parser.add_argument("--min-time", type=float, default=0.2, help="seconds to spend on each benchmark")
+    run_parser.add_argument("--startup-runs", type=int, default=5, help="fresh interpreters timed at each number of rows")
+    run_parser.add_argument(
+        "--unbounded-rows", type=int, default=100000, help="largest table to time the unpaginated listings on"
+    )
+    run_parser.add_argument("--output", help="file to save the results to as JSON")
+    run_parser.add_argument("--baseline", help="saved results to compare this run with")
+    run_parser.set_defaults(handler=run)
+    compare_parser = commands.add_parser("compare", help="compare two saved results")
+    compare_parser.add_argument("baseline", help="the saved results to compare against")
+    compare_parser.add_argument("current", help="the saved results to check")
+    compare_parser.set_defaults(handler=compare)
+    for command in (run_parser, compare_parser):
+        command.add_argument("--tolerance", type=float, default=0.25, help="slowdown flagged as a regression")
+        command.add_argument("--min-delta", type=float, default=0.05, help="smallest slowdown in ms flagged")
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Validation Benchmark
+
+Compares the previous Product.deserialize, which set each field as it
+checked it and stopped at the first error, with the table driven
+product_validator on batches of payloads like those of POST
+/products/batch: all valid, and with one bad field in every tenth item
+
+Usage:
+    python -m benchmarks.validation --items 10000
+"""
+import sys
+import time
+import argparse
+import statistics
+from decimal import Decimal
+from service.models import Product, Category, DataValidationError, product_validator
+from tests.factories import ProductFactory
+
+
+def previous_deserialize(product: Product, data: dict) -> Product:
+    """Product.deserialize as it was before product_validator"""
+    try:
+        product.name = data["name"]
+        if not isinstance(product.name, str):
+            raise DataValidationError("Invalid type for string [name]: " + str(type(product.name)))
+        product.description = data["description"]
+        product.price = Decimal(data["price"])
+        if isinstance(data["available"], bool):
+            product.available = data["available"]
+        else:
+            raise DataValidationError("Invalid type for boolean [available]: " + str(type(data["available"])))
+        product.category = getattr(Category, data["category"])
+    except AttributeError as error:
+        raise DataValidationError("Invalid attribute: " + error.args[0]) from error
+    except KeyError as error:
+        raise DataValidationError("Invalid product: missing " + error.args[0]) from error
+    except TypeError as error:
+        raise DataValidationError("Invalid product: body of request contained bad or no data " + str(error)) from error
+    return product
+
+
+def previous_batch(items: list) -> tuple:
+    """Checks a batch the way POST /products/batch did, one Product at a time"""
+    products = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            products.append(previous_deserialize(Product(), item))
+        except DataValidationError as error:
+            errors.append({"index": index, "message": str(error)})
+    return products, errors
+
+
+def current_batch(items: list) -> tuple:
+    """Checks a batch with Product.deserialize, one Product at a time"""
+    products = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            products.append(Product().deserialize(item))
+        except DataValidationError as error:
+            errors.append({"index": index, "message": str(error)})
+    return products, errors
+
+
+def best_of(function, repeat: int) -> float:
+    """Returns the median time of a function in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    """Prints the time each path takes to check the batches"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=10000, help="payloads per batch")
+    parser.add_argument("--repeat", type=int, default=5, help="times each path is run")
+    args = parser.parse_args(argv)
+
+    valid = [ProductFactory().serialize() for _ in range(args.items)]
+    for item in valid:
+        del item["id"]
+    invalid = [dict(item) for item in valid]
+    for item in invalid[::10]:
+        item["available"] = "yes"
+
+    print(f"{'path':<40}{'valid ms':>12}{'10% bad ms':>12}")
+    for label, function in (
+        ("previous deserialize, per item", previous_batch),
+        ("Product.deserialize, per item", current_batch),
+        ("product_validator.validate_many", product_validator.validate_many),
+    ):
+        times = [best_of(lambda items=items, function=function: function(items), args.repeat) for items in (valid, invalid)]
+        print(f"{label:<40}{times[0]:>12.1f}{times[1]:>12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
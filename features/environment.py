@@ -2,6 +2,7 @@
 Environment for Behave Testing
 """
 from os import getenv
+import requests
 from selenium import webdriver
 import logging
 
@@ -13,6 +14,7 @@ DRIVER = getenv('DRIVER', 'firefox').lower()
 def before_all(context):
     """ Executed once before all tests """
     context.base_url = BASE_URL
+    context.session = requests.Session()  # keeps the connection to the service alive
     context.wait_seconds = WAIT_SECONDS
     if 'firefox' in DRIVER:
         context.driver = get_firefox()
@@ -24,6 +26,7 @@ def before_all(context):
 
 def after_all(context):
     """ Executed once after all tests """
+    context.session.close()
     logging.info("Closing the browser...")
     context.driver.quit()
     logging.info("Browser closed.")
@@ -20,7 +20,6 @@ Load Steps for Products
 This file includes step definitions for testing the products API.
 """
 
-import requests
 from behave import given, when, then
 
 # HTTP Return Codes
@@ -29,54 +28,55 @@ HTTP_201_CREATED = 201
 HTTP_204_NO_CONTENT = 204
 HTTP_404_NOT_FOUND = 404
 
+
+def service_id(context, product_id: str) -> int:
+    """Returns the id the service gave the product with an id in a table of the feature"""
+    return getattr(context, "ids", {}).get(product_id, int(product_id))
+
+
 @given('the product database is empty')
 def step_impl(context):
-    """Ensure the product database is empty."""
-    rest_endpoint = f"{context.base_url}/products"
-    context.resp = requests.get(rest_endpoint)
-    assert context.resp.status_code == HTTP_200_OK
-    for product in context.resp.json():
-        context.resp = requests.delete(f"{rest_endpoint}/{product['id']}")
-        assert context.resp.status_code == HTTP_204_NO_CONTENT
+    """Remove every Product at once. The service needs RESET_ENABLED"""
+    context.resp = context.session.post(f"{context.base_url}/admin/reset")
+    assert context.resp.status_code == HTTP_204_NO_CONTENT
 
 
 @given('the following products')
 def step_impl(context):
-    """Delete all Products and load new ones"""
-    rest_endpoint = f"{context.base_url}/products"
-    context.resp = requests.get(rest_endpoint)
-    assert context.resp.status_code == HTTP_200_OK
-
-    for product in context.resp.json():
-        context.resp = requests.delete(f"{rest_endpoint}/{product['id']}")
-        assert context.resp.status_code == HTTP_204_NO_CONTENT
+    """Remove all Products and load new ones with a single batch request"""
+    context.resp = context.session.post(f"{context.base_url}/admin/reset")
+    assert context.resp.status_code == HTTP_204_NO_CONTENT
 
-    # Load the database with new products
-    for row in context.table:
-        payload = {
-            "id": int(row['id']) if 'id' in row.headings else None,  # Handle missing 'id'
+    payload = [
+        {
             "name": row['name'],
             "description": row['description'],
             "price": float(row['price']),
             "available": row['available'].lower() == "true",
             "category": row['category'],
         }
-        if not payload['id']:  # Remove 'id' if it's None to avoid conflicts
-            del payload['id']
-        context.resp = requests.post(rest_endpoint, json=payload)
-        assert context.resp.status_code == HTTP_201_CREATED
+        for row in context.table
+    ]
+    context.resp = context.session.post(f"{context.base_url}/products/batch", json=payload)
+    assert context.resp.status_code == HTTP_201_CREATED
+    # The ids are not reused after the reset, so the ids of the table are
+    # mapped to the ones the service gave, in the order of the table
+    ids = context.resp.json()["ids"]
+    assert len(ids) == len(context.table.rows)
+    if 'id' in context.table.headings:
+        context.ids = {row['id']: product_id for row, product_id in zip(context.table, ids)}
 
 
 @then('the following products should exist')
 def step_impl(context):
     """Verify that the specified products exist in the database."""
     rest_endpoint = f"{context.base_url}/products"
-    context.resp = requests.get(rest_endpoint)
+    context.resp = context.session.get(rest_endpoint)
     assert context.resp.status_code == HTTP_200_OK
 
     products = {product["id"]: product for product in context.resp.json()}
     for row in context.table:
-        product_id = int(row['id'])
+        product_id = service_id(context, row['id'])
         assert product_id in products
         product = products[product_id]
         assert product["name"] == row["name"]
@@ -89,29 +89,29 @@ def step_impl(context):
 @when('I update the product with id "{product_id}" to have price "{price}"')
 def step_impl(context, product_id, price):
     """Update the price of a product."""
-    rest_endpoint = f"{context.base_url}/products/{product_id}"
-    context.resp = requests.get(rest_endpoint)
+    rest_endpoint = f"{context.base_url}/products/{service_id(context, product_id)}"
+    context.resp = context.session.get(rest_endpoint)
     assert context.resp.status_code == HTTP_200_OK
 
     product = context.resp.json()
     product["price"] = float(price)
-    context.resp = requests.put(rest_endpoint, json=product)
+    context.resp = context.session.put(rest_endpoint, json=product)
     assert context.resp.status_code == HTTP_200_OK
 
 
 @when('I delete the product with id "{product_id}"')
 def step_impl(context, product_id):
     """Delete a product by ID."""
-    rest_endpoint = f"{context.base_url}/products/{product_id}"
-    context.resp = requests.delete(rest_endpoint)
+    rest_endpoint = f"{context.base_url}/products/{service_id(context, product_id)}"
+    context.resp = context.session.delete(rest_endpoint)
     assert context.resp.status_code == HTTP_204_NO_CONTENT
 
 
 @then('the product with id "{product_id}" should not exist')
 def step_impl(context, product_id):
     """Ensure a product no longer exists."""
-    rest_endpoint = f"{context.base_url}/products/{product_id}"
-    context.resp = requests.get(rest_endpoint)
+    rest_endpoint = f"{context.base_url}/products/{service_id(context, product_id)}"
+    context.resp = context.session.get(rest_endpoint)
     assert context.resp.status_code == HTTP_404_NOT_FOUND
 
 
@@ -119,7 +119,7 @@ def step_impl(context, product_id):
 def step_impl(context, name):
     """Search for a product by name."""
     rest_endpoint = f"{context.base_url}/products?name={name}"
-    context.resp = requests.get(rest_endpoint)
+    context.resp = context.session.get(rest_endpoint)
     assert context.resp.status_code == HTTP_200_OK
     context.searched_products = context.resp.json()
 
@@ -18,41 +18,83 @@
 Package: service
 
 Package for the application models and service routes
-This module creates and configures the Flask app and sets up the logging
-and SQL database
+This module creates and configures the Flask app in create_app() and sets
+up the logging and SQL database. The app is made the first time that
+service.app is used, so importing a module of the package, such as its
+config or metrics, does not import Flask nor connect to the database.
+Creating the tables is a separate step, see create_schema() in models.
 """
 import sys
-from flask import Flask
+import time
 from service import config
-from service.common import log_handlers
 
-# NOTE: Do not change the order of this code
-# The Flask app must be created
-# BEFORE you import modules that depend on it !!!
+# Seconds create_app() took, for the benchmarks
+startup = {}
 
-# Create the Flask aoo
-app = Flask(__name__)  # pylint: disable=invalid-name
+# The modules that register themselves on the app when they are imported
+APP_MODULES = ("service.routes", "service.common.error_handlers", "service.common.cli_commands")
 
-# Load Configurations
-app.config.from_object(config)
 
-# Dependencies require we import the routes AFTER the Flask app is created
-# pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
-from service import routes, models        # noqa: F401, E402
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+def create_app():
+    """Creates the Flask app, then registers its routes, error handlers and commands
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+    The routes register themselves on service.app when they are imported,
+    so there is a single app per process and later calls return it. No
+    statement is sent to the database. If the app cannot be set up,
+    service.app is not left half made and the next call starts over.
+    """
+    if "app" in globals():
+        return globals()["app"]
+    start = time.perf_counter()
+    # pylint: disable=import-outside-toplevel, cyclic-import, global-variable-undefined, invalid-name
+    from flask import Flask
 
-app.logger.info(70 * "*")
-app.logger.info("  P E T   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+    # NOTE: Do not change the order of this code
+    # The Flask app must be created
+    # BEFORE you import modules that depend on it !!!
+    global app
+    app = Flask(__name__)
+    app.config.from_object(config)
 
-try:
-    models.init_db(app)  # make our sqlalchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+    try:
+        # Dependencies require we import the routes AFTER the Flask app is created
+        from service import routes, models  # noqa: F401
+        from service.common import error_handlers, cli_commands, log_handlers  # noqa: F401
 
-app.logger.info("Service initialized!")
+        # Set up logging for production
+        log_handlers.init_logging(app, "gunicorn.error")
+
+        app.logger.info(70 * "*")
+        app.logger.info("  P E T   S E R V I C E   R U N N I N G  ".center(70, "*"))
+        app.logger.info(70 * "*")
+
+        try:
+            models.init_db(app)  # connect sqlalchemy, the tables are made by create_schema()
+        except Exception as error:  # pylint: disable=broad-except
+            app.logger.critical("%s: Cannot continue", error)
+            # gunicorn requires exit code 4 to stop spawning workers when they die
+            sys.exit(4)
+    except BaseException:
+        forget_app()
+        raise
+
+    startup["create_app"] = time.perf_counter() - start
+    app.logger.info("Service initialized!")
+    return app
+
+
+def forget_app():
+    """Forgets a half made app and the modules that registered on it, so create_app() can start over"""
+    globals().pop("app", None)
+    for name in APP_MODULES:
+        sys.modules.pop(name, None)
+        package, _, module = name.rpartition(".")
+        if hasattr(sys.modules.get(package), module):
+            delattr(sys.modules[package], module)
+
+
+def __getattr__(name: str):
+    """Creates the app the first time service.app is used"""
+    if name == "app":
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,315 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Product Store Service over ASGI
+
+Serves the /products API with async handlers over an async SQLAlchemy
+engine, so a worker keeps serving other requests while one waits on the
+database. It shares the Product model, its validation and its write
+listeners with the Flask app, which still creates the tables.
+
+Run it with:
+
+    uvicorn service.asgi:app --host 0.0.0.0 --port 8080 --workers 4
+"""
+import json
+import contextlib
+import logging
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+from service import config
+from service.common import status  # HTTP Status Codes
+from service.common.query_args import parse_filters, parse_page_limit
+from service.models import Product, DataValidationError, notify_write
+
+logger = logging.getLogger("flask.app")
+
+# The async driver to use for each database backend
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+JSON_MIMETYPE = "application/json"
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def async_database_uri(uri: str) -> str:
+    """Returns a database URI that uses the async driver of its backend"""
+    url = make_url(uri)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+DATABASE_URI = config.ASYNC_DATABASE_URI or async_database_uri(config.DATABASE_URI)
+engine = create_async_engine(DATABASE_URI, **config.engine_options(DATABASE_URI))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+
+def encode(content) -> str:
+    """Returns content encoded as JSON the way the Flask app encodes it"""
+    return json.dumps(content, sort_keys=True, separators=(",", ":"))
+
+
+class JSON(JSONResponse):
+    """A JSON response encoded the way the Flask app encodes it"""
+
+    def render(self, content) -> bytes:
+        return encode(content).encode("utf-8") + b"\n"
+
+
+############################################################
+# U T I L I T Y   F U N C T I O N S
+############################################################
+def abort(status_code: int, message: str):
+    """Stops the request with an HTTP error"""
+    raise HTTPException(status_code, message)
+
+
+def check_content_type(request: Request, content_type: str):
+    """Checks that the media type is correct"""
+    if request.headers.get("Content-Type") != content_type:
+        logger.error("Invalid Content-Type: %s", request.headers.get("Content-Type"))
+        abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type must be {content_type}")
+
+
+async def get_json(request: Request):
+    """Returns the JSON body of a request"""
+    check_content_type(request, "application/json")
+    try:
+        return await request.json()
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "The body of the request is not valid JSON")
+    return None
+
+
+def not_modified(request: Request, etag: str):
+    """Returns a 304_NOT_MODIFIED response if the client already has this entity tag"""
+    if parse_etags(request.headers.get("If-None-Match")).contains_weak(etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": f'"{etag}"'})
+    return None
+
+
+def best_mimetype(request: Request) -> str:
+    """Returns the listing media type the client prefers"""
+    accept = parse_accept_header(request.headers.get("Accept"), MIMEAccept)
+    return accept.best_match([JSON_MIMETYPE, NDJSON_MIMETYPE])
+
+
+def not_found(product_id: int):
+    """Stops the request because a Product does not exist"""
+    abort(status.HTTP_404_NOT_FOUND, f"Product with id {product_id} was not found.")
+
+
+############################################################
+# H E A L T H   C H E C K
+############################################################
+async def healthcheck(request: Request):  # pylint: disable=unused-argument
+    """Let them know our heart is still beating"""
+    return JSON({"status": 200, "message": "OK"}, status.HTTP_200_OK)
+
+
+############################################################
+# L I S T   A L L   P R O D U C T S
+############################################################
+async def list_products(request: Request):
+    """Returns the Products matching every filter in the query string
+
+    It answers the same arguments as the Flask app: a limit or a cursor
+    returns one page with the links to the next and previous pages in the
+    Link header, stream=1 or asking for application/x-ndjson streams every
+    result, and other listings have an ETag.
+    """
+    args = request.query_params
+    sort = args.get("sort", "id")
+    statement = Product.select_rows_where(**parse_filters(args))
+    Product.sort_keys(sort)  # raises DataValidationError if the sort is not valid
+
+    if args.get("stream", "").lower() in ("1", "true") or best_mimetype(request) == NDJSON_MIMETYPE:
+        return stream_products(request, Product.sorted_by(statement, sort))
+
+    headers = {}
+    if "limit" in args or "cursor" in args:
+        limit = parse_page_limit(args, config.PAGE_SIZE_DEFAULT, config.PAGE_SIZE_MAX)
+        statement, direction = Product.page_query(statement, limit, args.get("cursor"), sort)
+        async with Session() as session:
+            rows = (await session.execute(statement)).all()
+        rows, next_cursor, prev_cursor = Product.page_of(rows, limit, args.get("cursor"), sort, direction)
+        links = []
+        if next_cursor:
+            links.append(f'<{request.url.include_query_params(limit=limit, cursor=next_cursor)}>; rel="next"')
+        if prev_cursor:
+            links.append(f'<{request.url.include_query_params(limit=limit, cursor=prev_cursor)}>; rel="prev"')
+        if links:
+            headers["Link"] = ", ".join(links)
+    else:
+        async with Session() as session:
+            rows = (await session.execute(Product.sorted_by(statement, sort))).all()
+
+    etag = Product.etag_of(rows)
+    response = not_modified(request, etag)
+    if response is None:
+        response = JSON([Product.serialize_row(row) for row in rows], status.HTTP_200_OK)
+        response.headers["ETag"] = f'"{etag}"'
+    response.headers.update(headers)
+    return response
+
+
+def stream_products(request: Request, statement) -> StreamingResponse:
+    """Streams the rows of a select as NDJSON or as a JSON array, one chunk of rows at a time"""
+    chunk_size = config.STREAM_CHUNK_SIZE
+    ndjson = best_mimetype(request) == NDJSON_MIMETYPE
+
+    async def generate():
+        if not ndjson:
+            yield "["
+        count = 0
+        async with Session() as session:
+            result = await session.stream(statement.execution_options(yield_per=chunk_size))
+            async for rows in result.partitions():
+                lines = []
+                for row in rows:
+                    encoded = encode(Product.serialize_row(row))
+                    if ndjson:
+                        lines.append(encoded + "\n")
+                    else:
+                        lines.append("," + encoded if count else encoded)
+                    count += 1
+                yield "".join(lines)
+        if not ndjson:
+            yield "]\n"
+
+    return StreamingResponse(generate(), media_type=NDJSON_MIMETYPE if ndjson else JSON_MIMETYPE)
+
+
+############################################################
+# C R E A T E   A   N E W   P R O D U C T
+############################################################
+async def create_products(request: Request):
+    """Creates a Product from the data in the body"""
+    product = Product().deserialize(await get_json(request))
+    async with Session() as session:
+        session.add(product)
+        await session.flush()
+        values = product.values()
+        await session.commit()
+    notify_write(changed={product.id: values})
+    logger.info("Product with new id [%s] saved!", product.id)
+    location_url = str(request.url_for("read_products", product_id=product.id))
+    return JSON(product.serialize(), status.HTTP_201_CREATED, headers={"Location": location_url})
+
+
+############################################################
+# R E A D   A   P R O D U C T
+############################################################
+async def read_products(request: Request):
+    """Returns a single Product by id"""
+    product_id = request.path_params["product_id"]
+    async with Session() as session:
+        product = await session.get(Product, product_id)
+    if not product:
+        not_found(product_id)
+    return not_modified(request, product.etag) or JSON(
+        product.serialize(), status.HTTP_200_OK, headers={"ETag": f'"{product.etag}"'}
+    )
+
+
+############################################################
+# U P D A T E   A N   E X I S T I N G   P R O D U C T
+############################################################
+async def update_products(request: Request):
+    """Replaces the fields of a Product with the data in the body"""
+    product_id = request.path_params["product_id"]
+    data = await get_json(request)
+    async with Session() as session:
+        product = await session.get(Product, product_id)
+        if not product:
+            not_found(product_id)
+        product.deserialize(data)
+        values = product.values()
+        product.version = Product.version + 1
+        try:
+            await session.commit()
+        except StaleDataError:
+            # another request deleted it since it was found
+            await session.rollback()
+            not_found(product_id)
+        await session.refresh(product)
+    notify_write(changed={product_id: values})
+    return JSON(product.serialize(), status.HTTP_200_OK, headers={"ETag": f'"{product.etag}"'})
+
+
+############################################################
+# D E L E T E   A   P R O D U C T
+############################################################
+async def delete_products(request: Request):
+    """Deletes a Product"""
+    product_id = request.path_params["product_id"]
+    async with Session() as session:
+        product = await session.get(Product, product_id)
+        if not product:
+            not_found(product_id)
+        await session.delete(product)
+        await session.commit()
+    notify_write(deleted=[product_id])
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+############################################################
+# E R R O R   H A N D L E R S
+############################################################
+async def http_error(request: Request, error: HTTPException):  # pylint: disable=unused-argument
+    """Returns HTTP errors in the same JSON body as the Flask app"""
+    phrase = {
+        status.HTTP_400_BAD_REQUEST: "Bad Request",
+        status.HTTP_404_NOT_FOUND: "Not Found",
+        status.HTTP_405_METHOD_NOT_ALLOWED: "Method not Allowed",
+        status.HTTP_415_UNSUPPORTED_MEDIA_TYPE: "Unsupported media type",
+    }.get(error.status_code, "Error")
+    logger.warning(error.detail)
+    return JSON({"status": error.status_code, "error": phrase, "message": error.detail}, error.status_code)
+
+
+async def validation_error(request: Request, error: DataValidationError):
+    """Handles bad data with 400_BAD_REQUEST"""
+    return await http_error(request, HTTPException(status.HTTP_400_BAD_REQUEST, str(error)))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):  # pylint: disable=unused-argument,redefined-outer-name
+    """Closes the connections of the engine when the server stops"""
+    yield
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/health", healthcheck, methods=["GET"]),
+        Route("/products", list_products, methods=["GET"]),
+        Route("/products", create_products, methods=["POST"]),
+        Route("/products/{product_id:int}", read_products, methods=["GET"]),
+        Route("/products/{product_id:int}", update_products, methods=["PUT"]),
+        Route("/products/{product_id:int}", delete_products, methods=["DELETE"]),
+    ],
+    exception_handlers={HTTPException: http_error, DataValidationError: validation_error},
+    lifespan=lifespan,
+)
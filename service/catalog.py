@@ -0,0 +1,150 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Catalog Lookups
+
+This module answers the find_by_* lookups of Products from the catalog
+snapshot of service.common.catalog, kept in memory by each process. The
+writes of this process are applied to it right away through a write
+listener, and the writes of other workers at the next sync, see
+CatalogMixin.sync_catalog().
+"""
+import logging
+from sqlalchemy import select
+from service.common.catalog import Catalog
+from service.database import db, on_write
+from service.indexes import update_product_cache
+
+logger = logging.getLogger("flask.app")
+
+# Columnar snapshot of the Products that answers the find_by_* lookups
+catalog = Catalog()
+
+# The most ids of catalog matches read with a single IN (...), which SQLite
+# also bounds with the number of parameters of a statement
+CATALOG_ID_LOOKUP_MAX = 500
+
+
+class ProductList(list):
+    """A list of Products that can also be counted like a query"""
+
+    def count(self, *args):  # pylint: disable=arguments-differ
+        """Returns the number of Products, or of occurrences of a value like list.count()"""
+        return super().count(*args) if args else len(self)
+
+
+class CatalogMixin:
+    """Keeps the catalog snapshot of a model in sync and finds its rows through it"""
+
+    @classmethod
+    def catalog_columns(cls) -> list:
+        """Returns the columns kept in the catalog snapshot, in the order of its records"""
+        return [cls.id, cls.name, cls.price, cls.available, cls.category, cls.version]
+
+    @classmethod
+    def _catalog_records(cls, statement):
+        """Yields the catalog records of the rows of a select of the catalog columns"""
+        for row in db.session.execute(statement):
+            yield (row.id, row.name, row.price, row.available, row.category.value, row.version)
+
+    @classmethod
+    def load_catalog(cls):
+        """Reads the whole catalog snapshot from the database if it is enabled"""
+        if catalog.enabled:
+            catalog.load(cls._catalog_records(select(*cls.catalog_columns())), cls._fingerprint())
+
+    @classmethod
+    def sync_catalog(cls, force: bool = False):
+        """Brings the catalog snapshot up to date once it is older than its staleness bound
+
+        A single aggregate query tells whether anything changed since the
+        last sync. Only then are the ids and versions of the products
+        compared with the snapshot, and just the new and changed rows read.
+        """
+        if not (force or catalog.is_stale()):
+            return
+        lock = catalog.sync_lock()
+        # while another thread syncs, serve the snapshot there is unless there is none
+        if not lock.acquire(blocking=catalog.synced_at is None):
+            return
+        try:
+            fingerprint = cls._fingerprint()
+            if catalog.synced_at is None:
+                # never loaded, as load_indexes is not run when the app is created
+                logger.info("Loading catalog")
+                catalog.load(cls._catalog_records(select(*cls.catalog_columns())), fingerprint)
+            elif fingerprint != catalog.fingerprint:
+                changed, deleted = catalog.diff(db.session.execute(select(cls.id, cls.version).order_by(cls.id)))
+                logger.info("Syncing catalog: %d changed, %d deleted", len(changed), len(deleted))
+                update_product_cache({}, deleted)
+                for product_id in deleted:
+                    catalog.remove(product_id)
+                for start in range(0, len(changed), 500):
+                    statement = select(*cls.catalog_columns()).where(cls.id.in_(changed[start:start + 500]))
+                    for record in cls._catalog_records(statement):
+                        catalog.upsert(record)
+            catalog.mark_synced(fingerprint)
+        finally:
+            lock.release()
+
+    @classmethod
+    def _find_in_catalog(cls, **field) -> list:
+        """Returns the Products matching one field, found by id through the catalog snapshot
+
+        The snapshot gives the ids of the matches without scanning the
+        table, then one query reads them by primary key. The query stays
+        because the snapshot holds only the searchable columns, not whole
+        Products, and because it checks the field again so a Product another
+        worker changed since the last sync is not returned. Past
+        CATALOG_ID_LOOKUP_MAX matches the database reads as many rows
+        either way, so the scan of the snapshot stops there and the field
+        is matched by the database alone.
+        """
+        cls.sync_catalog()
+        ids = catalog.find_ids(CATALOG_ID_LOOKUP_MAX, **field)
+        if ids == []:
+            return ProductList()
+        (name, value), = field.items()
+        if name == "category":
+            value = cls.category.type.enum_class(value)
+        statement = select(cls).where(getattr(cls, name) == value).order_by(cls.id)
+        if ids is not None:
+            statement = statement.where(cls.id.in_(ids))
+        return ProductList(db.session.scalars(statement))
+
+
+######################################################################
+# Keep the catalog snapshot up to date
+######################################################################
+@on_write
+def update_catalog(changed: dict, deleted: list):
+    """Applies the writes of this process to the catalog snapshot right away"""
+    if not catalog.enabled:
+        return
+    catalog.mark_changed()
+    for product_id in deleted:
+        catalog.remove(product_id)
+    for product_id, values in changed.items():
+        values = {field: values[field] for field in ("name", "price", "available", "category") if field in values}
+        if "category" in values:
+            values["category"] = values["category"].value
+        if not catalog.update(product_id, **values) and len(values) == 4:
+            # the version of a Product is known when it was just created, else the next sync reads it
+            catalog.upsert((
+                product_id, values["name"], values["price"], values["available"], values["category"],
+                changed[product_id].get("version"),
+            ))
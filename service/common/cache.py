@@ -0,0 +1,138 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+LRU Cache
+
+This module contains a small bounded cache that evicts the least recently
+used entry when it is full and expires entries after a time to live.
+It is local to the process, so every worker keeps its own copy.
+
+It also contains the freshness of an in-process copy of the database,
+which tells when the copy is due to be checked for the writes of other
+workers.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread safe least recently used cache with a time to live"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, enabled: bool = True, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, maxsize: int = None, ttl: float = None, enabled: bool = None):
+        """Changes the settings of the cache and empties it"""
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if ttl is not None:
+            self.ttl = ttl
+        if enabled is not None:
+            self.enabled = enabled
+        self.clear()
+
+    def get(self, key, default=None):
+        """Returns the value cached for key, or default if there is none"""
+        if not self.enabled:
+            return default
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires <= self._timer():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Caches a value for key, evicting the least recently used entry if full"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (self._timer() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Removes the value cached for key if there is one"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the counters of the cache"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class Freshness:
+    """When an in-process copy of the database was last checked and what the database was then"""
+
+    def __init__(self, max_staleness: float = 5.0, timer=time.monotonic):
+        self.max_staleness = max_staleness
+        self._timer = timer
+        self.lock = threading.Lock()  # held by the one thread that checks
+        self.fingerprint = None
+        self.checked_at = None
+
+    def is_stale(self) -> bool:
+        """Returns True if the copy was last checked longer ago than max_staleness"""
+        return self.checked_at is None or self._timer() - self.checked_at >= self.max_staleness
+
+    def mark_checked(self, fingerprint):
+        """Records that the copy matches the database as it was when fingerprint was taken"""
+        self.fingerprint = fingerprint
+        self.checked_at = self._timer()
+
+    def mark_changed(self):
+        """Records that the copy was changed by this process, so it matches no fingerprint
+
+        Without it, the writes of other workers that bring the database back
+        to the fingerprint of the last check would go unnoticed
+        """
+        self.fingerprint = None
@@ -0,0 +1,305 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Catalog Snapshot
+
+This module contains a compact in-memory copy of the searchable columns
+of the products. Every column is a flat array ordered by id:
+
+    ids         array of 64 bit ints      8 bytes
+    versions    array of 32 bit ints      4 bytes
+    prices      array of 64 bit cents     8 bytes
+    categories  array of bytes            1 byte
+    available   array of bytes            1 byte
+    names       list of interned str      8 bytes plus each distinct name once
+
+so 1M products take about 30 MB plus their distinct names, where the same
+products loaded as ORM instances take well over 1 GB. Matching a value
+scans a column in C, so only the matches cost Python work.
+"""
+import re
+import sys
+import time
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from decimal import Decimal
+
+# Field positions of the records returned by the catalog
+ID, NAME, PRICE, AVAILABLE, CATEGORY, VERSION = range(6)
+
+# Stands in the prices column for a price with a fraction of a cent
+INEXACT = -(2 ** 63)
+
+
+def to_cents(price: Decimal):
+    """Returns a price in whole cents, or None if it has a fraction of a cent"""
+    cents = Decimal(price) * 100
+    return int(cents) if cents == cents.to_integral_value() else None
+
+
+class Catalog:
+    """A thread safe columnar snapshot of products with a staleness bound"""
+
+    def __init__(self, enabled: bool = False, max_staleness: float = 5.0, timer=time.monotonic):
+        self.enabled = enabled
+        self.max_staleness = max_staleness
+        self._timer = timer
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self.fingerprint = None
+        self.synced_at = None
+        self.syncs = 0
+        self.clear()
+
+    def configure(self, enabled: bool = None, max_staleness: float = None):
+        """Changes the settings of the catalog and empties it"""
+        if enabled is not None:
+            self.enabled = enabled
+        if max_staleness is not None:
+            self.max_staleness = max_staleness
+        self.clear()
+
+    def clear(self):
+        """Removes every product from the catalog"""
+        with self._lock:
+            self._ids = array("q")
+            self._versions = array("i")
+            self._prices = array("q")
+            self._categories = array("B")
+            self._available = array("B")
+            self._names = []
+            self._inexact = {}  # prices with a fraction of a cent by id
+            self.fingerprint = None
+            self.synced_at = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    ##################################################
+    # Changes
+    ##################################################
+
+    def load(self, records, fingerprint=None):
+        """Replaces the contents of the catalog with (id, name, price, available, category, version) records"""
+        with self._lock:
+            self.clear()
+            for record in sorted(records, key=lambda record: record[ID]):
+                self._append(record)
+            self.mark_synced(fingerprint)
+
+    def upsert(self, record):
+        """Adds a (id, name, price, available, category, version) record or replaces the one with its id"""
+        with self._lock:
+            position = bisect_left(self._ids, record[ID])
+            if position < len(self._ids) and self._ids[position] == record[ID]:
+                self._remove_at(position)
+            if position == len(self._ids):
+                self._append(record)
+                return
+            self._ids.insert(position, record[ID])
+            self._versions.insert(position, record[VERSION] or 0)
+            self._prices.insert(position, self._cents(record[ID], record[PRICE]))
+            self._categories.insert(position, record[CATEGORY])
+            self._available.insert(position, int(record[AVAILABLE]))
+            self._names.insert(position, self._intern(record[NAME]))
+
+    def update(self, item_id, **values) -> bool:
+        """Changes some of the fields of a product, returns False if it is not in the catalog"""
+        with self._lock:
+            record = self.get(item_id)
+            if record is None:
+                return False
+            record = list(record)
+            for field, value in values.items():
+                record[{"name": NAME, "price": PRICE, "available": AVAILABLE, "category": CATEGORY}[field]] = value
+            self.upsert(record)
+            return True
+
+    def remove(self, item_id):
+        """Removes a product from the catalog if it is there"""
+        with self._lock:
+            position = bisect_left(self._ids, item_id)
+            if position < len(self._ids) and self._ids[position] == item_id:
+                self._remove_at(position)
+
+    def _append(self, record):
+        self._ids.append(record[ID])
+        self._versions.append(record[VERSION] or 0)
+        self._prices.append(self._cents(record[ID], record[PRICE]))
+        self._categories.append(record[CATEGORY])
+        self._available.append(int(record[AVAILABLE]))
+        self._names.append(self._intern(record[NAME]))
+
+    def _remove_at(self, position: int):
+        self._inexact.pop(self._ids[position], None)
+        for column in (self._ids, self._versions, self._prices, self._categories, self._available, self._names):
+            del column[position]
+
+    def _cents(self, item_id, price) -> int:
+        cents = to_cents(price)
+        if cents is None:
+            self._inexact[item_id] = Decimal(price)
+            return INEXACT
+        return cents
+
+    @staticmethod
+    def _intern(name: str) -> str:
+        return name if name is None else sys.intern(name)
+
+    ##################################################
+    # Freshness
+    ##################################################
+
+    def mark_synced(self, fingerprint):
+        """Records that the catalog matches the database as it was when fingerprint was taken"""
+        with self._lock:
+            self.fingerprint = fingerprint
+            self.synced_at = self._timer()
+            self.syncs += 1
+
+    def mark_changed(self):
+        """Records that this process changed the catalog, so the next sync compares it with the database
+
+        Without it, the writes of other workers that bring the database back
+        to the fingerprint of the last sync would go unnoticed
+        """
+        with self._lock:
+            self.fingerprint = None
+
+    def is_stale(self) -> bool:
+        """Returns True if the catalog was last synced longer ago than max_staleness"""
+        return self.synced_at is None or self._timer() - self.synced_at >= self.max_staleness
+
+    def sync_lock(self):
+        """Returns the lock held while the catalog is synced, so only one thread syncs at a time"""
+        return self._sync_lock
+
+    def diff(self, versions) -> tuple:
+        """Compares the catalog with the (id, version) pairs of the database in id order
+
+        Returns the ids that are new or changed in the database and the ids
+        that are no longer there
+        """
+        with self._lock:
+            ids, known = self._ids.tolist(), self._versions.tolist()
+        changed, deleted = [], []
+        position = 0
+        for item_id, version in versions:
+            while position < len(ids) and ids[position] < item_id:
+                deleted.append(ids[position])
+                position += 1
+            if position < len(ids) and ids[position] == item_id:
+                if known[position] != version:
+                    changed.append(item_id)
+                position += 1
+            else:
+                changed.append(item_id)
+        deleted.extend(ids[position:])
+        return changed, deleted
+
+    ##################################################
+    # Queries
+    ##################################################
+
+    def get(self, item_id):
+        """Returns the record of a product, or None if it is not in the catalog"""
+        with self._lock:
+            position = bisect_left(self._ids, item_id)
+            if position < len(self._ids) and self._ids[position] == item_id:
+                return self._record(position)
+            return None
+
+    def find(self, name: str = None, price: Decimal = None, available: bool = None, category: int = None) -> list:
+        """Returns the records of the products matching one field, in id order"""
+        with self._lock:
+            return [self._record(position) for position in self._positions(name, price, available, category)]
+
+    def find_ids(self, limit: int, **field) -> list:
+        """Returns the ids of the products matching one field in id order, or None past limit matches
+
+        The scan stops at the first match past the limit, so a value shared
+        by most products costs no more than one shared by limit of them
+        """
+        with self._lock:
+            positions = list(islice(self._positions(**field), limit + 1))
+            return None if len(positions) > limit else [self._ids[position] for position in positions]
+
+    def _positions(self, name: str = None, price: Decimal = None, available: bool = None, category: int = None):
+        if name is not None:
+            return self._positions_in_list(self._names, name)
+        if price is not None:
+            return self._positions_of_price(Decimal(price))
+        if available is not None:
+            return self._positions_in_array(self._available, int(available))
+        if category is not None:
+            return self._positions_in_array(self._categories, category)
+        return range(len(self._ids))
+
+    def _record(self, position: int) -> tuple:
+        cents = self._prices[position]
+        return (
+            self._ids[position],
+            self._names[position],
+            self._inexact[self._ids[position]] if cents == INEXACT else Decimal(cents) / 100,
+            bool(self._available[position]),
+            self._categories[position],
+            self._versions[position],
+        )
+
+    def _positions_of_price(self, price: Decimal):
+        cents = to_cents(price)
+        if cents is not None:
+            return self._positions_in_array(self._prices, cents)
+        matches = sorted(item_id for item_id, inexact in self._inexact.items() if inexact == price)
+        return [bisect_left(self._ids, item_id) for item_id in matches]
+
+    @staticmethod
+    def _positions_in_list(values: list, value):
+        position = -1
+        try:
+            while True:
+                position = values.index(value, position + 1)
+                yield position
+        except ValueError:
+            return
+
+    @staticmethod
+    def _positions_in_array(values: array, value: int):
+        # the lookahead finds overlapping matches, so a match across two
+        # values can never hide the aligned match of a whole value
+        pattern = b"(?=" + re.escape(array(values.typecode, [value]).tobytes()) + b")"
+        width = values.itemsize
+        return (
+            match.start() // width
+            for match in re.finditer(pattern, memoryview(values).cast("B"), re.DOTALL)
+            if match.start() % width == 0
+        )
+
+    def stats(self) -> dict:
+        """Returns the size and freshness of the catalog"""
+        with self._lock:
+            columns = (self._ids, self._versions, self._prices, self._categories, self._available)
+            return {
+                "enabled": self.enabled,
+                "size": len(self._ids),
+                "bytes": sum(column.itemsize * len(column) for column in columns) + 8 * len(self._names),
+                "max_staleness": self.max_staleness,
+                "age": None if self.synced_at is None else self._timer() - self.synced_at,
+                "syncs": self.syncs,
+            }
@@ -1,8 +1,17 @@
 """
 Flask CLI Command Extensions
 """
+import time
+import random
+from decimal import Decimal
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import NoSuchTableError, OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateIndex, DropIndex
 from service import app
-from service.models import db
+from service.models import db, Product, Category, create_schema
+
+SEED_NAMES = ["Hat", "Pants", "Shirt", "Apple", "Banana", "Pots", "Towels", "Ford", "Chevy", "Hammer", "Wrench"]
 
 
 ######################################################################
@@ -18,3 +27,160 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to create the tables that are missing
+# Usage: flask db-init
+######################################################################
+@app.cli.command("db-init")
+def db_init():
+    """
+    Creates the tables and indexes that are missing from the database,
+    keeping the data there is. The app does not create them on its own.
+    """
+    start = time.perf_counter()
+    create_schema()
+    click.echo(f"Schema created in {time.perf_counter() - start:.3f}s")
+
+
+######################################################################
+# Command to remove every product, keeping the schema
+# Usage: flask db-reset --yes
+######################################################################
+@app.cli.command("db-reset")
+@click.confirmation_option(prompt="Remove every product?")
+def db_reset():
+    """
+    Removes every product by truncating the table, which is much faster
+    than deleting them. The ids of new products go on from the last one.
+    Meant for test and staging databases.
+    """
+    start = time.perf_counter()
+    Product.remove_all()
+    click.echo(f"Products removed in {time.perf_counter() - start:.3f}s")
+
+
+######################################################################
+# Command to fill the database with products
+# Usage: flask db-seed --count 1000000
+######################################################################
+@app.cli.command("db-seed")
+@click.option("--count", type=click.IntRange(min=0), default=1000, show_default=True, help="Products to create")
+@click.option(
+    "--distinct", type=click.IntRange(min=1), default=1000, show_default=True,
+    help="Different random products, repeated up to the count",
+)
+@click.option("--chunk-size", type=click.IntRange(min=1), default=10000, show_default=True, help="Products per commit")
+def db_seed(count, distinct, chunk_size):
+    """
+    Creates random products in bulk, like those of the ProductFactory of
+    the tests. A pool of distinct products is repeated until there are
+    enough, so making them takes no time next to inserting them.
+    """
+    start = time.perf_counter()
+    pool = [seed_product(number) for number in range(min(distinct, count))]
+    rows = (pool[number % len(pool)] for number in range(count))
+    created = Product.bulk_insert(rows, chunk_size)
+    click.echo(f"{created} products created in {time.perf_counter() - start:.3f}s")
+
+
+def seed_product(number: int) -> dict:
+    """Returns the values of a random Product"""
+    return {
+        "name": random.choice(SEED_NAMES),
+        "description": f"Seed product {number}",
+        "price": Decimal(random.randint(50, 200000)) / 100,
+        "available": random.random() < 0.5,
+        "category": random.choice(list(Category)),
+    }
+
+
+######################################################################
+# Command to build the indexes that are missing
+# Usage: flask db-indexes
+######################################################################
+@app.cli.command("db-indexes")
+def db_indexes():
+    """
+    Builds the indexes declared on the models that are missing from the
+    database. On PostgreSQL they are built CONCURRENTLY so that writes to
+    the table are not blocked while they build. The full text index of
+    the products is added to tables made before it existed.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        try:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        except NoSuchTableError:
+            click.echo(f"{table.name}: table does not exist, run flask db-create")
+            continue
+        invalid = invalid_indexes(table.name)
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing and index.name not in invalid:
+                click.echo(f"{index.name}: exists, {format_size(index_size(index.name))}")
+                continue
+            start = time.perf_counter()
+            build_index(index, rebuild=index.name in invalid)
+            elapsed = time.perf_counter() - start
+            click.echo(f"{index.name}: built in {elapsed:.3f}s, {format_size(index_size(index.name))}")
+    if inspector.has_table(Product.__tablename__):
+        start = time.perf_counter()
+        if Product.create_search_index():
+            click.echo(f"full text index: built in {time.perf_counter() - start:.3f}s")
+        else:
+            click.echo("full text index: exists")
+
+
+def build_index(index, rebuild: bool = False):
+    """Builds an index, without blocking writes on PostgreSQL"""
+    if db.engine.dialect.name != "postgresql":
+        index.create(db.engine)
+        return
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    options = index.dialect_options["postgresql"]
+    options["concurrently"] = True
+    try:
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            if rebuild:
+                connection.execute(DropIndex(index))
+            connection.execute(CreateIndex(index))
+    finally:
+        options["concurrently"] = False
+
+
+def invalid_indexes(table_name: str) -> set:
+    """Returns the indexes left invalid by a failed concurrent build"""
+    if db.engine.dialect.name != "postgresql":
+        return set()
+    sql = text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = CAST(:table AS regclass) AND NOT i.indisvalid"
+    )
+    with db.engine.connect() as connection:
+        return set(connection.scalars(sql, {"table": table_name}))
+
+
+def index_size(name: str):
+    """Returns the size of an index in bytes, or None if it is not known"""
+    if db.engine.dialect.name == "postgresql":
+        sql = text("SELECT pg_relation_size(CAST(:name AS regclass))")
+    else:
+        # needs SQLite to be compiled with the dbstat virtual table
+        sql = text("SELECT SUM(pgsize) FROM dbstat WHERE name = :name")
+    try:
+        with db.engine.connect() as connection:
+            return connection.scalar(sql, {"name": name})
+    except (OperationalError, ProgrammingError):
+        return None
+
+
+def format_size(size) -> str:
+    """Formats a size in bytes for people to read"""
+    if size is None:
+        return "size unknown"
+    for unit in ("bytes", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
@@ -0,0 +1,379 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Metrics
+
+This module contains a histogram of observed values and the instruments
+of the database connection pool. The pool counts its checkouts, how often
+it had to overflow or timed out, and how long each request waited for a
+connection, so that it can be sized from real traffic.
+
+It also contains the counters of the requests served by each route,
+which are exposed in the Prometheus text format. Each worker process
+counts its own requests. When they are given a directory, the workers
+write their counters to a file in it named after their pid, so whichever
+worker is scraped can add up the counters of all of them.
+"""
+import os
+import glob
+import json
+import time
+import threading
+from bisect import bisect_left
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds in seconds of the buckets of the connection wait histogram
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+# Upper bounds in seconds of the buckets of the request latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The file holding the counters of the workers that have exited
+EXITED_WORKERS = "exited.json"
+
+
+class Histogram:
+    """A thread safe count of observed values in buckets with upper bounds"""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Counts a value in the first bucket whose bound is not below it"""
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> dict:
+        """Returns the count, the sum and the cumulative count of every bucket"""
+        with self._lock:
+            cumulative = []
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), self._counts):
+                total += count
+                cumulative.append((str(bound), total))
+            return {"count": self.count, "sum": self.sum, "buckets": dict(cumulative)}
+
+
+class PoolMetrics:
+    """Counters of the checkouts from a connection pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Sets every counter back to zero"""
+        with self._lock:
+            self.wait_time = Histogram(WAIT_BUCKETS)
+            self.checkouts = 0
+            self.overflow_checkouts = 0
+            self.peak_checked_out = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+
+    def instrument(self, engine):
+        """Listens to the events of the pool of an engine"""
+
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):  # pylint: disable=unused-argument
+            self.on_checkout(engine.pool)
+
+        event.listen(engine, "connect", self.on_connect)
+        event.listen(engine, "checkout", on_checkout)
+        event.listen(engine, "invalidate", self.on_invalidate)
+
+    def on_connect(self, dbapi_connection, connection_record):  # pylint: disable=unused-argument
+        """Counts the new connections opened by the pool"""
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, pool):
+        """Counts a checkout and whether the pool was beyond its size for it"""
+        with self._lock:
+            self.checkouts += 1
+            if isinstance(pool, QueuePool):
+                self.peak_checked_out = max(self.peak_checked_out, pool.checkedout())
+                if pool.overflow() > 0:
+                    self.overflow_checkouts += 1
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):  # pylint: disable=unused-argument
+        """Counts the connections the pool found broken"""
+        with self._lock:
+            self.invalidations += 1
+
+    def on_timeout(self):
+        """Counts a checkout that gave up waiting for a connection"""
+        with self._lock:
+            self.timeouts += 1
+
+    def stats(self, pool) -> dict:
+        """Returns the counters together with the current state of the pool"""
+        with self._lock:
+            counters = {
+                "checkouts": self.checkouts,
+                "overflow_checkouts": self.overflow_checkouts,
+                "peak_checked_out": self.peak_checked_out,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_seconds": self.wait_time.snapshot(),
+            }
+        if isinstance(pool, QueuePool):
+            counters.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=max(pool.overflow(), 0),
+                max_overflow=pool._max_overflow,  # pylint: disable=protected-access
+                timeout=pool.timeout(),
+            )
+        return counters
+
+
+# The counters of the connection pool of this worker
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited for a connection
+
+    The pool has no event before a checkout, so the wait is timed here
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.on_timeout()
+            raise
+        finally:
+            pool_metrics.wait_time.observe(time.perf_counter() - start)
+
+
+class RequestMetrics:
+    """Counters, latency histograms and in-flight gauges of the requests to each route
+
+    :param directory: where every worker writes its counters, or None to
+        report the counters of this process alone
+    :param flush_interval: the longest time in seconds that the file of a
+        worker lags behind its counters
+    """
+
+    def __init__(self, directory: str = None, flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+        self.reset()
+
+    def configure(self, directory: str = None, flush_interval: float = None):
+        """Changes where the counters are written and how often"""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+
+    def reset(self):
+        """Sets every counter back to zero, as a new worker process must"""
+        with self._lock:
+            self.requests = {}  # count by (method, route, status)
+            self.latency = {}  # Histogram by (method, route)
+            self.in_flight = {}  # requests being served by (method, route)
+            self.flushed_at = 0.0
+            self.dirty = False
+
+    def started(self, method: str, route: str):
+        """Counts a request that is being served"""
+        with self._lock:
+            self.in_flight[method, route] = self.in_flight.get((method, route), 0) + 1
+            self.dirty = True
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def finished(self, method: str, route: str, status: int, seconds: float):
+        """Counts a request that was served with a status in some seconds"""
+        key = (method, route)
+        with self._lock:
+            self.in_flight[key] = self.in_flight.get(key, 1) - 1
+            self.requests[method, route, status] = self.requests.get((method, route, status), 0) + 1
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+            histogram = self.latency[key]
+            self.dirty = True
+            due = self.directory and time.monotonic() - self.flushed_at >= self.flush_interval
+        histogram.observe(seconds)
+        if due:
+            self.flush()
+
+    def snapshot(self) -> dict:
+        """Returns the counters of this process in a form that can be saved as JSON"""
+        with self._lock:
+            latency = list(self.latency.items())
+            snapshot = {
+                "requests": [[*key, count] for key, count in self.requests.items()],
+                "in_flight": [[*key, count] for key, count in self.in_flight.items()],
+            }
+        snapshot["latency"] = [[*key, histogram.snapshot()] for key, histogram in latency]
+        return snapshot
+
+    def flush(self):
+        """Writes the counters of this process to its file in the directory"""
+        if not self.directory or not self._flush_lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return
+        try:
+            with self._lock:
+                self.flushed_at = time.monotonic()
+                self.dirty = False
+            write_json(os.path.join(self.directory, f"{os.getpid()}.json"), self.snapshot())
+        finally:
+            self._flush_lock.release()
+
+    def _start_flusher(self):
+        """Starts the thread that writes the counters of a worker that went idle
+
+        Threads do not survive a fork, so each worker starts its own
+        """
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_when_dirty, name="metrics-flusher", daemon=True).start()
+
+    def _flush_when_dirty(self):
+        while True:
+            time.sleep(self.flush_interval or 1.0)
+            if self.dirty:
+                self.flush()
+
+    def collect(self) -> dict:
+        """Returns the counters of every worker added up"""
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path, encoding="utf-8") as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue  # the worker exited or is writing it
+        return merge_snapshots(snapshots)
+
+
+# The counters of the requests served by this worker
+request_metrics = RequestMetrics()
+
+
+def clear_workers(directory: str):
+    """Removes the counters left in a directory by the workers of an earlier server"""
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+def worker_exited(directory: str, pid: int):
+    """Moves the counters of a worker that exited to the file of exited workers
+
+    Its counters keep counting in the totals, and its in-flight requests
+    stop counting
+    """
+    path = os.path.join(directory, f"{pid}.json")
+    exited = os.path.join(directory, EXITED_WORKERS)
+    snapshots = []
+    for source in (exited, path):
+        try:
+            with open(source, encoding="utf-8") as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    merged = merge_snapshots(snapshots)
+    merged["in_flight"] = []
+    write_json(exited, merged)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def write_json(path: str, data):
+    """Replaces a file with JSON in one step, so it is never read half written"""
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+def merge_snapshots(snapshots: list) -> dict:
+    """Adds up the counters of snapshots of several processes"""
+    requests, in_flight, latency = {}, {}, {}
+    for snapshot in snapshots:
+        for *key, count in snapshot["requests"]:
+            requests[tuple(key)] = requests.get(tuple(key), 0) + count
+        for *key, count in snapshot["in_flight"]:
+            in_flight[tuple(key)] = in_flight.get(tuple(key), 0) + count
+        for *key, histogram in snapshot["latency"]:
+            total = latency.setdefault(tuple(key), {"count": 0, "sum": 0.0, "buckets": {}})
+            total["count"] += histogram["count"]
+            total["sum"] += histogram["sum"]
+            for bound, count in histogram["buckets"].items():
+                total["buckets"][bound] = total["buckets"].get(bound, 0) + count
+    return {
+        "requests": [[*key, count] for key, count in requests.items()],
+        "in_flight": [[*key, count] for key, count in in_flight.items()],
+        "latency": [[*key, histogram] for key, histogram in latency.items()],
+    }
+
+
+def label(value) -> str:
+    """Returns a value escaped for a label of the Prometheus text format"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def to_prometheus(snapshot: dict) -> str:
+    """Returns the counters of a snapshot in the Prometheus text format"""
+    lines = [
+        "# HELP http_requests_total Requests served by method, route and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for method, route, status, count in sorted(snapshot["requests"]):
+        lines.append(
+            f'http_requests_total{{method="{label(method)}",route="{label(route)}",status="{status}"}} {count}'
+        )
+    lines += [
+        "# HELP http_requests_in_flight Requests being served by method and route.",
+        "# TYPE http_requests_in_flight gauge",
+    ]
+    for method, route, count in sorted(snapshot["in_flight"]):
+        lines.append(f'http_requests_in_flight{{method="{label(method)}",route="{label(route)}"}} {count}')
+    lines += [
+        "# HELP http_request_duration_seconds Time to serve the requests by method and route.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for method, route, histogram in sorted(snapshot["latency"], key=lambda item: item[:2]):
+        labels = f'method="{label(method)}",route="{label(route)}"'
+        for bound, count in histogram["buckets"].items():
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f"http_request_duration_seconds_sum{{{labels}}} {histogram['sum']}")
+        lines.append(f"http_request_duration_seconds_count{{{labels}}} {histogram['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,52 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Pagination Cursors
+
+This module contains utility functions to encode and decode the opaque
+cursor tokens used for keyset pagination. A cursor records the sort key
+values of the row at the edge of a page and the direction to move in.
+"""
+import json
+import base64
+import binascii
+
+NEXT = "next"
+PREV = "prev"
+
+
+def encode_cursor(sort: str, values: list, direction: str = NEXT) -> str:
+    """Encodes the sort key values of a row into an opaque cursor token"""
+    payload = {"s": sort, "v": [str(value) for value in values], "d": direction}
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple:
+    """Decodes a cursor token into a (sort, values, direction) tuple
+
+    Raises ValueError if the token was not produced by encode_cursor()
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        sort, values, direction = payload["s"], payload["v"], payload["d"]
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError) as error:
+        raise ValueError(f"Invalid cursor: {token}") from error
+    if not isinstance(values, list) or direction not in (NEXT, PREV):
+        raise ValueError(f"Invalid cursor: {token}")
+    return sort, values, direction
@@ -0,0 +1,97 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Prefix Index
+
+This module contains an in-memory index that suggests the names starting
+with a prefix. The distinct names are kept case folded in a sorted array,
+so a lookup is a binary search followed by a scan of the matches.
+"""
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+
+class PrefixIndex:
+    """A thread safe index of the names of items keyed by id"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = {}  # name of each item by id
+        self._keys = []  # sorted case folded names
+        self._spellings = {}  # how often each spelling of a case folded name is used
+
+    def __len__(self):
+        return len(self._names)
+
+    def load(self, items):
+        """Replaces the contents of the index with (id, name) pairs"""
+        names = {item_id: name for item_id, name in items}
+        spellings = {}
+        for name in names.values():
+            spellings.setdefault(name.casefold(), Counter())[name] += 1
+        with self._lock:
+            self._names = names
+            self._spellings = spellings
+            self._keys = sorted(spellings)
+
+    def add(self, item_id, name: str):
+        """Adds an item to the index or changes its name"""
+        with self._lock:
+            if self._names.get(item_id) == name:
+                return
+            self._remove(item_id)
+            self._names[item_id] = name
+            key = name.casefold()
+            if key not in self._spellings:
+                self._spellings[key] = Counter()
+                insort(self._keys, key)
+            self._spellings[key][name] += 1
+
+    def remove(self, item_id):
+        """Removes an item from the index if it is there"""
+        with self._lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id):
+        name = self._names.pop(item_id, None)
+        if name is None:
+            return
+        key = name.casefold()
+        spellings = self._spellings[key]
+        spellings[name] -= 1
+        if spellings[name] <= 0:
+            del spellings[name]
+        if not spellings:
+            del self._spellings[key]
+            del self._keys[bisect_left(self._keys, key)]
+
+    def suggest(self, prefix: str, limit: int = 10) -> list:
+        """Returns up to limit distinct names that start with prefix in alphabetical order
+
+        Names are matched regardless of case and returned with their most
+        common spelling
+        """
+        prefix = prefix.casefold()
+        with self._lock:
+            position = bisect_left(self._keys, prefix)
+            suggestions = []
+            for key in self._keys[position:position + limit]:
+                if not key.startswith(prefix):
+                    break
+                suggestions.append(self._spellings[key].most_common(1)[0][0])
+            return suggestions
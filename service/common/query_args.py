@@ -0,0 +1,70 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Query Arguments
+
+This module contains the parsers of the query string of the product
+listings, shared by the Flask app and the ASGI app so both answer the
+same arguments the same way. They take any mapping of the arguments and
+raise DataValidationError, which both apps answer with 400_BAD_REQUEST.
+"""
+from decimal import Decimal
+from service.models import Category, DataValidationError
+
+
+def parse_filters(args) -> dict:
+    """Returns the Product filters given in the query string
+
+    Every filter that is given is applied, so they can be combined
+    """
+    filters = {}
+    if args.get("name"):
+        filters["name"] = args["name"]
+    if args.get("category"):
+        try:
+            filters["category"] = getattr(Category, args["category"].upper())  # Convert to Enum
+        except AttributeError as error:
+            raise DataValidationError(f"Invalid category: {args['category']}") from error
+    if args.get("available") is not None:
+        filters["available"] = args["available"].lower() == "true"  # Convert to Boolean
+    for bound in ("min_price", "max_price"):
+        if args.get(bound):
+            filters[bound] = parse_price(args, bound)
+    return filters
+
+
+def parse_price(args, arg: str) -> Decimal:
+    """Returns a price given in the query string"""
+    try:
+        price = Decimal(args[arg])
+    except ArithmeticError:
+        price = None
+    if price is None or not price.is_finite():
+        raise DataValidationError(f"Invalid {arg}: {args[arg]}")
+    return price
+
+
+def parse_page_limit(args, default: int, maximum: int) -> int:
+    """Returns the page size requested with the limit query parameter"""
+    limit = args.get("limit", default)
+    try:
+        limit = int(limit)
+    except ValueError as error:
+        raise DataValidationError(f"Invalid limit: {limit}") from error
+    if not 1 <= limit <= maximum:
+        raise DataValidationError(f"limit must be between 1 and {maximum}")
+    return limit
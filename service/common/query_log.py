@@ -0,0 +1,186 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Query Log
+
+This module contains the instruments of the SQL statements an engine
+runs. It counts the statements of each unit of work, such as a request,
+with the time they spent in the database, and keeps the statements slower
+than a threshold in a slow query log. The bound parameters of a slow
+statement are replaced by their types, so the log never holds the data
+of the products. The plan of a slow statement can be captured with
+EXPLAIN as well.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from sqlalchemy import event
+
+logger = logging.getLogger("flask.app.slow_queries")
+
+# Statements that EXPLAIN describes without running them
+EXPLAINABLE = ("select", "with", "update", "delete", "insert")
+
+# The savepoint the EXPLAIN of a statement runs in
+EXPLAIN_SAVEPOINT = "query_log_explain"
+
+
+def redact(parameters):
+    """Returns the bound parameters of a statement with each value replaced by its type"""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class QueryLog:
+    """Counts the statements run by each thread and keeps the slowest ones
+
+    :param threshold: the time in seconds above which a statement is slow
+    :param size: the number of slow statements kept, the oldest are dropped
+    :param explain: True to capture the plan of the slow statements
+    """
+
+    def __init__(self, threshold: float = 0.1, size: int = 100, explain: bool = False):
+        self.threshold = threshold
+        self.explain = explain
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._slow = deque(maxlen=size)
+
+    def configure(self, threshold: float = None, size: int = None, explain: bool = None):
+        """Changes the settings of the log"""
+        if threshold is not None:
+            self.threshold = threshold
+        if explain is not None:
+            self.explain = explain
+        if size is not None:
+            with self._lock:
+                self._slow = deque(self._slow, maxlen=size)
+
+    def instrument(self, engine):
+        """Listens to the statements an engine runs"""
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    ##################################################
+    # Units of work
+    ##################################################
+
+    def start(self, label: str = None):
+        """Starts counting the statements run by this thread for a unit of work"""
+        self._local.label = label
+        self._local.count = 0
+        self._local.seconds = 0.0
+
+    def stop(self) -> tuple:
+        """Stops counting and returns the number of statements and their time in seconds"""
+        count, seconds = self.current()
+        self._local.count = None
+        return count, seconds
+
+    def current(self) -> tuple:
+        """Returns the number of statements of the unit of work so far and their time in seconds"""
+        if getattr(self._local, "count", None) is None:
+            return 0, 0.0
+        return self._local.count, self._local.seconds
+
+    ##################################################
+    # Engine events
+    ##################################################
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """Starts the clock of a statement"""
+        # pylint: disable=unused-argument,too-many-arguments
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """Counts a statement and logs it if it was slow"""
+        # pylint: disable=unused-argument,too-many-arguments
+        seconds = time.perf_counter() - conn.info["query_start"].pop()
+        if getattr(self._local, "count", None) is not None:
+            self._local.count += 1
+            self._local.seconds += seconds
+        if seconds >= self.threshold:
+            self.record(conn, statement, parameters, seconds, executemany)
+
+    def record(self, conn, statement: str, parameters, seconds: float, executemany: bool = False):
+        """Adds a slow statement to the log"""
+        # pylint: disable=too-many-arguments
+        entry = {
+            "statement": statement,
+            "parameters": "executemany" if executemany else redact(parameters),
+            "duration_ms": round(seconds * 1000, 3),
+            "at": time.time(),
+            "label": getattr(self._local, "label", None),
+        }
+        if self.explain and not executemany and statement.lstrip().lower().startswith(EXPLAINABLE):
+            entry["plan"] = self.plan(conn, statement, parameters)
+        logger.warning("Slow query (%.1f ms) in %s: %s", seconds * 1000, entry["label"], " ".join(statement.split()))
+        with self._lock:
+            self._slow.append(entry)
+
+    @staticmethod
+    def plan(conn, statement: str, parameters) -> list:
+        """Returns the plan of a statement from EXPLAIN, run on a cursor of its own connection
+
+        The DBAPI cursor is used directly, so the EXPLAIN is neither counted
+        nor logged. Within a transaction it runs inside a SAVEPOINT that is
+        rolled back if it fails, since on PostgreSQL a failed statement
+        aborts the transaction of the request it was run for.
+        """
+        prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+        savepoint = conn.in_transaction()
+        cursor = conn.connection.cursor()
+        try:
+            if savepoint:
+                cursor.execute(f"SAVEPOINT {EXPLAIN_SAVEPOINT}")
+            try:
+                cursor.execute(prefix + statement, parameters)
+                return [str(row[-1]) for row in cursor.fetchall()]
+            except Exception as error:  # pylint: disable=broad-except
+                if savepoint:
+                    cursor.execute(f"ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}")
+                return [f"EXPLAIN failed: {error}"]
+            finally:
+                if savepoint:
+                    cursor.execute(f"RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}")
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Cannot explain a slow query: %s", error)
+            return [f"EXPLAIN failed: {error}"]
+        finally:
+            cursor.close()
+
+    ##################################################
+    # Slow query log
+    ##################################################
+
+    def slow_queries(self) -> list:
+        """Returns the slow statements, the most recent first"""
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def clear(self):
+        """Empties the slow query log"""
+        with self._lock:
+            self._slow.clear()
+
+
+# The statements run by this worker
+query_log = QueryLog()
@@ -0,0 +1,111 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Validation
+
+This module contains a validator of the dictionaries posted to the
+service, driven by a table of their fields. The table is compiled once
+into a tuple of steps: a field whose value must be of a type is checked
+in the loop itself, any other field calls its parser. Every field is
+checked, so the errors of a payload are reported together rather than
+one per request, and a list of payloads is checked in one pass with the
+errors of each item listed by its index.
+"""
+
+# The names of the types in the messages, as in "Invalid type for string [name]"
+TYPE_NAMES = {str: "string", bool: "boolean", int: "integer", float: "number", list: "list", dict: "object"}
+
+MISSING = object()
+
+
+class Validator:
+    """Checks the fields of dictionaries against a table and reports every error
+
+    :param fields: for each field name, either the type its value must be
+        or a parser called with the name and the value that returns the
+        value to keep or raises error
+    :param error: the exception raised by the parsers and by validate()
+    :param missing: the message of a missing field, formatted with its name
+    :param invalid: the message of a payload that is not a dictionary
+    """
+
+    def __init__(self, fields: dict, error=ValueError, missing: str = "missing {}", invalid: str = "invalid data"):
+        self.error = error
+        self.invalid = invalid
+        # (name, type or None, parser or None, message when missing) of each field
+        self._steps = tuple(
+            (name, kind, None, missing.format(name)) if isinstance(kind, type) else (name, None, kind, missing.format(name))
+            for name, kind in fields.items()
+        )
+        self._type_errors = {
+            name: f"Invalid type for {TYPE_NAMES.get(kind, kind.__name__)} [{name}]: "
+            for name, kind in fields.items()
+            if isinstance(kind, type)
+        }
+
+    @property
+    def fields(self) -> tuple:
+        """Returns the names of the fields in the order they are checked"""
+        return tuple(step[0] for step in self._steps)
+
+    def check(self, data) -> tuple:
+        """Returns the values of the fields and the messages of every error found"""
+        if not isinstance(data, dict):
+            return {}, [self.invalid]
+        values = {}
+        errors = []
+        for name, kind, parser, missing in self._steps:
+            value = data.get(name, MISSING)
+            if value is MISSING:
+                errors.append(missing)
+            elif kind is not None:
+                if isinstance(value, kind):
+                    values[name] = value
+                else:
+                    errors.append(f"{self._type_errors[name]}{type(value)}")
+            else:
+                try:
+                    values[name] = parser(name, value)
+                except self.error as error:
+                    errors.append(str(error))
+        return values, errors
+
+    def validate(self, data) -> dict:
+        """Returns the values of the fields, or raises error with every message joined"""
+        values, errors = self.check(data)
+        if errors:
+            raise self.error("; ".join(errors))
+        return values
+
+    def validate_many(self, items: list) -> tuple:
+        """Returns the values of each item and the errors of the invalid ones by index
+
+        :return: the values of the valid items in order, and for each item
+            with errors a dictionary of its index, every message and all
+            of them joined
+        :rtype: tuple
+
+        """
+        rows = []
+        errors = []
+        for index, data in enumerate(items):
+            values, messages = self.check(data)
+            if messages:
+                errors.append({"index": index, "message": "; ".join(messages), "errors": messages})
+            else:
+                rows.append(values)
+        return rows, errors
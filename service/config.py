@@ -3,6 +3,7 @@ Global Configuration for Application
 """
 import os
 import logging
+from sqlalchemy.engine import make_url
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -13,7 +14,79 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool of each worker
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "yes", "1")
+
+
+def engine_options(uri: str) -> dict:
+    """Returns the connection pool settings of the engine for a database URI
+
+    Only database servers get a sized pool. SQLite keeps the default pool of
+    its driver, a single shared connection for an in-memory database
+    """
+    if make_url(uri).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+SQLALCHEMY_ENGINE_OPTIONS = engine_options(DATABASE_URI)
+
+# Database used by the ASGI app, DATABASE_URI with an async driver by default
+ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URI")
+
+# Keyset pagination for product listings
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "20"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Rows fetched per round trip when streaming product listings
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "1000"))
+
+# Largest number of products accepted by a batch request
+BATCH_SIZE_MAX = int(os.getenv("BATCH_SIZE_MAX", "10000"))
+
+# Per-process read-through cache of Products looked up by id
+PRODUCT_CACHE_ENABLED = os.getenv("PRODUCT_CACHE_ENABLED", "true").lower() in ("true", "yes", "1")
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "4096"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "30"))
+
+# Per-process columnar snapshot of the catalog that answers the find_by_* lookups.
+# Writes by other workers show up after at most CATALOG_MAX_STALENESS seconds
+CATALOG_ENABLED = os.getenv("CATALOG_ENABLED", "false").lower() in ("true", "yes", "1")
+CATALOG_MAX_STALENESS = float(os.getenv("CATALOG_MAX_STALENESS", "5"))
+
+# Per-process name and bitmap indexes follow the writes of their own worker at
+# once, and are rebuilt after other workers write within INDEX_MAX_STALENESS seconds
+INDEX_MAX_STALENESS = float(os.getenv("INDEX_MAX_STALENESS", "5"))
+
+# Per-process cache of the encoded JSON of Products, checked against their version
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "50000"))
+
+# Directory where each worker writes the counters served at /metrics, so
+# that they add up across workers. Unset, /metrics counts this worker alone
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+
+# Statements slower than SLOW_QUERY_THRESHOLD_MS are logged with their bound
+# parameters redacted, and kept for /admin/slow-queries with their plan when
+# SLOW_QUERY_EXPLAIN is set
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() in ("true", "yes", "1")
+
+# POST /admin/reset removes every product when RESET_ENABLED is set. Only
+# for the test and staging environments, never for production
+RESET_ENABLED = os.getenv("RESET_ENABLED", "false").lower() in ("true", "yes", "1")
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
@@ -0,0 +1,43 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Database
+
+This module holds the SQLAlchemy object of the service and the listeners
+told about every write of Products. The models, their full text search,
+their catalog snapshot and their in-process indexes all share them.
+"""
+from flask_sqlalchemy import SQLAlchemy
+
+# Create the SQLAlchemy object to be initialized later in init_db()
+db = SQLAlchemy()
+
+# Functions called after every write with the values that changed keyed
+# by the id of each new or changed Product, and the ids of deleted ones
+write_listeners = []
+
+
+def on_write(listener):
+    """Registers a function to call with (changed, deleted) after Products are written"""
+    write_listeners.append(listener)
+    return listener
+
+
+def notify_write(changed: dict = None, deleted: list = None):
+    """Tells every write listener which Products were written"""
+    for listener in write_listeners:
+        listener(changed or {}, deleted or [])
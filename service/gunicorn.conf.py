@@ -0,0 +1,181 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Gunicorn Configuration
+
+Sizes the workers and threads of the service from the CPUs available to
+the process and the environment. Start the service with:
+
+    gunicorn --config service/gunicorn.conf.py service:app
+
+Environment:
+    GUNICORN_BIND            address to listen on (0.0.0.0:$PORT)
+    WEB_CONCURRENCY          number of worker processes (2 x CPUs + 1, within
+                             DB_MAX_CONNECTIONS / GUNICORN_THREADS)
+    GUNICORN_THREADS         threads per worker, more than 1 uses gthread (4)
+    DB_MAX_CONNECTIONS       database connections all of the workers may hold (90)
+    DB_POOL_SIZE             connections per worker (GUNICORN_THREADS, within
+                             DB_MAX_CONNECTIONS / workers)
+    DB_MAX_OVERFLOW          connections per worker beyond the pool (0)
+    GUNICORN_PRELOAD         import the app once before forking (true)
+    GUNICORN_MAX_REQUESTS    requests before a worker is recycled (1000)
+    GUNICORN_MAX_REQUESTS_JITTER  random extra requests per worker (100)
+    GUNICORN_KEEPALIVE       seconds to hold idle connections open (75)
+    GUNICORN_TIMEOUT         seconds before a silent worker is killed (30)
+    METRICS_DIR              where workers add up their /metrics counters
+                             (a fresh directory when there are several workers)
+    DB_CREATE_SCHEMA         create the missing tables before the workers start (true)
+"""
+import os
+import tempfile
+import multiprocessing
+
+
+def cpu_count() -> int:
+    """Returns the number of CPUs this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on every platform
+        return multiprocessing.cpu_count()
+
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+
+# Each worker is a process with its own connection pool, caches and
+# indexes. The connections of every pool must fit within max_connections
+# of the database, 100 by default on PostgreSQL, with some to spare for
+# the master, migrations and people. A thread uses one connection at a
+# time, so each worker gets a pool of one per thread and no overflow, and
+# there are no more workers than the connections can serve
+max_connections = int(os.getenv("DB_MAX_CONNECTIONS", "90"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(cpu_count() * 2 + 1, max(max_connections // threads, 1)))))
+worker_class = "gthread" if threads > 1 else "sync"
+pool_size = int(os.getenv("DB_POOL_SIZE", str(max(min(threads, max_connections // workers), 1))))
+max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "0"))
+
+# Import the app once in the master so workers start fast and share
+# memory pages. The database connections must not be shared, see post_fork
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("true", "yes", "1")
+
+# Recycle workers after a number of requests to cap memory growth. The
+# jitter keeps them from all restarting at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# Hold idle connections open longer than the idle timeout of the load
+# balancer in front (60 seconds on most), so it never reuses a connection
+# that the worker is closing
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = timeout
+
+# Heartbeat files on a RAM disk so a slow container disk cannot stall workers
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+accesslog = "-"
+
+# Gunicorn sets raw_env before it preloads the app, so the workers read
+# their pool size from it like from the rest of the environment
+raw_env = [f"DB_POOL_SIZE={pool_size}", f"DB_MAX_OVERFLOW={max_overflow}"]
+
+# Each worker counts the requests it serves, so /metrics needs a directory
+# where they all write their counters to report the totals of the server
+if workers > 1 and not os.getenv("METRICS_DIR"):
+    shared = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    raw_env.append(f"METRICS_DIR={os.path.join(shared, f'product-metrics-{os.getpid()}')}")
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Drops the request counters left by an earlier server in the same directory"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.metrics import clear_workers
+
+    if os.getenv("METRICS_DIR") and os.path.isdir(os.environ["METRICS_DIR"]):
+        clear_workers(os.environ["METRICS_DIR"])
+
+
+# The master creates the tables once, unless migrations manage the schema
+CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "true").lower() in ("true", "yes", "1")
+
+
+def when_ready(server):
+    """Creates the missing tables, then loads the in-process indexes the preloaded workers share
+
+    Without preload_app, each worker loads its own indexes, see post_worker_init.
+    The connection of the master is closed so it does not hold one of the
+    connections of the workers while they run
+    """
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.models import db, Product, create_schema
+
+    with app.app_context():
+        if CREATE_SCHEMA:
+            create_schema()
+        if server.cfg.preload_app:
+            Product.load_indexes()
+        db.session.remove()
+        db.engine.dispose()
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Gives each worker its own database connections
+
+    The pool created while the app was preloaded is dropped without closing
+    its connections, which still belong to the master process
+    """
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.models import db
+    from service.common.metrics import pool_metrics, request_metrics
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+    pool_metrics.reset()
+    request_metrics.reset()
+
+
+def post_worker_init(worker):
+    """Loads the in-process indexes of a worker that imported the app itself"""
+    if worker.cfg.preload_app:
+        return
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.models import Product
+
+    with app.app_context():
+        Product.load_indexes()
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """Writes the last request counters of a worker before it exits"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.metrics import request_metrics
+
+    request_metrics.flush()
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Keeps the request counters of a worker that exited in the totals"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.metrics import worker_exited
+
+    if os.getenv("METRICS_DIR"):
+        worker_exited(os.environ["METRICS_DIR"], worker.pid)
@@ -0,0 +1,140 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+In-process Indexes
+
+This module holds the caches and indexes of Products that each process
+keeps in memory: the read-through cache of Product.find(), the cached
+JSON of each Product, the name index of the suggestions and the bitmap
+index of the facets. The writes of this process update them right away
+through the write listeners at the end of the module. The writes of
+other workers are found with a fingerprint of the product table, see
+IndexesMixin.sync_indexes().
+"""
+import logging
+from sqlalchemy import select, func
+from service.common.bitmap_index import BitmapIndex, from_bitmap
+from service.common.cache import LRUCache, Freshness
+from service.common.prefix_index import PrefixIndex
+from service.database import db, on_write
+
+logger = logging.getLogger("flask.app")
+
+# Read-through cache of the column values of Products keyed by id
+product_cache = LRUCache()
+
+# Encoded JSON of Products keyed by id, stored with the version it encodes
+# so an entry is never served for a newer version of the Product
+fragment_cache = LRUCache(ttl=float("inf"))
+
+# Names of the Products for autocomplete
+name_index = PrefixIndex()
+
+# Bitmaps of the Products with each category and availability
+bitmap_index = BitmapIndex(("category", "available"))
+
+# What the name and bitmap indexes were last built from or checked against
+index_freshness = Freshness()
+
+
+class IndexesMixin:
+    """Loads and syncs the in-process indexes of a model with id, name, category, available and version columns"""
+
+    @classmethod
+    def load_indexes(cls):
+        """Rebuilds the in-process caches and indexes of Products from the database
+
+        The catalog snapshot is loaded too when it is enabled, see
+        CatalogMixin.load_catalog()
+        """
+        logger.info("Loading in-process indexes")
+        product_cache.clear()
+        fragment_cache.clear()
+        fingerprint = cls._fingerprint()
+        name_index.load(db.session.execute(select(cls.id, cls.name)))
+        bitmap_index.load(db.session.execute(select(cls.id, cls.category, cls.available)))
+        index_freshness.mark_checked(fingerprint)
+        cls.load_catalog()
+
+    @classmethod
+    def sync_indexes(cls):
+        """Rebuilds the name and bitmap indexes once they are stale if other workers changed the Products
+
+        The indexes follow the writes of this worker as they happen. The
+        writes of the other workers are found with the same fingerprint as
+        the catalog, checked at most every INDEX_MAX_STALENESS seconds. One
+        thread rebuilds while the others keep reading the indexes there are,
+        or wait for it when the indexes were never built, and the cached
+        copies of the Products the other workers removed are dropped.
+        """
+        if not index_freshness.is_stale():
+            return
+        # while another thread rebuilds, serve the indexes there are unless there are none
+        if not index_freshness.lock.acquire(blocking=index_freshness.checked_at is None):
+            return
+        try:
+            fingerprint = cls._fingerprint()
+            if fingerprint != index_freshness.fingerprint:
+                logger.info("Rebuilding the name and bitmap indexes")
+                loaded = bitmap_index.match()
+                name_index.load(db.session.execute(select(cls.id, cls.name)))
+                bitmap_index.load(db.session.execute(select(cls.id, cls.category, cls.available)))
+                update_product_cache({}, from_bitmap(loaded & ~bitmap_index.match()))
+            index_freshness.mark_checked(fingerprint)
+        finally:
+            index_freshness.lock.release()
+
+    @classmethod
+    def _fingerprint(cls) -> tuple:
+        """Returns a summary of the product table that changes on every insert, update and delete"""
+        return tuple(db.session.execute(select(func.count(cls.id), func.max(cls.id), func.sum(cls.version))).one())
+
+
+######################################################################
+# Keep the in-process caches and indexes up to date
+######################################################################
+@on_write
+def update_product_cache(changed: dict, deleted: list):
+    """Drops the cached copies and encodings of the Products that were written"""
+    for product_id in list(changed) + list(deleted):
+        product_cache.invalidate(product_id)
+        fragment_cache.invalidate(product_id)
+
+
+@on_write
+def update_bitmap_index(changed: dict, deleted: list):
+    """Moves the Products that were written to the bitmaps of their new values"""
+    index_freshness.mark_changed()
+    for product_id in deleted:
+        bitmap_index.remove(product_id)
+    groups = {}
+    for product_id, values in changed.items():
+        key = tuple((field, values[field]) for field in bitmap_index.fields if field in values)
+        if key:
+            groups.setdefault(key, []).append(product_id)
+    for key, ids in groups.items():
+        bitmap_index.set_many(ids, **dict(key))
+
+
+@on_write
+def update_name_index(changed: dict, deleted: list):
+    """Adds the new names of the Products that were written to the name index"""
+    for product_id in deleted:
+        name_index.remove(product_id)
+    for product_id, values in changed.items():
+        if "name" in values:
+            name_index.add(product_id, values["name"])
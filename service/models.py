@@ -28,23 +28,45 @@ description (string) - the description the product belongs to (i.e., dog, cat)
 available (boolean) - True for products that are available for adoption
 
 """
+import io
+import csv
+import hashlib
 import logging
+from itertools import islice
 from enum import Enum
 from decimal import Decimal
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import tuple_, insert, update, delete, select, func, event, DDL, inspect
+from sqlalchemy.orm import make_transient_to_detached
+from service.common.metrics import InstrumentedQueuePool, pool_metrics
+from service.common.query_log import query_log
+from service.common.pagination import encode_cursor, decode_cursor, NEXT, PREV
+from service.common.validation import Validator
+from service.database import db, notify_write
+from service.indexes import IndexesMixin, product_cache, fragment_cache, bitmap_index, index_freshness
+from service.catalog import CatalogMixin, catalog
+from service.search import SearchMixin, SEARCH_DDL, SEARCH_DROP_DDL, BULK_INSERT_SQL, TRUNCATE_SQL
 
 logger = logging.getLogger("flask.app")
 
-# Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
-
 
 def init_db(app):
     """Initialize the SQLAlchemy app"""
     Product.init_db(app)
 
 
+def create_schema():
+    """Creates the tables and indexes that are missing from the database
+
+    It is a step of its own, run once by flask db-init or by the gunicorn
+    master before it forks the workers, rather than on every import
+    """
+    logger.info("Creating the missing tables")
+    db.create_all()
+    Product.add_version_column()
+    Product.create_search_index()
+
+
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
@@ -60,7 +82,75 @@ class Category(Enum):
     TOOLS = 5
 
 
-class Product(db.Model):
+# The most characters of the string columns of a Product
+NAME_MAX_LENGTH = 100
+DESCRIPTION_MAX_LENGTH = 250
+
+
+def _string_parser(max_length: int):
+    """Returns a parser of the strings of at most max_length characters"""
+
+    def parse(field: str, value) -> str:
+        if not isinstance(value, str):
+            raise DataValidationError(f"Invalid type for string [{field}]: {type(value)}")
+        if len(value) > max_length:
+            raise DataValidationError(f"Invalid length for string [{field}]: longer than {max_length}")
+        return value
+
+    return parse
+
+
+def _parse_decimal(field: str, value) -> Decimal:
+    try:
+        number = Decimal(value)
+    except (ArithmeticError, TypeError, ValueError) as error:
+        raise DataValidationError(f"Invalid value for decimal [{field}]: {value}") from error
+    if not number.is_finite():
+        raise DataValidationError(f"Invalid value for decimal [{field}]: {value}")
+    return number
+
+
+def _parse_boolean(field: str, value) -> bool:
+    if not isinstance(value, bool):
+        raise DataValidationError(f"Invalid type for boolean [{field}]: {type(value)}")
+    return value
+
+
+def _parse_category(field: str, value) -> Category:
+    try:
+        return Category[value]
+    except (KeyError, TypeError) as error:
+        raise DataValidationError(f"Invalid attribute: {field} {value}") from error
+
+
+# Validates and converts each field that can be changed in bulk
+CHANGE_PARSERS = {
+    "name": _string_parser(NAME_MAX_LENGTH),
+    "description": _string_parser(DESCRIPTION_MAX_LENGTH),
+    "price": _parse_decimal,
+    "available": _parse_boolean,
+    "category": _parse_category,
+}
+
+# Checks and converts every field of a new Product, reporting all of the errors at once
+product_validator = Validator(
+    {
+        "name": CHANGE_PARSERS["name"],
+        "description": CHANGE_PARSERS["description"],
+        "price": _parse_decimal,
+        "available": bool,
+        "category": _parse_category,
+    },
+    error=DataValidationError,
+    missing="Invalid product: missing {}",
+    invalid="Invalid product: body of request contained bad or no data",
+)
+
+# The fields of a Product that clients can set
+FIELDS = product_validator.fields
+
+
+class Product(IndexesMixin, CatalogMixin, SearchMixin, db.Model):
     """
     Class that represents a Product
 
@@ -72,13 +162,32 @@ class Product(db.Model):
     # Table Schema
     ##################################################
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.String(250), nullable=False)
+    name = db.Column(db.String(NAME_MAX_LENGTH), nullable=False)
+    description = db.Column(db.String(DESCRIPTION_MAX_LENGTH), nullable=False)
     price = db.Column(db.Numeric, nullable=False)
     available = db.Column(db.Boolean(), nullable=False, default=True)
     category = db.Column(
         db.Enum(Category), nullable=False, server_default=(Category.UNKNOWN.name)
     )
+    # incremented on every change so clients can tell when a Product changed
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    # Composite indexes serving the filter combinations of find_by_filters()
+    # with the equality columns first and the price range last. Their
+    # leading columns also serve find_by_name(), find_by_category() and
+    # find_by_availability(). The (price, id) and (name, id) indexes serve
+    # find_by_price() and the sorted pages of paginate() in index order.
+    # Use "flask db-indexes" to build any that are missing from a database.
+    # SQLite uses AUTOINCREMENT so that, like PostgreSQL, it never gives the
+    # id of a removed Product to a new one, whose ETag would be the same.
+    __table_args__ = (
+        db.Index("ix_product_name_category_available", "name", "category", "available"),
+        db.Index("ix_product_category_available_price", "category", "available", "price"),
+        db.Index("ix_product_available_price", "available", "price"),
+        db.Index("ix_product_price", "price", "id"),
+        db.Index("ix_product_name", "name", "id"),
+        {"sqlite_autoincrement": True},
+    )
 
     ##################################################
     # INSTANCE METHODS
@@ -95,7 +204,11 @@ class Product(db.Model):
         # id must be none to generate next primary key
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
+        db.session.flush()
+        values = self.values()
+        values["version"] = self.version
         db.session.commit()
+        notify_write(changed={self.id: values})
 
     def update(self):
         """
@@ -104,71 +217,117 @@ class Product(db.Model):
         logger.info("Saving %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
+        values = self.values()
+        self.version = Product.version + 1
         db.session.commit()
+        notify_write(changed={self.id: values})
 
     def delete(self):
         """Removes a Product from the data store"""
         logger.info("Deleting %s", self.name)
+        product_id = self.id
         db.session.delete(self)
         db.session.commit()
+        notify_write(deleted=[product_id])
+
+    def values(self) -> dict:
+        """Returns the values of the fields of a Product keyed by name"""
+        return {field: getattr(self, field) for field in FIELDS}
+
+    @property
+    def etag(self) -> str:
+        """Returns an entity tag that changes whenever the Product changes"""
+        return f"{self.id}-{self.version}"
 
     def serialize(self) -> dict:
         """Serializes a Product into a dictionary"""
+        return self.serialize_row(self)
+
+    @staticmethod
+    def serialize_row(row) -> dict:
+        """Serializes a row of the columns of a Product into a dictionary
+
+        A row returned by the row queries serializes exactly like the
+        Product it was read from, without loading that Product.
+        """
         return {
-            "id": self.id,
-            "name": self.name,
-            "description": self.description,
-            "price": str(self.price),
-            "available": self.available,
-            "category": self.category.name  # convert enum to string
+            "id": row.id,
+            "name": row.name,
+            "description": row.description,
+            "price": str(row.price),
+            "available": row.available,
+            "category": row.category.name  # convert enum to string
         }
 
     def deserialize(self, data: dict):
         """
         Deserializes a Product from a dictionary
+        Every field is checked by product_validator, and the errors of all
+        of them are reported together
         Args:
             data (dict): A dictionary containing the Product data
         """
-        try:
-            self.name = data["name"]
-            if not isinstance(self.name, str):  # Validate that name is a string
-                raise DataValidationError("Invalid type for string [name]: " + str(type(self.name)))
-            self.description = data["description"]
-            self.price = Decimal(data["price"])
-            if isinstance(data["available"], bool):
-                self.available = data["available"]
-            else:
-                raise DataValidationError(
-                    "Invalid type for boolean [available]: " + str(type(data["available"]))
-                )
-            self.category = getattr(Category, data["category"])  # Create enum from string
-        except AttributeError as error:
-            raise DataValidationError("Invalid attribute: " + error.args[0]) from error
-        except KeyError as error:
-            raise DataValidationError("Invalid product: missing " + error.args[0]) from error
-        except TypeError as error:
-            raise DataValidationError(
-                "Invalid product: body of request contained bad or no data " + str(error)
-            ) from error
+        for field, value in product_validator.validate(data).items():
+            setattr(self, field, value)
         return self
 
     ##################################################
     # CLASS METHODS
     ##################################################
 
+    @classmethod
+    def deserialize_changes(cls, data: dict) -> dict:
+        """
+        Deserializes changes to a Product from a dictionary
+        Unlike deserialize() every field is optional, but the fields that
+        are present are validated the same way
+        Args:
+            data (dict): A dictionary containing some of the Product data
+        """
+        if not isinstance(data, dict) or not data:
+            raise DataValidationError("Invalid changes: body of request contained bad or no data")
+        changes = {}
+        for field, value in data.items():
+            if field not in CHANGE_PARSERS:
+                raise DataValidationError(f"Invalid attribute: {field}")
+            changes[field] = CHANGE_PARSERS[field](field, value)
+        return changes
+
     @classmethod
     def init_db(cls, app: Flask):
         """Initializes the database session
 
+        Nothing is sent to the database: the tables are made by create_schema()
+        and the in-process indexes are loaded by load_indexes(), or on their
+        first use.
+
         :param app: the Flask app
         :type data: Flask
 
         """
         logger.info("Initializing database")
         # This is where we initialize SQLAlchemy from the Flask app
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {}).setdefault("poolclass", InstrumentedQueuePool)
         db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        pool_metrics.instrument(db.engine)
+        query_log.instrument(db.engine)
+        query_log.configure(
+            threshold=app.config.get("SLOW_QUERY_THRESHOLD_MS", 100) / 1000,
+            size=app.config.get("SLOW_QUERY_LOG_SIZE"),
+            explain=app.config.get("SLOW_QUERY_EXPLAIN"),
+        )
+        product_cache.configure(
+            maxsize=app.config.get("PRODUCT_CACHE_SIZE"),
+            ttl=app.config.get("PRODUCT_CACHE_TTL"),
+            enabled=app.config.get("PRODUCT_CACHE_ENABLED"),
+        )
+        fragment_cache.configure(maxsize=app.config.get("FRAGMENT_CACHE_SIZE"))
+        catalog.configure(
+            enabled=app.config.get("CATALOG_ENABLED"),
+            max_staleness=app.config.get("CATALOG_MAX_STALENESS"),
+        )
+        index_freshness.max_staleness = app.config.get("INDEX_MAX_STALENESS", 5.0)
 
     @classmethod
     def all(cls) -> list:
@@ -177,18 +336,39 @@ class Product(db.Model):
         return cls.query.all()
 
     @classmethod
-    def find(cls, product_id: int):
+    def find(cls, product_id: int, cached: bool = True):
         """Finds a Product by it's ID
 
+        A Product about to be changed or deleted must be found with cached
+        set to False: it is then read from the database, since a cached copy
+        may miss the writes of other workers, which the update would undo or
+        the delete would not notice.
+
         :param product_id: the id of the Product to find
         :type product_id: int
 
+        :param cached: whether a copy from the product cache will do
+        :type cached: bool
+
         :return: an instance with the product_id, or None if not found
         :rtype: Product
 
         """
         logger.info("Processing lookup for id %s ...", product_id)
-        return cls.query.get(product_id)
+        if not cached:
+            return db.session.get(cls, product_id, populate_existing=True)
+        values = product_cache.get(product_id)
+        if values is not None:
+            # attach a copy of the cached row to the session without a SELECT
+            product = cls(**values)
+            make_transient_to_detached(product)
+            return db.session.merge(product, load=False)
+        product = db.session.get(cls, product_id)
+        if product is not None:
+            product_cache.set(
+                product_id, {attr.key: getattr(product, attr.key) for attr in cls.__mapper__.column_attrs}
+            )
+        return product
 
     @classmethod
     def find_by_name(cls, name: str) -> list:
@@ -202,6 +382,8 @@ class Product(db.Model):
 
         """
         logger.info("Processing name query for %s ...", name)
+        if catalog.enabled:
+            return cls._find_in_catalog(name=name)
         return cls.query.filter(cls.name == name)
 
     @classmethod
@@ -219,8 +401,30 @@ class Product(db.Model):
         price_value = price
         if isinstance(price, str):
             price_value = Decimal(price.strip(' "'))
+        if catalog.enabled:
+            return cls._find_in_catalog(price=price_value)
         return cls.query.filter(cls.price == price_value).all()
 
+    @classmethod
+    def find_by_price_range(cls, min_price: Decimal = None, max_price: Decimal = None):
+        """Returns all Products with a price in a range
+
+        :param min_price: the lowest price to match, or None for no lower bound
+        :type min_price: Decimal
+        :param max_price: the highest price to match, or None for no upper bound
+        :type max_price: Decimal
+
+        :return: a query of the Products within that price range
+        :rtype: Query
+
+        """
+        logger.info("Processing price range query for %s to %s ...", min_price, max_price)
+        if isinstance(min_price, str):
+            min_price = Decimal(min_price.strip(' "'))
+        if isinstance(max_price, str):
+            max_price = Decimal(max_price.strip(' "'))
+        return cls.query.filter(*cls.filter_criteria(min_price=min_price, max_price=max_price))
+
     @classmethod
     def find_by_availability(cls, available: bool = True) -> list:
         """Returns all Products by their availability
@@ -247,12 +451,490 @@ class Product(db.Model):
 
         """
         logger.info("Processing category query for %s ...", category.name)
+        if catalog.enabled:
+            return cls._find_in_catalog(category=category.value)
         return cls.query.filter(cls.category == category)
 
     @classmethod
     def find_by_availability(cls, available: bool = True) -> list:
         """Returns all Products by their availability"""
         logger.info("Processing available query for %s ...", available)
+        if catalog.enabled:
+            return cls._find_in_catalog(available=available)
         return cls.query.filter(cls.available == available).all()
 
-    
+    @classmethod
+    def create_many(cls, products: list) -> list:
+        """Creates many Products in the database in a single transaction
+
+        The rows are written with multi-row INSERT statements instead of
+        one INSERT and one commit per Product.
+
+        :param products: the Products to create
+        :type products: list
+
+        :return: the ids of the new Products in the same order
+        :rtype: list
+
+        """
+        logger.info("Creating %d Products", len(products))
+        return cls.create_rows([product.values() for product in products])
+
+    @classmethod
+    def create_rows(cls, rows: list) -> list:
+        """Creates many Products from the values of their fields in a single transaction
+
+        The values are not checked: they come from product_validator or
+        from Products
+
+        :param rows: the values of each Product keyed by field name
+        :type rows: list
+
+        :return: the ids of the new Products in the same order
+        :rtype: list
+
+        """
+        if not rows:
+            return []
+        ids = db.session.scalars(insert(cls).returning(cls.id), rows).all()
+        db.session.commit()
+        notify_write(changed={product_id: dict(row, version=1) for product_id, row in zip(ids, rows)})
+        return ids
+
+    @classmethod
+    def bulk_insert(cls, rows, chunk_size: int = 10000) -> int:
+        """Writes a large number of Products as fast as the database takes them
+
+        On PostgreSQL each chunk of rows is streamed with COPY and committed.
+        On SQLite the chunks are written with executemany INSERT statements
+        in a single transaction, without the full text index trigger, and
+        the index is rebuilt once at the end. Unlike create_many, the ids
+        are not returned and the in-process caches and indexes are not
+        told: call load_indexes afterwards if this process serves requests.
+
+        :param rows: the values of each Product keyed by field name
+        :type rows: iterable
+        :param chunk_size: the number of rows written per statement
+        :type chunk_size: int
+
+        :return: the number of Products written
+        :rtype: int
+
+        """
+        logger.info("Bulk inserting Products in chunks of %d", chunk_size)
+        dialect = db.engine.dialect.name
+        before, after = BULK_INSERT_SQL.get(dialect, ([], []))
+        if before:
+            # the triggers it drops and makes again must have an index to update
+            cls.create_search_index()
+        for statement in before:
+            db.session.execute(db.text(statement))
+        rows = iter(rows)
+        count = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            if dialect == "postgresql":
+                cls._copy(chunk)
+                db.session.commit()
+            else:
+                db.session.execute(insert(cls.__table__), chunk)
+            count += len(chunk)
+        for statement in after:
+            db.session.execute(db.text(statement))
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def _copy(rows: list):
+        """Streams rows into the product table with COPY FROM STDIN"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row["name"], row["description"], row["price"], row["available"], row["category"].name])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY product ({', '.join(FIELDS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+
+    @classmethod
+    def remove_all(cls):
+        """Removes every Product at once
+
+        The table is truncated instead of deleting its rows one at a time,
+        and the in-process caches and indexes of this process are emptied.
+        The ids go on from the last one, so the other workers never serve a
+        cached copy or an ETag of a removed Product for a new one.
+        """
+        logger.info("Removing all Products")
+        if db.engine.dialect.name == "sqlite":
+            # its statements drop and make again a trigger of the full text index
+            cls.create_search_index()
+        for statement in TRUNCATE_SQL.get(db.engine.dialect.name, ["DELETE FROM product"]):
+            db.session.execute(db.text(statement))
+        db.session.commit()
+        cls.load_indexes()
+
+    @classmethod
+    def update_many(cls, changes: dict, ids: list = None, **filters) -> list:
+        """Applies the same changes to many Products with a single UPDATE
+
+        :param changes: the new values keyed by field name
+        :type changes: dict
+        :param ids: the ids of the Products to change, or None for any id
+        :type ids: list
+        :param filters: the filters the Products to change must match
+
+        :return: the ids of the Products that were changed
+        :rtype: list
+
+        """
+        logger.info("Updating Products with ids %s and filters %s", ids, filters)
+        criteria = cls._bulk_criteria(ids, filters)
+        statement = update(cls).where(*criteria).values(**changes, version=cls.version + 1).returning(cls.id)
+        ids = db.session.scalars(statement.execution_options(synchronize_session=False)).all()
+        db.session.commit()
+        notify_write(changed={product_id: changes for product_id in ids})
+        return sorted(ids)
+
+    @classmethod
+    def update_each(cls, items: list) -> list:
+        """Applies different changes to many Products in a single transaction
+
+        The Products are not loaded: the rows are changed by primary key
+        with an UPDATE statement executed once per distinct set of fields.
+
+        :param items: the new values of each Product keyed by field name and
+            including the id of the Product to change
+        :type items: list
+
+        :return: the ids of the Products that were changed
+        :rtype: list
+
+        """
+        logger.info("Updating %d Products", len(items))
+        ids = [item["id"] for item in items]
+        found = set(db.session.scalars(select(cls.id).where(cls.id.in_(ids))))
+        rows = [item for item in items if item["id"] in found]
+        if rows:
+            db.session.execute(update(cls), rows)
+            db.session.execute(
+                update(cls).where(cls.id.in_(found)).values(version=cls.version + 1),
+                execution_options={"synchronize_session": False},
+            )
+        db.session.commit()
+        notify_write(changed={row["id"]: {k: v for k, v in row.items() if k != "id"} for row in rows})
+        return [product_id for product_id in ids if product_id in found]
+
+    @classmethod
+    def delete_many(cls, ids: list = None, **filters) -> list:
+        """Removes many Products from the data store with a single DELETE
+
+        :param ids: the ids of the Products to delete, or None for any id
+        :type ids: list
+        :param filters: the filters the Products to delete must match
+
+        :return: the ids of the Products that were deleted
+        :rtype: list
+
+        """
+        logger.info("Deleting Products with ids %s and filters %s", ids, filters)
+        criteria = cls._bulk_criteria(ids, filters)
+        statement = delete(cls).where(*criteria).returning(cls.id)
+        ids = db.session.scalars(statement.execution_options(synchronize_session=False)).all()
+        db.session.commit()
+        notify_write(deleted=ids)
+        return sorted(ids)
+
+    @classmethod
+    def _bulk_criteria(cls, ids: list, filters: dict) -> list:
+        """Returns the criteria of a bulk statement, refusing to match every row"""
+        criteria = cls.filter_criteria(**filters)
+        if ids is not None:
+            criteria.append(cls.id.in_(ids))
+        if not criteria:
+            raise DataValidationError("Bulk changes need ids or filters")
+        return criteria
+
+    @classmethod
+    def find_by_filters(cls, **filters):
+        """Returns a query for the Products matching all of the given filters
+
+        The filters are combined into a single query that the composite
+        indexes of the table can serve.
+
+        :param name: the name of the Products to match
+        :type name: str
+        :param category: the Category of the Products to match
+        :type category: enum
+        :param available: True for products that are available
+        :type available: bool
+        :param min_price: the lowest price of the Products to match
+        :type min_price: Decimal
+        :param max_price: the highest price of the Products to match
+        :type max_price: Decimal
+
+        :return: a query of the Products matching every filter that is not None
+        :rtype: Query
+
+        """
+        logger.info("Processing filter query for %s ...", filters)
+        return cls.query.filter(*cls.filter_criteria(**filters))
+
+    @classmethod
+    def find_rows_by_filters(cls, **filters):
+        """Returns a query for the rows of the Products matching all of the given filters
+
+        It takes the same filters as find_by_filters(), but the query returns
+        plain rows of the columns of the Products instead of Product instances,
+        so reading a large listing skips the work of tracking each Product in
+        the session. Use serialize_row() to serialize the rows.
+        """
+        logger.info("Processing row query for %s ...", filters)
+        return db.session.query(*cls.row_columns()).filter(*cls.filter_criteria(**filters))
+
+    @classmethod
+    def row_columns(cls) -> list:
+        """Returns the columns read by the row queries"""
+        return [cls.id, cls.name, cls.description, cls.price, cls.available, cls.category, cls.version]
+
+    @classmethod
+    def select_rows_where(cls, **filters):
+        """Returns a select statement of the rows of the Products matching all of the given filters
+
+        It takes the same filters as find_rows_by_filters() and can be run
+        on any session, including an async one.
+        """
+        return select(*cls.row_columns()).where(*cls.filter_criteria(**filters))
+
+    @classmethod
+    def filter_criteria(
+        cls,
+        name: str = None,
+        category: Category = None,
+        available: bool = None,
+        min_price: Decimal = None,
+        max_price: Decimal = None,
+    ) -> list:
+        """Returns the SQL criteria that match the given filters"""
+        # pylint: disable=too-many-arguments
+        criteria = []
+        if name is not None:
+            criteria.append(cls.name == name)
+        if category is not None:
+            criteria.append(cls.category == category)
+        if available is not None:
+            criteria.append(cls.available == available)
+        if min_price is not None:
+            criteria.append(cls.price >= min_price)
+        if max_price is not None:
+            criteria.append(cls.price <= max_price)
+        return criteria
+
+    @classmethod
+    def facets(cls, **filters) -> dict:
+        """Returns how many Products match the filters and how many of them have each category and availability
+
+        Filters on the category and availability alone are answered from the
+        bitmap index with no query. Any other filter is counted by the
+        database with a single grouped query.
+
+        :return: the count of the matching Products, and their counts by
+            Category and by availability including the values none of them have
+        :rtype: dict
+
+        """
+        logger.info("Processing facet counts for %s ...", filters)
+        if set(filters) <= set(bitmap_index.fields):
+            cls.sync_indexes()
+            counts = bitmap_index.facets(**filters)
+            total = bitmap_index.count(**filters)
+        else:
+            statement = (
+                select(cls.category, cls.available, func.count())
+                .where(*cls.filter_criteria(**filters))
+                .group_by(cls.category, cls.available)
+            )
+            counts = {"category": {}, "available": {}}
+            total = 0
+            for category, available, count in db.session.execute(statement):
+                counts["category"][category] = counts["category"].get(category, 0) + count
+                counts["available"][available] = counts["available"].get(available, 0) + count
+                total += count
+        return {
+            "count": total,
+            "category": {category: counts["category"].get(category, 0) for category in Category},
+            "available": {available: counts["available"].get(available, 0) for available in (True, False)},
+        }
+
+    @classmethod
+    def paginate(cls, query, limit: int, cursor: str = None, sort: str = "id") -> tuple:
+        """Returns one page of a query using keyset pagination
+
+        Rows are ordered by their sort key and id, and a page starts right
+        after (or right before) the row recorded in the cursor, so the cost
+        of a page does not depend on how deep into the results it is. With
+        an index on the sort keys the database reads just limit + 1 rows
+        in index order instead of sorting every match.
+
+        :param query: the query to paginate
+        :type query: Query
+        :param limit: the maximum number of Products to return
+        :type limit: int
+        :param cursor: a token returned by a previous call, or None for the first page
+        :type cursor: str
+        :param sort: id, price or name, prefixed with - to sort in descending order
+        :type sort: str
+
+        :return: a (products, next_cursor, prev_cursor) tuple
+        :rtype: tuple
+
+        """
+        query, direction = cls.page_query(query, limit, cursor, sort)
+        return cls.page_of(query.all(), limit, cursor, sort, direction)
+
+    @classmethod
+    def page_query(cls, query, limit: int, cursor: str = None, sort: str = "id") -> tuple:
+        """Returns a query or select narrowed to the rows of a page, and the direction of the cursor
+
+        It is the first half of paginate(), for a select statement that is
+        run on another session, such as an async one. Pass the rows it
+        returns to page_of().
+        """
+        keys = cls.sort_keys(sort)
+        direction = NEXT
+        if cursor:
+            values, direction = cls._decode_page_cursor(cursor, sort, keys)
+        # walking backwards through the pages reads the rows in reverse order
+        ascending = (direction == NEXT) != sort.startswith("-")
+        if cursor:
+            if ascending:
+                query = query.filter(tuple_(*keys) > tuple_(*values))
+            else:
+                query = query.filter(tuple_(*keys) < tuple_(*values))
+        query = query.order_by(*[key if ascending else key.desc() for key in keys])
+        return query.limit(limit + 1), direction
+
+    @classmethod
+    def page_of(cls, products: list, limit: int, cursor: str, sort: str, direction: str) -> tuple:
+        """Returns the (products, next_cursor, prev_cursor) of the rows read by a page_query()"""
+        keys = cls.sort_keys(sort)
+        has_more = len(products) > limit
+        products = list(products[:limit])
+        if direction == PREV:
+            products.reverse()
+
+        def _cursor(product, towards):
+            return encode_cursor(sort, [getattr(product, key.key) for key in keys], towards)
+
+        next_cursor = prev_cursor = None
+        if products:
+            if has_more or direction == PREV:
+                next_cursor = _cursor(products[-1], NEXT)
+            if (has_more and direction == PREV) or (cursor and direction == NEXT):
+                prev_cursor = _cursor(products[0], PREV)
+        return products, next_cursor, prev_cursor
+
+    @staticmethod
+    def etag_of(products: list) -> str:
+        """Returns an entity tag that changes whenever a list of Products changes"""
+        digest = hashlib.sha1()
+        for product in products:
+            digest.update(f"{product.id}-{product.version};".encode("ascii"))
+        return digest.hexdigest()
+
+    @classmethod
+    def add_version_column(cls) -> bool:
+        """Adds the version column of the ETags to a product table made before it existed
+
+        Every Product there is starts at version 1.
+
+        :return: True if the column was missing
+        :rtype: bool
+
+        """
+        columns = {column["name"] for column in inspect(db.engine).get_columns(cls.__tablename__)}
+        if "version" in columns:
+            return False
+        logger.info("Adding the version column of the Products")
+        db.session.execute(db.text(VERSION_COLUMN_DDL))
+        db.session.commit()
+        return True
+
+    @classmethod
+    def stream(cls, query, chunk_size: int = 1000, sort: str = "id"):
+        """Yields the Products of a query without loading them all at once
+
+        Rows are fetched chunk_size at a time through a server-side cursor
+        where the database supports one, so memory use stays flat however
+        many rows the query returns.
+
+        :param query: the query to stream
+        :type query: Query
+        :param chunk_size: the number of rows to fetch per round trip
+        :type chunk_size: int
+        :param sort: id, price or name, prefixed with - to sort in descending order
+        :type sort: str
+
+        :return: a generator of Products in sort order
+        :rtype: generator
+
+        """
+        logger.info("Processing streamed query in chunks of %s ...", chunk_size)
+        yield from cls.sorted_by(query, sort).yield_per(chunk_size)
+
+    @classmethod
+    def sort_keys(cls, sort: str = "id") -> list:
+        """Returns the columns to order by for a sort, ending with the id to break ties"""
+        column = {"id": cls.id, "price": cls.price, "name": cls.name}.get(sort.lstrip("-"))
+        if column is None or sort.count("-") > 1:
+            raise DataValidationError(f"Invalid sort: {sort}")
+        return [column] if column is cls.id else [column, cls.id]
+
+    @classmethod
+    def sorted_by(cls, query, sort: str = "id"):
+        """Returns a query ordered by a sort, prefixed with - to sort in descending order"""
+        keys = cls.sort_keys(sort)
+        if sort.startswith("-"):
+            keys = [key.desc() for key in keys]
+        return query.order_by(*keys)
+
+    @staticmethod
+    def _decode_page_cursor(cursor: str, sort: str, keys: list) -> tuple:
+        """Returns the typed key values and direction recorded in a cursor
+
+        encode_cursor() records every value as a string, so anything else
+        is a cursor it did not make and is refused like one
+        """
+        try:
+            cursor_sort, values, direction = decode_cursor(cursor)
+            if cursor_sort != sort or len(values) != len(keys) or not all(isinstance(value, str) for value in values):
+                raise ValueError(f"Invalid cursor: {cursor}")
+            values = [key.type.python_type(value) for key, value in zip(keys, values)]
+            if any(isinstance(value, Decimal) and not value.is_finite() for value in values):
+                raise ValueError(f"Invalid cursor: {cursor}")
+        except (ValueError, ArithmeticError, TypeError, KeyError) as error:
+            raise DataValidationError(f"Invalid cursor: {cursor}") from error
+        return values, direction
+
+
+# The version column of the ETags, for product tables made before it
+VERSION_COLUMN_DDL = "ALTER TABLE product ADD COLUMN version INTEGER NOT NULL DEFAULT 1"
+
+
+######################################################################
+# Full text index of the name and description of Products
+######################################################################
+def _register_search_ddl():
+    """Makes the full text index of the Products with their table, and drops it with the table"""
+    for dialect, statements in SEARCH_DDL.items():
+        for statement in statements:
+            event.listen(Product.__table__, "after_create", DDL(statement).execute_if(dialect=dialect))
+    for dialect, statement in SEARCH_DROP_DDL.items():
+        event.listen(Product.__table__, "after_drop", DDL(statement).execute_if(dialect=dialect))
+
+
+_register_search_ddl()
@@ -18,12 +18,74 @@
 """
 Product Store Service with UI
 """
-from flask import jsonify, request, abort
-from flask import url_for  # noqa: F401 pylint: disable=unused-import
-from service.models import Product , DataValidationError , Category
+import time
+from flask import jsonify, request, abort, Response, stream_with_context
+from flask import url_for, g
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import Product , DataValidationError , db, product_validator
+from service.indexes import product_cache, fragment_cache, name_index, bitmap_index
+from service.catalog import catalog
+from service.common.metrics import pool_metrics, request_metrics, to_prometheus
+from service.common.query_log import query_log
+from service.common.query_args import parse_filters, parse_page_limit
 from service.common import status  # HTTP Status Codes
 from . import app
 
+JSON_MIMETYPE = "application/json"
+NDJSON_MIMETYPE = "application/x-ndjson"
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+request_metrics.configure(app.config.get("METRICS_DIR"), app.config.get("METRICS_FLUSH_INTERVAL"))
+
+
+######################################################################
+# R E Q U E S T   M E T R I C S
+######################################################################
+def request_route() -> str:
+    """Returns the route template of the request, so every product id counts as one route"""
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+def start_request_metrics():
+    """Counts the request as in flight and starts its clock"""
+    g.metrics_start = time.perf_counter()
+    g.metrics_route = request_route()
+    g.metrics_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+    request_metrics.started(request.method, g.metrics_route)
+    query_log.start(f"{request.method} {g.metrics_route}")
+
+
+@app.after_request
+def record_response_status(response):
+    """Remembers the status of the response, including those of the error handlers
+
+    The statements the request ran so far and their time in the database
+    are sent in the Server-Timing header. A streamed response runs more of
+    them while it is sent, which the header cannot include.
+    """
+    g.metrics_status = response.status_code
+    count, seconds = query_log.current()
+    queries = "1 query" if count == 1 else f"{count} queries"
+    response.headers.add("Server-Timing", f'db;dur={seconds * 1000:.2f};desc="{queries}"')
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error=None):  # pylint: disable=unused-argument
+    """Counts the request once its response has been sent, streamed ones included"""
+    if "metrics_start" in g:
+        request_metrics.finished(
+            request.method, g.metrics_route, g.metrics_status, time.perf_counter() - g.metrics_start
+        )
+    query_log.stop()
+
+
+@app.route("/metrics")
+def metrics():
+    """Returns the request counters of every worker in the Prometheus text format"""
+    return Response(to_prometheus(request_metrics.collect()), content_type=PROMETHEUS_MIMETYPE)
+
 
 ######################################################################
 # H E A L T H   C H E C K
@@ -34,6 +96,65 @@ def healthcheck():
     return jsonify(status=200, message="OK"), status.HTTP_200_OK
 
 
+######################################################################
+# S T A T I S T I C S
+######################################################################
+@app.route("/stats")
+def stats():
+    """Returns the counters of the in-process caches, indexes and connection pool of this worker"""
+    return jsonify(
+        product_cache=product_cache.stats(),
+        fragment_cache=fragment_cache.stats(),
+        catalog=catalog.stats(),
+        bitmap_index=bitmap_index.stats(),
+        pool=pool_metrics.stats(db.engine.pool),
+    ), status.HTTP_200_OK
+
+
+######################################################################
+# S L O W   Q U E R I E S
+######################################################################
+@app.route("/admin/slow-queries", methods=["GET"])
+def list_slow_queries():
+    """Returns the statements of this worker slower than SLOW_QUERY_THRESHOLD_MS, the most recent first
+
+    Their bound parameters are replaced by their types
+    """
+    return jsonify(
+        threshold_ms=query_log.threshold * 1000,
+        explain=query_log.explain,
+        queries=query_log.slow_queries(),
+    ), status.HTTP_200_OK
+
+
+@app.route("/admin/slow-queries", methods=["DELETE"])
+def clear_slow_queries():
+    """Empties the slow query log of this worker"""
+    query_log.clear()
+    return "", status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+# R E S E T   T H E   P R O D U C T S
+######################################################################
+@app.route("/admin/reset", methods=["POST"])
+def reset_products():
+    """Removes every Product, for test environments
+
+    It only exists when RESET_ENABLED is set. The ids of the removed
+    Products are never given to new ones, so no worker serves a cached
+    copy or an ETag of a removed Product for a new one. The other workers
+    find out about the reset like about any delete: they drop their cached
+    copies at their next index or catalog sync, and until then may serve
+    a removed Product by id for up to PRODUCT_CACHE_TTL seconds.
+    """
+    if not app.config.get("RESET_ENABLED"):
+        abort(status.HTTP_404_NOT_FOUND, "The reset endpoint is not enabled.")
+    app.logger.warning("Request to Remove all Products")
+    Product.remove_all()
+    return "", status.HTTP_204_NO_CONTENT
+
+
 ######################################################################
 # H O M E   P A G E
 ######################################################################
@@ -65,6 +186,156 @@ def check_content_type(content_type):
     )
 
 
+def get_batch() -> list:
+    """Returns the list of items posted to a batch endpoint"""
+    data = request.get_json()
+    if not isinstance(data, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be a list")
+    check_batch_size(len(data))
+    return data
+
+
+def check_batch_size(count: int):
+    """Checks that a batch request is not too large"""
+    if count > app.config["BATCH_SIZE_MAX"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"A batch can contain at most {app.config['BATCH_SIZE_MAX']} items",
+        )
+
+
+def batch_errors(errors: list):
+    """Returns a 400_BAD_REQUEST response listing the errors of each batch item"""
+    message = f"{len(errors)} items in the batch are not valid"
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_400_BAD_REQUEST,
+            error="Bad Request",
+            message=message,
+            errors=errors,
+        ),
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def is_id(value) -> bool:
+    """Checks that a value from a JSON body is a Product id"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def get_item_changes(item) -> dict:
+    """Returns the id and the changes of one item of a bulk update"""
+    if not isinstance(item, dict) or not is_id(item.get("id")):
+        raise DataValidationError("Invalid item: id must be an integer")
+    changes = Product.deserialize_changes({key: value for key, value in item.items() if key != "id"})
+    changes["id"] = item["id"]
+    return changes
+
+
+def get_bulk_selection(data) -> tuple:
+    """Returns the ids and the filters that select the Products of a bulk request"""
+    if not isinstance(data, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be an object")
+    ids = data.get("ids")
+    if ids is not None:
+        if not isinstance(ids, list) or not all(is_id(value) for value in ids):
+            abort(status.HTTP_400_BAD_REQUEST, "ids must be a list of integers")
+        check_batch_size(len(ids))
+    filters = data.get("filter") or {}
+    if not isinstance(filters, dict) or not set(filters) <= {"name", "category", "available"}:
+        abort(status.HTTP_400_BAD_REQUEST, "filter can only match name, category and available")
+    if filters:
+        filters = Product.deserialize_changes(filters)
+    if ids is None and not filters:
+        abort(status.HTTP_400_BAD_REQUEST, "Request must select Products with ids or a filter")
+    return ids, filters
+
+
+def get_page_limit() -> int:
+    """Returns the page size requested with the limit query parameter"""
+    return parse_page_limit(request.args, app.config["PAGE_SIZE_DEFAULT"], app.config["PAGE_SIZE_MAX"])
+
+
+def page_url(limit: int, cursor: str) -> str:
+    """Returns the url of the page of the current listing at cursor"""
+    args = request.args.to_dict()
+    args.update(limit=limit, cursor=cursor)
+    return url_for("list_products", _external=True, **args)
+
+
+def search_url(limit: int, offset: int) -> str:
+    """Returns the url of the page of the current search at offset"""
+    args = request.args.to_dict()
+    args.update(limit=limit, offset=offset)
+    return url_for("search_products", _external=True, **args)
+
+
+def not_modified(etag: str):
+    """Returns a 304_NOT_MODIFIED response if the client already has this entity tag"""
+    if request.if_none_match.contains_weak(etag):
+        return app.response_class(status=status.HTTP_304_NOT_MODIFIED)
+    return None
+
+
+def encode_product(row) -> str:
+    """Returns the JSON of a Product or row encoded like jsonify, from the cache if it is current"""
+    cached = fragment_cache.get(row.id)
+    if cached is not None and cached[0] == row.version:
+        return cached[1]
+    fragment = app.json.dumps(Product.serialize_row(row), separators=(",", ":"))
+    fragment_cache.set(row.id, (row.version, fragment))
+    return fragment
+
+
+def encode_products(rows) -> str:
+    """Returns the JSON array of Products or rows by joining their encodings"""
+    return "[" + ",".join(encode_product(row) for row in rows) + "]"
+
+
+def json_response(body: str) -> Response:
+    """Returns a response with a body that is already encoded as JSON"""
+    return app.response_class(body + "\n", mimetype=app.json.mimetype)
+
+
+def wants_stream() -> bool:
+    """Checks if the client asked for a streamed listing"""
+    if request.args.get("stream", "").lower() in ("1", "true"):
+        return True
+    best = request.accept_mimetypes.best_match([JSON_MIMETYPE, NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_products(query, sort: str = "id") -> Response:
+    """Streams the Products of a query as NDJSON or as a JSON array
+
+    The body is produced by a generator one chunk of rows at a time so
+    neither the rows nor the encoded body are ever held in memory at once.
+    """
+    chunk_size = app.config["STREAM_CHUNK_SIZE"]
+    ndjson = request.accept_mimetypes.best_match([JSON_MIMETYPE, NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+    def generate():
+        if not ndjson:
+            yield "["
+        lines = []
+        for count, row in enumerate(Product.stream(query, chunk_size, sort)):
+            encoded = encode_product(row)
+            if ndjson:
+                lines.append(encoded + "\n")
+            else:
+                lines.append("," + encoded if count else encoded)
+            if len(lines) == chunk_size:
+                yield "".join(lines)
+                lines = []
+        yield "".join(lines)
+        if not ndjson:
+            yield "]\n"
+
+    mimetype = NDJSON_MIMETYPE if ndjson else JSON_MIMETYPE
+    return Response(stream_with_context(generate()), status=status.HTTP_200_OK, mimetype=mimetype)
+
+
 ######################################################################
 # C R E A T E   A   N E W   P R O D U C T
 ######################################################################
@@ -94,6 +365,82 @@ def create_products():
     return jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
 
 
+######################################################################
+# C R E A T E   M A N Y   P R O D U C T S
+######################################################################
+@app.route("/products/batch", methods=["POST"])
+def create_products_batch():
+    """
+    Creates many Products
+    This endpoint validates every Product in the posted list in one pass and
+    saves them all in one transaction, or none of them if any Product is not
+    valid, listing every error of each invalid Product
+    """
+    app.logger.info("Request to Create a batch of Products...")
+    check_content_type("application/json")
+
+    rows, errors = product_validator.validate_many(get_batch())
+    if errors:
+        return batch_errors(errors)
+
+    ids = Product.create_rows(rows)
+    app.logger.info("Batch of %d Products saved!", len(ids))
+    return jsonify(count=len(ids), ids=ids), status.HTTP_201_CREATED
+
+
+######################################################################
+# U P D A T E   M A N Y   P R O D U C T S
+######################################################################
+@app.route("/products/batch", methods=["PATCH"])
+def update_products_batch():
+    """
+    Updates many Products
+    The body is either a list of changes that each include the id of the
+    Product to change, or an object with the changes to make to every
+    Product selected by its ids and/or filter
+    """
+    app.logger.info("Request to Update a batch of Products...")
+    check_content_type("application/json")
+
+    data = request.get_json()
+    if isinstance(data, list):
+        items = []
+        errors = []
+        for index, item in enumerate(get_batch()):
+            try:
+                items.append(get_item_changes(item))
+            except DataValidationError as error:
+                errors.append({"index": index, "message": str(error)})
+        if errors:
+            return batch_errors(errors)
+        ids = Product.update_each(items)
+    else:
+        product_ids, filters = get_bulk_selection(data)
+        changes = Product.deserialize_changes(data.get("changes"))
+        ids = Product.update_many(changes, product_ids, **filters)
+
+    app.logger.info("Batch of %d Products updated!", len(ids))
+    return jsonify(count=len(ids), ids=ids), status.HTTP_200_OK
+
+
+######################################################################
+# D E L E T E   M A N Y   P R O D U C T S
+######################################################################
+@app.route("/products/batch", methods=["DELETE"])
+def delete_products_batch():
+    """
+    Deletes many Products
+    The body is an object selecting the Products by their ids and/or filter
+    """
+    app.logger.info("Request to Delete a batch of Products...")
+    check_content_type("application/json")
+
+    product_ids, filters = get_bulk_selection(request.get_json())
+    ids = Product.delete_many(product_ids, **filters)
+    app.logger.info("Batch of %d Products deleted!", len(ids))
+    return jsonify(count=len(ids), ids=ids), status.HTTP_200_OK
+
+
 ######################################################################
 # L I S T   A L L   P R O D U C T S
 ######################################################################
@@ -103,27 +450,109 @@ def create_products():
 #
 @app.route("/products", methods=["GET"])
 def list_products():
-    """Returns a list of all products or filters by availability"""
-    name = request.args.get("name")
-    category = request.args.get("category")
-    available = request.args.get("available")
-    
-    if name:
-        products = Product.find_by_name(name)
-    elif category:
-        try:
-            category_enum = getattr(Category, category.upper())  # Convert to Enum
-            products = Product.find_by_category(category_enum)
-        except AttributeError:
-            abort(400, f"Invalid category: {category}")
-    elif available is not None:
-        available_bool = available.lower() == "true"  # Convert to Boolean
-        products = Product.find_by_availability(available_bool)
+    """Returns a list of all products or filters by availability
+
+    Results are ordered by id, or by the sort given as price, -price, name
+    or -name. Passing a limit or a cursor returns one page of results.
+    The links to the next and previous pages are returned in the Link header.
+    Asking for application/x-ndjson or passing stream=1 streams every result
+    instead of building the whole response in memory.
+    Other listings have an ETag and are not sent again if the client has it.
+    """
+    query = Product.find_rows_by_filters(**parse_filters(request.args))
+    sort = request.args.get("sort", "id")
+    Product.sort_keys(sort)  # raises DataValidationError if the sort is not valid
+
+    if wants_stream():
+        return stream_products(query, sort)
+
+    headers = {}
+    if "limit" in request.args or "cursor" in request.args:
+        limit = get_page_limit()
+        rows, next_cursor, prev_cursor = Product.paginate(
+            query, limit, request.args.get("cursor"), sort
+        )
+        links = []
+        if next_cursor:
+            links.append(f'<{page_url(limit, next_cursor)}>; rel="next"')
+        if prev_cursor:
+            links.append(f'<{page_url(limit, prev_cursor)}>; rel="prev"')
+        if links:
+            headers["Link"] = ", ".join(links)
     else:
-        products = Product.all()
-    
-    results = [product.serialize() for product in products]
-    return jsonify(results), 200
+        rows = Product.sorted_by(query, sort).all()
+
+    etag = Product.etag_of(rows)
+    response = not_modified(etag) or json_response(encode_products(rows))
+    response.set_etag(etag)
+    response.headers.update(headers)
+    return response, response.status_code
+
+######################################################################
+# S E A R C H   P R O D U C T S
+######################################################################
+@app.route("/products/search", methods=["GET"])
+def search_products():
+    """Returns the products whose name or description match the words in q
+
+    The best matches come first. Results are returned one page of limit
+    products at a time with the links to the next and previous pages in
+    the Link header.
+    """
+    text = request.args.get("q", "").strip()
+    if not text:
+        abort(status.HTTP_400_BAD_REQUEST, "q must contain the words to search for")
+    limit = get_page_limit()
+    offset = request.args.get("offset", "0")
+    if not offset.isdigit():
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid offset: {offset}")
+    offset = int(offset)
+
+    rows = Product.search_rows(text, limit + 1, offset)
+    links = []
+    if len(rows) > limit:
+        links.append(f'<{search_url(limit, offset + limit)}>; rel="next"')
+    if offset > 0:
+        links.append(f'<{search_url(limit, max(offset - limit, 0))}>; rel="prev"')
+    headers = {"Link": ", ".join(links)} if links else {}
+    return json_response(encode_products(rows[:limit])), status.HTTP_200_OK, headers
+
+
+######################################################################
+# S U G G E S T   P R O D U C T   N A M E S
+######################################################################
+@app.route("/products/suggest", methods=["GET"])
+def suggest_product_names():
+    """Returns up to limit distinct product names that start with prefix
+
+    The names come from an index kept in memory, so this only touches the
+    database to check for the writes of other workers every few seconds.
+    """
+    prefix = request.args.get("prefix", "").strip()
+    if not prefix:
+        abort(status.HTTP_400_BAD_REQUEST, "prefix must contain the start of a name")
+    limit = get_page_limit()
+    Product.sync_indexes()
+    return jsonify(name_index.suggest(prefix, limit)), status.HTTP_200_OK
+
+
+######################################################################
+# C O U N T   P R O D U C T S   B Y   F A C E T
+######################################################################
+@app.route("/products/facets", methods=["GET"])
+def count_product_facets():
+    """Returns how many products match the filters and their counts by category and availability
+
+    It takes the same filters as the listing. Filters on the category and
+    availability alone are counted from bitmaps kept in memory.
+    """
+    facets = Product.facets(**parse_filters(request.args))
+    return jsonify(
+        count=facets["count"],
+        category={category.name: count for category, count in facets["category"].items()},
+        available={str(available).lower(): count for available, count in facets["available"].items()},
+    ), status.HTTP_200_OK
+
 
 ######################################################################
 # R E A D   A   P R O D U C T
@@ -134,11 +563,16 @@ def list_products():
 #
 @app.route("/products/<int:product_id>", methods=["GET"])
 def read_product(product_id):
-    """Returns a single product by ID"""
+    """Returns a single product by ID
+
+    The product is not sent again if the client has its current ETag
+    """
     product = Product.find(product_id)
     if not product:
         abort(404, f"Product with id {product_id} was not found.")
-    return jsonify(product.serialize()), 200
+    response = not_modified(product.etag) or json_response(encode_product(product))
+    response.set_etag(product.etag)
+    return response, response.status_code
 ######################################################################
 # U P D A T E   A   P R O D U C T
 ######################################################################
@@ -149,7 +583,7 @@ def read_product(product_id):
 @app.route("/products/<int:product_id>", methods=["PUT"])
 def update_product(product_id):
     """Updates an existing product"""
-    product = Product.find(product_id)
+    product = Product.find(product_id, cached=False)
     if not product:
         abort(404, f"Product with id {product_id} was not found.")
     
@@ -158,8 +592,15 @@ def update_product(product_id):
     except DataValidationError as error:
         abort(400, str(error))
     
-    product.update()
-    return jsonify(product.serialize()), 200
+    try:
+        product.update()
+    except StaleDataError:
+        # another request deleted it since it was found
+        db.session.rollback()
+        abort(404, f"Product with id {product_id} was not found.")
+    response = jsonify(product.serialize())
+    response.set_etag(product.etag)
+    return response
 ######################################################################
 # D E L E T E   A   P R O D U C T
 ######################################################################
@@ -171,7 +612,7 @@ def update_product(product_id):
 @app.route("/products/<int:product_id>", methods=["DELETE"])
 def delete_product(product_id):
     """Deletes a product"""
-    product = Product.find(product_id)
+    product = Product.find(product_id, cached=False)
     if not product:
         abort(404, f"Product with id {product_id} was not found.")
     product.delete()
@@ -0,0 +1,199 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Full Text Search
+
+This module contains the full text index of the name and description of
+Products and the searches it serves. PostgreSQL keeps a weighted tsvector
+in a generated column with a GIN index. SQLite keeps an external content
+FTS5 table that triggers update on every insert, update and delete of a
+product, including bulk ones.
+"""
+import re
+import logging
+from sqlalchemy import select, func, literal_column, table, column
+from service.database import db
+
+logger = logging.getLogger("flask.app")
+
+# Every statement can run again, so they also add the index to tables
+# made before it existed, see SearchMixin.create_search_index()
+SEARCH_DDL = {
+    "postgresql": [
+        "ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', name), 'A') || "
+        "setweight(to_tsvector('english', description), 'B')) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_product_search ON product USING GIN (search_vector)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5("
+        "name, description, content='product', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS product_search_insert AFTER INSERT ON product BEGIN "
+        "INSERT INTO product_search (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+        "CREATE TRIGGER IF NOT EXISTS product_search_delete AFTER DELETE ON product BEGIN "
+        "INSERT INTO product_search (product_search, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); END",
+        "CREATE TRIGGER IF NOT EXISTS product_search_update AFTER UPDATE OF name, description ON product BEGIN "
+        "INSERT INTO product_search (product_search, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO product_search (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    ],
+}
+
+# Dropping the index with the table. PostgreSQL drops the column with it
+SEARCH_DROP_DDL = {
+    "sqlite": "DROP TABLE IF EXISTS product_search",
+}
+
+# Whether the full text index exists, and how to index the rows there are
+# once it is added to a table that has some. PostgreSQL computes the
+# generated column of every row when it is added
+SEARCH_EXISTS_SQL = {
+    "postgresql": "SELECT count(*) FROM information_schema.columns "
+                  "WHERE table_name = 'product' AND column_name = 'search_vector'",
+    "sqlite": "SELECT count(*) FROM sqlite_master WHERE name = 'product_search'",
+}
+SEARCH_REBUILD_SQL = {
+    "sqlite": ["INSERT INTO product_search (product_search) VALUES ('rebuild')"],
+}
+
+# Bulk loading with the full text index. SQLite indexes the rows far faster
+# all at once than with the insert trigger, row by row
+BULK_INSERT_SQL = {
+    "sqlite": (
+        ["DROP TRIGGER product_search_insert"],
+        SEARCH_REBUILD_SQL["sqlite"] + [SEARCH_DDL["sqlite"][1]],
+    ),
+}
+
+# Emptying the table with its full text index. SQLite has no TRUNCATE and
+# runs the delete trigger once per row, so the trigger is dropped while
+# the rows go and the FTS5 table is emptied in one go, in one transaction
+TRUNCATE_SQL = {
+    "postgresql": ["TRUNCATE TABLE product"],
+    "sqlite": [
+        "DROP TRIGGER product_search_delete",
+        "DELETE FROM product",
+        "INSERT INTO product_search (product_search) VALUES ('delete-all')",
+        SEARCH_DDL["sqlite"][2],
+    ],
+}
+
+
+class SearchMixin:
+    """Searches the name and description of a model through the full text index"""
+
+    @classmethod
+    def create_search_index(cls) -> bool:
+        """Adds the full text index of the Products to the database if it is missing
+
+        New tables get the index when they are created. This adds it to the
+        tables made before it existed and indexes the rows they hold, and it
+        does nothing when the index is there. On PostgreSQL adding the
+        generated column rewrites the table, which is locked meanwhile.
+
+        :return: True if the index was missing
+        :rtype: bool
+
+        """
+        dialect = db.engine.dialect.name
+        if dialect not in SEARCH_DDL:
+            return False
+        missing = not db.session.scalar(db.text(SEARCH_EXISTS_SQL[dialect]))
+        if missing:
+            logger.info("Creating the full text index of the Products")
+        # the triggers are made again if they were dropped on their own
+        for statement in SEARCH_DDL[dialect]:
+            db.session.execute(db.text(statement))
+        if missing:
+            for statement in SEARCH_REBUILD_SQL.get(dialect, []):
+                db.session.execute(db.text(statement))
+        db.session.commit()
+        return missing
+
+    @classmethod
+    def search(cls, text: str, limit: int = 20, offset: int = 0) -> list:
+        """Returns the Products whose name or description match every word of a text
+
+        The words are matched as prefixes through the full text index of
+        the database, and the best matches, weighing the name above the
+        description, come first.
+
+        :param text: the words to search for
+        :type text: str
+        :param limit: the maximum number of Products to return
+        :type limit: int
+        :param offset: the number of best matches to skip
+        :type offset: int
+
+        :return: a collection of Products ordered by rank
+        :rtype: list
+
+        """
+        logger.info("Processing search for %s ...", text)
+        statement = cls._search(select(cls), text)
+        if statement is None:
+            return []
+        return db.session.scalars(statement.limit(limit).offset(offset)).all()
+
+    @classmethod
+    def search_rows(cls, text: str, limit: int = 20, offset: int = 0) -> list:
+        """Returns the rows of the Products whose name or description match every word of a text
+
+        It matches and ranks like search(), but returns plain rows of the
+        columns of the Products instead of Product instances.
+        """
+        logger.info("Processing row search for %s ...", text)
+        statement = cls._search(select(*cls.row_columns()), text)
+        if statement is None:
+            return []
+        return db.session.execute(statement.limit(limit).offset(offset)).all()
+
+    @classmethod
+    def _search(cls, statement, text: str):
+        """Returns a statement narrowed to the matches of the words of a text, or None without words"""
+        # only keep the words so no query syntax can be injected
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return None
+        if db.engine.dialect.name == "postgresql":
+            return cls._postgresql_search(statement, words)
+        return cls._sqlite_search(statement, words)
+
+    @classmethod
+    def _postgresql_search(cls, statement, words: list):
+        """Returns a search ranked with ts_rank over the search_vector column"""
+        query = func.to_tsquery("english", " & ".join(f"{word}:*" for word in words))
+        vector = literal_column("product.search_vector")
+        return (
+            statement
+            .where(vector.op("@@")(query))
+            .order_by(func.ts_rank(vector, query).desc(), cls.id)
+        )
+
+    @classmethod
+    def _sqlite_search(cls, statement, words: list):
+        """Returns a search ranked with bm25 over the product_search FTS5 table"""
+        match = " ".join(f'"{word}"*' for word in words)
+        search = table("product_search", column("rowid"))
+        search_name = literal_column("product_search")
+        return (
+            statement
+            .join(search, search.c.rowid == cls.id)
+            .where(search_name.op("MATCH")(match))
+            .order_by(func.bm25(search_name, 10.0, 1.0), cls.id)
+        )
@@ -33,6 +33,34 @@ $(function () {
         $("#flash_message").append(message);
     }
 
+    // ****************************************
+    // Suggest Product names while typing
+    // ****************************************
+
+    $("#product_name").on("input", function () {
+
+        let prefix = $(this).val().trim();
+        if (prefix.length == 0) {
+            $("#product_names").empty();
+            return;
+        }
+
+        let ajax = $.ajax({
+            type: "GET",
+            url: `/products/suggest?prefix=${encodeURIComponent(prefix)}&limit=10`,
+            contentType: "application/json",
+            data: ''
+        });
+
+        ajax.done(function(res){
+            $("#product_names").empty();
+            for (let name of res) {
+                $("#product_names").append($("<option>").attr("value", name));
+            }
+        });
+
+    });
+
     // ****************************************
     // Create a Product
     // ****************************************
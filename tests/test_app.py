@@ -0,0 +1,80 @@
+"""
+Test cases for the app factory
+"""
+import os
+import sys
+import tempfile
+import subprocess
+from unittest import TestCase
+import service
+from service import create_app, startup
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def run_python(code: str, **environment) -> str:
+    """Returns what a fresh interpreter prints when it runs some code in the repository"""
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT, env={**os.environ, **environment}, capture_output=True, text=True, check=True,
+    ).stdout
+
+
+class TestCreateApp(TestCase):
+    """App factory tests"""
+
+    def test_create_app_once(self):
+        """It should create a single app that service.app returns"""
+        app = create_app()
+        self.assertIs(create_app(), app)
+        self.assertIs(service.app, app)
+        self.assertGreater(startup["create_app"], 0)
+        self.assertIn("list_products", app.view_functions)
+        self.assertIn("db-init", app.cli.commands)
+
+    def test_imports_are_lazy(self):
+        """It should not create the app when a module of the package is imported"""
+        output = run_python(
+            "import sys, service.config, service.common.metrics\n"
+            "print(sorted(name for name in ('flask', 'service.routes', 'service.models') if name in sys.modules))"
+        )
+        self.assertEqual(output.strip(), "[]")
+
+    def test_create_app_sends_no_statement(self):
+        """It should create the app without connecting to the database"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "products.db")
+            output = run_python("from service import create_app\nprint(create_app().name)", DATABASE_URI=f"sqlite:///{path}")
+            self.assertEqual(output.strip(), "service")
+            self.assertFalse(os.path.exists(path))
+
+    def test_create_app_in_memory(self):
+        """It should serve products from an in-memory SQLite database"""
+        output = run_python(
+            "from service import create_app\n"
+            "from service.models import create_schema\n"
+            "app = create_app()\n"
+            "create_schema()\n"
+            "print(app.test_client().get('/products').status_code)",
+            DATABASE_URI="sqlite://",
+        )
+        self.assertEqual(output.strip(), "200")
+
+    def test_create_app_fails(self):
+        """It should not leave a half made app behind when it cannot be set up"""
+        output = run_python(
+            "from unittest.mock import patch\n"
+            "import service, service.models\n"
+            "with patch.object(service.models, 'init_db', side_effect=RuntimeError('no database')):\n"
+            "    try:\n"
+            "        service.create_app()\n"
+            "    except SystemExit as error:\n"
+            "        print(error.code)\n"
+            "print('app' in vars(service))\n"
+            "print('list_products' in service.app.view_functions, 'db-init' in service.app.cli.commands)"
+        )
+        self.assertEqual(output.split(), ["4", "False", "True", "True"])
+
+    def test_missing_attribute(self):
+        """It should raise AttributeError for anything but the app"""
+        self.assertRaises(AttributeError, getattr, service, "nothing")
@@ -0,0 +1,71 @@
+"""
+Test cases for the Bitmap Index
+"""
+from unittest import TestCase
+from unittest.mock import patch
+from service.common.bitmap_index import BitmapIndex, to_bitmap, from_bitmap, count_bits
+
+
+class TestBitmapIndex(TestCase):
+    """Bitmap Index tests"""
+
+    def setUp(self):
+        self.index = BitmapIndex(("color", "size"))
+        self.index.load([(1, "red", "S"), (2, "red", "M"), (3, "blue", "M"), (10, "blue", "L"), (800, "red", "M")])
+
+    def test_bitmaps(self):
+        """It should convert between ids and bitmaps"""
+        self.assertEqual(to_bitmap([0, 3, 9]), 0b1000001001)
+        self.assertEqual(to_bitmap([]), 0)
+        self.assertEqual(from_bitmap(0b1000001001), [0, 3, 9])
+        self.assertEqual(from_bitmap(0), [])
+        ids = [1, 7, 8, 64, 65, 1000, 123456]
+        self.assertEqual(from_bitmap(to_bitmap(ids)), ids)
+
+    def test_match(self):
+        """It should combine filters and count the matches"""
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.ids(), [1, 2, 3, 10, 800])
+        self.assertEqual(self.index.ids(color="red"), [1, 2, 800])
+        self.assertEqual(self.index.ids(color="red", size="M"), [2, 800])
+        self.assertEqual(self.index.count(color="blue", size="S"), 0)
+        self.assertEqual(self.index.count(color="green"), 0)
+        self.assertEqual(self.index.count(size="M"), 3)
+
+    def test_facets(self):
+        """It should count the matches having each value of each field"""
+        self.assertEqual(
+            self.index.facets(size="M"),
+            {"color": {"red": 2, "blue": 1}, "size": {"S": 0, "M": 3, "L": 0}},
+        )
+        self.assertEqual(self.index.facets()["color"], {"red": 3, "blue": 2})
+
+    def test_count_bits(self):
+        """It should count the bits of a bitmap where int.bit_count() is missing"""
+        self.assertEqual(count_bits(0), 0)
+        self.assertEqual(count_bits(to_bitmap(range(0, 100000, 3))), 33334)
+        with patch("service.common.bitmap_index.popcount", count_bits):
+            self.assertEqual(len(self.index), 5)
+            self.assertEqual(self.index.count(size="M"), 3)
+            self.assertEqual(self.index.facets()["color"], {"red": 3, "blue": 2})
+            self.assertEqual(self.index.stats()["size"], 5)
+
+    def test_changes(self):
+        """It should follow new, changed and removed items"""
+        self.index.set(4, color="green", size="S")
+        self.index.set(1, color="blue")
+        self.assertEqual(self.index.ids(color="blue"), [1, 3, 10])
+        self.assertEqual(self.index.ids(size="S"), [1, 4])
+        self.index.set_many([2, 3, 4], size="L")
+        self.assertEqual(self.index.ids(size="L"), [2, 3, 4, 10])
+        self.assertEqual(self.index.ids(size="M"), [800])
+        self.index.remove(10)
+        self.index.remove(99)
+        self.assertEqual(self.index.ids(color="blue"), [1, 3])
+        self.assertEqual(len(self.index), 5)
+        stats = self.index.stats()
+        self.assertEqual(stats["size"], 5)
+        self.assertGreater(stats["bytes"], 100)
+        self.index.clear()
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.count(color="red"), 0)
@@ -0,0 +1,86 @@
+"""
+Test cases for the LRU Cache
+"""
+from unittest import TestCase
+from service.common.cache import LRUCache, Freshness
+
+
+class FakeTimer:
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(TestCase):
+    """LRU Cache tests"""
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = LRUCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_get_and_set(self):
+        """It should return cached values and count hits and misses"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expires_entries(self):
+        """It should expire entries after their time to live"""
+        self.cache.set("a", 1)
+        self.timer.now = 9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.timer.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_invalidate_and_clear(self):
+        """It should remove entries"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.invalidate("a")
+        self.cache.invalidate("missing")
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("b"))
+
+    def test_disabled(self):
+        """It should not cache anything when disabled"""
+        self.cache.configure(enabled=False)
+        self.cache.set("a", 1)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["misses"], 0)
+
+
+class TestFreshness(TestCase):
+    """Freshness tests"""
+
+    def test_staleness(self):
+        """It should be stale until checked and again after max_staleness"""
+        timer = FakeTimer()
+        freshness = Freshness(max_staleness=5, timer=timer)
+        self.assertTrue(freshness.is_stale())
+        freshness.mark_checked((1, 1, 1))
+        self.assertEqual(freshness.fingerprint, (1, 1, 1))
+        timer.now += 4.9
+        self.assertFalse(freshness.is_stale())
+        timer.now += 0.1
+        self.assertTrue(freshness.is_stale())
+        freshness.mark_changed()
+        self.assertIsNone(freshness.fingerprint)
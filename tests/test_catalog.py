@@ -0,0 +1,107 @@
+"""
+Test cases for the Catalog Snapshot
+"""
+from decimal import Decimal
+from unittest import TestCase
+from service.common.catalog import Catalog, to_cents
+
+
+class FakeTimer:
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+RECORDS = [
+    (3, "Hat", Decimal("2.56"), True, 1, 1),
+    (1, "Hat", Decimal("0.01"), False, 1, 1),
+    (2, "Wrench", Decimal("65536.00"), True, 5, 2),
+    (5, "Apple", Decimal("0.015"), False, 2, 1),
+]
+
+
+class TestCatalog(TestCase):
+    """Catalog Snapshot tests"""
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.catalog = Catalog(enabled=True, max_staleness=5, timer=self.timer)
+        self.catalog.load(RECORDS, fingerprint=(4, 5, 5))
+
+    def _ids(self, **field) -> list:
+        return [record[0] for record in self.catalog.find(**field)]
+
+    def test_to_cents(self):
+        """It should convert prices to whole cents"""
+        self.assertEqual(to_cents(Decimal("19.99")), 1999)
+        self.assertEqual(to_cents("0.10"), 10)
+        self.assertIsNone(to_cents(Decimal("0.015")))
+
+    def test_find(self):
+        """It should find the records matching one field in id order"""
+        self.assertEqual(len(self.catalog), 4)
+        self.assertEqual(self._ids(name="Hat"), [1, 3])
+        self.assertEqual(self._ids(name="Hammer"), [])
+        self.assertEqual(self._ids(available=True), [2, 3])
+        self.assertEqual(self._ids(category=1), [1, 3])
+        self.assertEqual(self._ids(), [1, 2, 3, 5])
+        self.assertEqual(self.catalog.get(2), (2, "Wrench", Decimal("65536.00"), True, 5, 2))
+        self.assertIsNone(self.catalog.get(4))
+
+    def test_find_by_price(self):
+        """It should match prices exactly, including fractions of a cent"""
+        # 0.01 and 65536.00 share bytes with 2.56 at other offsets
+        self.assertEqual(self._ids(price=Decimal("2.56")), [3])
+        self.assertEqual(self._ids(price=Decimal("0.01")), [1])
+        self.assertEqual(self._ids(price=Decimal("65536")), [2])
+        self.assertEqual(self._ids(price=Decimal("0.015")), [5])
+        self.assertEqual(self._ids(price=Decimal("0.016")), [])
+        self.assertEqual(self.catalog.get(5)[2], Decimal("0.015"))
+
+    def test_find_ids(self):
+        """It should find the ids of the matches up to a limit"""
+        self.assertEqual(self.catalog.find_ids(2, name="Hat"), [1, 3])
+        self.assertEqual(self.catalog.find_ids(2, price=Decimal("0.015")), [5])
+        self.assertEqual(self.catalog.find_ids(2, category=5), [2])
+        self.assertEqual(self.catalog.find_ids(1, name="Hammer"), [])
+        self.assertIsNone(self.catalog.find_ids(1, available=True))
+        self.assertIsNone(self.catalog.find_ids(3))
+
+    def test_changes(self):
+        """It should add, change and remove records"""
+        self.catalog.upsert((4, "Hammer", Decimal("9.99"), True, 5, 1))
+        self.assertEqual(self._ids(category=5), [2, 4])
+        self.assertTrue(self.catalog.update(1, name="Fedora", available=True))
+        self.assertEqual(self._ids(name="Fedora"), [1])
+        self.assertEqual(self._ids(available=True), [1, 2, 3, 4])
+        self.assertFalse(self.catalog.update(9, name="Cap"))
+        self.catalog.remove(5)
+        self.catalog.remove(9)
+        self.assertEqual(self._ids(price=Decimal("0.015")), [])
+        self.assertEqual(self._ids(), [1, 2, 3, 4])
+
+    def test_staleness(self):
+        """It should be stale once it is older than max_staleness"""
+        self.assertFalse(self.catalog.is_stale())
+        self.timer.now = 5
+        self.assertTrue(self.catalog.is_stale())
+        self.catalog.mark_synced((4, 5, 6))
+        self.assertFalse(self.catalog.is_stale())
+        self.assertEqual(self.catalog.stats()["syncs"], 2)
+        self.assertTrue(Catalog().is_stale())
+
+    def test_diff(self):
+        """It should find the new, changed and deleted ids"""
+        changed, deleted = self.catalog.diff([(2, 3), (3, 1), (4, 1), (6, 1)])
+        self.assertEqual(changed, [2, 4, 6])
+        self.assertEqual(deleted, [1, 5])
+
+    def test_stats(self):
+        """It should report the size and memory of the columns"""
+        stats = self.catalog.stats()
+        self.assertEqual(stats["size"], 4)
+        self.assertEqual(stats["bytes"], 4 * 30)
@@ -5,7 +5,10 @@ import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from sqlalchemy import inspect
+from service.common.cli_commands import db_create, db_init, db_reset, db_seed, db_indexes, format_size, SEED_NAMES
+from service.models import db, Product
+from tests.factories import ProductFactory
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +24,53 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    def test_db_init(self):
+        """It should create the missing tables and keep the data there is"""
+        db.drop_all()
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_init)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Schema created", result.output)
+            Product.bulk_insert([ProductFactory.build().values()])
+            self.assertEqual(self.runner.invoke(db_init).exit_code, 0)
+        self.assertEqual(Product.query.count(), 1)
+
+    def test_db_seed_and_reset(self):
+        """It should seed products in bulk and remove them all"""
+        db.create_all()
+        Product.remove_all()
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_seed, ["--count", "25", "--distinct", "10", "--chunk-size", "10"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("25 products created", result.output)
+            self.assertEqual(Product.query.count(), 25)
+            self.assertLessEqual(len({product.description for product in Product.all()}), 10)
+            self.assertLessEqual({product.name for product in Product.all()}, set(SEED_NAMES))
+            result = self.runner.invoke(db_reset, input="n\n")
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertEqual(Product.query.count(), 25)
+            result = self.runner.invoke(db_reset, ["--yes"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(Product.query.count(), 0)
+
+    def test_db_indexes(self):
+        """It should build the indexes missing from the database"""
+        db.create_all()
+        index = next(index for index in Product.__table__.indexes if index.name == "ix_product_price")
+        index.drop(db.engine)
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_indexes)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("ix_product_price: built in", result.output)
+        self.assertIn("ix_product_available_price: exists", result.output)
+        self.assertIn("full text index: exists", result.output)
+        names = {index["name"] for index in inspect(db.engine).get_indexes("product")}
+        self.assertTrue({index.name for index in Product.__table__.indexes} <= names)
+
+    def test_format_size(self):
+        """It should format index sizes"""
+        self.assertEqual(format_size(None), "size unknown")
+        self.assertEqual(format_size(512), "512 bytes")
+        self.assertEqual(format_size(4096), "4.0 KiB")
+        self.assertEqual(format_size(3 * 1024 ** 3), "3.0 GiB")
@@ -0,0 +1,98 @@
+"""
+Test cases for the Gunicorn configuration
+"""
+import os
+import runpy
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import inspect
+from service import app
+from service.models import db, Product
+
+CONFIG = os.path.join(os.path.dirname(__file__), "..", "service", "gunicorn.conf.py")
+
+
+class TestGunicornConfig(TestCase):
+    """Gunicorn configuration tests"""
+
+    def test_sizes_workers_from_cpus(self):
+        """It should run 2 workers per CPU plus one with gthread workers"""
+        with patch.dict(os.environ, {"PORT": "9000"}), patch("os.sched_getaffinity", return_value={0, 1, 2}):
+            for name in ("WEB_CONCURRENCY", "GUNICORN_THREADS", "GUNICORN_BIND", "DB_MAX_CONNECTIONS", "DB_POOL_SIZE"):
+                os.environ.pop(name, None)
+            settings = runpy.run_path(CONFIG)
+        self.assertEqual(settings["workers"], 7)
+        self.assertEqual(settings["worker_class"], "gthread")
+        self.assertEqual(settings["bind"], "0.0.0.0:9000")
+        self.assertTrue(settings["preload_app"])
+        self.assertGreater(settings["keepalive"], 60)
+        self.assertIn("DB_POOL_SIZE=4", settings["raw_env"])
+        self.assertIn("DB_MAX_OVERFLOW=0", settings["raw_env"])
+
+    def test_connections_within_the_database_limit(self):
+        """It should size the workers and their pools to fit the connections of the database"""
+        with patch.dict(os.environ), patch("os.sched_getaffinity", return_value=set(range(16))):
+            for name in ("WEB_CONCURRENCY", "GUNICORN_THREADS", "DB_MAX_CONNECTIONS", "DB_POOL_SIZE", "DB_MAX_OVERFLOW"):
+                os.environ.pop(name, None)
+            settings = runpy.run_path(CONFIG)
+            self.assertEqual(settings["workers"], 22)
+            self.assertLessEqual(settings["workers"] * (settings["pool_size"] + settings["max_overflow"]), 90)
+            os.environ.update(DB_MAX_CONNECTIONS="20", WEB_CONCURRENCY="8")
+            settings = runpy.run_path(CONFIG)
+            self.assertEqual((settings["workers"], settings["pool_size"]), (8, 2))
+            os.environ.update(DB_POOL_SIZE="6", DB_MAX_OVERFLOW="2")
+            settings = runpy.run_path(CONFIG)
+            self.assertIn("DB_POOL_SIZE=6", settings["raw_env"])
+            self.assertIn("DB_MAX_OVERFLOW=2", settings["raw_env"])
+
+    def test_environment_overrides(self):
+        """It should take the workers and threads from the environment"""
+        environment = {"WEB_CONCURRENCY": "3", "GUNICORN_THREADS": "1", "GUNICORN_PRELOAD": "false"}
+        with patch.dict(os.environ, environment):
+            settings = runpy.run_path(CONFIG)
+        self.assertEqual(settings["workers"], 3)
+        self.assertEqual(settings["worker_class"], "sync")
+        self.assertFalse(settings["preload_app"])
+
+    def test_metrics_directory(self):
+        """It should give several workers a directory to add up their request counters"""
+        with patch.dict(os.environ, {"WEB_CONCURRENCY": "4"}):
+            os.environ.pop("METRICS_DIR", None)
+            settings = runpy.run_path(CONFIG)
+        metrics_dirs = [setting for setting in settings["raw_env"] if setting.startswith("METRICS_DIR=")]
+        self.assertEqual(len(metrics_dirs), 1)
+        with patch.dict(os.environ, {"WEB_CONCURRENCY": "4", "METRICS_DIR": "/tmp/metrics"}):
+            self.assertNotIn("METRICS_DIR", " ".join(runpy.run_path(CONFIG)["raw_env"]))
+        with patch.dict(os.environ, {"WEB_CONCURRENCY": "1"}):
+            os.environ.pop("METRICS_DIR", None)
+            self.assertNotIn("METRICS_DIR", " ".join(runpy.run_path(CONFIG)["raw_env"]))
+
+    def test_post_fork_replaces_pool(self):
+        """It should give a forked worker a new connection pool"""
+        settings = runpy.run_path(CONFIG)
+        with app.app_context():
+            pool = db.engine.pool
+            settings["post_fork"](None, None)
+            self.assertIsNot(db.engine.pool, pool)
+
+    def test_when_ready_creates_schema_and_loads_indexes(self):
+        """It should create the missing tables and load the indexes the preloaded workers share"""
+        settings = runpy.run_path(CONFIG)
+        with app.app_context():
+            db.drop_all()
+            with patch.object(Product, "load_indexes") as load_indexes:
+                settings["when_ready"](SimpleNamespace(cfg=SimpleNamespace(preload_app=False)))
+                load_indexes.assert_not_called()
+                settings["when_ready"](SimpleNamespace(cfg=SimpleNamespace(preload_app=True)))
+                load_indexes.assert_called_once()
+            self.assertIn("product", inspect(db.engine).get_table_names())
+
+    def test_post_worker_init_loads_indexes(self):
+        """It should load the indexes of a worker that was not preloaded"""
+        settings = runpy.run_path(CONFIG)
+        with patch.object(Product, "load_indexes") as load_indexes:
+            settings["post_worker_init"](SimpleNamespace(cfg=SimpleNamespace(preload_app=True)))
+            load_indexes.assert_not_called()
+            settings["post_worker_init"](SimpleNamespace(cfg=SimpleNamespace(preload_app=False)))
+            load_indexes.assert_called_once()
@@ -0,0 +1,30 @@
+"""
+Test cases for the Load Generator
+"""
+import argparse
+from unittest import TestCase
+from benchmarks.load import parse_mix, percentile
+
+
+class TestLoad(TestCase):
+    """Load generator tests"""
+
+    def test_parse_mix(self):
+        """It should read the weight of each operation"""
+        self.assertEqual(parse_mix("create=1,read=6"), {"create": 1, "read": 6})
+        self.assertEqual(parse_mix("list=0,delete=2"), {"list": 0, "delete": 2})
+
+    def test_parse_bad_mix(self):
+        """It should reject unknown operations, bad weights and a mix without weights"""
+        for text in ("fetch=1", "read", "read=-1", "read=1.5", "read=1,", "create=0,read=0"):
+            with self.assertRaises(argparse.ArgumentTypeError, msg=text):
+                parse_mix(text)
+
+    def test_percentile(self):
+        """It should return the sample below which a fraction of the samples fall"""
+        samples = [float(value) for value in range(1, 101)]
+        self.assertEqual(percentile(samples, 0.50), 51.0)
+        self.assertEqual(percentile(samples, 0.99), 100.0)
+        self.assertEqual(percentile(samples, 1.0), 100.0)
+        self.assertEqual(percentile([7.0], 0.99), 7.0)
+        self.assertEqual(percentile([], 0.50), 0.0)
@@ -0,0 +1,128 @@
+"""
+Test cases for the Metrics
+"""
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+from sqlalchemy import create_engine, exc
+from service.common.metrics import Histogram, InstrumentedQueuePool, PoolMetrics, pool_metrics
+from service.common.metrics import RequestMetrics, to_prometheus, worker_exited, clear_workers, EXITED_WORKERS
+
+
+class TestHistogram(TestCase):
+    """Histogram tests"""
+
+    def test_observe(self):
+        """It should count values in cumulative buckets"""
+        histogram = Histogram((1, 0.1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["count"], 4)
+        self.assertAlmostEqual(snapshot["sum"], 2.65)
+        self.assertEqual(snapshot["buckets"], {"0.1": 2, "1": 3, "+Inf": 4})
+
+
+class TestPoolMetrics(TestCase):
+    """Connection pool instrumentation tests"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.engine = create_engine(
+            f"sqlite:///{self.path}", poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=1, pool_timeout=0.01
+        )
+        self.metrics = PoolMetrics()
+        self.metrics.instrument(self.engine)
+        pool_metrics.reset()
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_checkouts(self):
+        """It should count checkouts, overflows, waits and timeouts"""
+        first = self.engine.connect()
+        second = self.engine.connect()
+        self.assertRaises(exc.TimeoutError, self.engine.connect)
+        stats = self.metrics.stats(self.engine.pool)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["connects"], 2)
+        self.assertEqual(stats["overflow_checkouts"], 1)
+        self.assertEqual(stats["peak_checked_out"], 2)
+        self.assertEqual((stats["size"], stats["checked_out"], stats["overflow"]), (1, 2, 1))
+        self.assertEqual(pool_metrics.timeouts, 1)
+        self.assertEqual(pool_metrics.wait_time.snapshot()["count"], 3)
+        second.close()
+        first.close()
+        stats = self.metrics.stats(self.engine.pool)
+        self.assertEqual((stats["checked_out"], stats["checked_in"]), (0, 1))
+
+
+class TestRequestMetrics(TestCase):
+    """Request metrics tests"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_count_requests(self):
+        """It should count requests by route and status with their latency"""
+        metrics = RequestMetrics()
+        metrics.started("GET", "/products/<int:product_id>")
+        metrics.started("GET", "/products/<int:product_id>")
+        self.assertEqual(metrics.in_flight[("GET", "/products/<int:product_id>")], 2)
+        metrics.finished("GET", "/products/<int:product_id>", 200, 0.003)
+        metrics.started("GET", "/products/<int:product_id>")
+        metrics.finished("GET", "/products/<int:product_id>", 404, 0.2)
+        snapshot = metrics.collect()
+        self.assertEqual(sorted(snapshot["requests"]), [
+            ["GET", "/products/<int:product_id>", 200, 1], ["GET", "/products/<int:product_id>", 404, 1],
+        ])
+        self.assertEqual(snapshot["in_flight"], [["GET", "/products/<int:product_id>", 1]])
+        histogram = snapshot["latency"][0][2]
+        self.assertEqual((histogram["count"], histogram["buckets"]["0.005"], histogram["buckets"]["+Inf"]), (2, 1, 2))
+        metrics.reset()
+        self.assertEqual(metrics.collect()["requests"], [])
+
+    def test_prometheus_format(self):
+        """It should render counters, gauges and histograms in the Prometheus text format"""
+        metrics = RequestMetrics()
+        metrics.started("GET", '/a"b')
+        metrics.finished("GET", '/a"b', 200, 0.01)
+        text = to_prometheus(metrics.collect())
+        self.assertIn("# TYPE http_requests_total counter\n", text)
+        self.assertIn('http_requests_total{method="GET",route="/a\\"b",status="200"} 1\n', text)
+        self.assertIn('http_requests_in_flight{method="GET",route="/a\\"b"} 0\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/a\\"b",le="0.01"} 1\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/a\\"b",le="+Inf"} 1\n', text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/a\\"b"} 1\n', text)
+
+    def test_add_up_workers(self):
+        """It should add up the counters every worker writes to the directory"""
+        metrics = RequestMetrics(self.directory, flush_interval=0)
+        other = RequestMetrics()
+        for worker in (metrics, other):
+            worker.started("GET", "/products")
+            worker.finished("GET", "/products", 200, 0.01)
+        other.started("GET", "/products")
+        with open(os.path.join(self.directory, "99999999.json"), "w", encoding="utf-8") as file:
+            json.dump(other.snapshot(), file)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"{os.getpid()}.json")))
+        snapshot = metrics.collect()
+        self.assertEqual(snapshot["requests"], [["GET", "/products", 200, 2]])
+        self.assertEqual(snapshot["in_flight"], [["GET", "/products", 1]])
+        self.assertEqual(snapshot["latency"][0][2]["count"], 2)
+        # a worker that exits keeps counting in the totals but has nothing in flight
+        worker_exited(self.directory, 99999999)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "99999999.json")))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, EXITED_WORKERS)))
+        snapshot = metrics.collect()
+        self.assertEqual(snapshot["requests"], [["GET", "/products", 200, 2]])
+        self.assertEqual(snapshot["in_flight"], [["GET", "/products", 0]])
+        clear_workers(self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
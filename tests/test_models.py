@@ -24,10 +24,18 @@ While debugging just these tests it's convenient to use this:
 
 """
 import os
+import json
+import base64
 import logging
 import unittest
+import threading
 from decimal import Decimal
-from service.models import Product, Category, db , DataValidationError
+from unittest.mock import patch
+from sqlalchemy import delete, event, insert, update
+from service.models import Product, Category, db , DataValidationError, create_schema, product_validator
+from service.indexes import product_cache, name_index, bitmap_index, index_freshness
+import service.catalog
+from service.catalog import catalog
 from service import app
 from tests.factories import ProductFactory
 
@@ -49,8 +57,10 @@ class TestProductModel(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        app.config["PRODUCT_CACHE_ENABLED"] = False
         app.logger.setLevel(logging.CRITICAL)
         Product.init_db(app)
+        create_schema()
 
     @classmethod
     def tearDownClass(cls):
@@ -61,6 +71,7 @@ class TestProductModel(unittest.TestCase):
         """This runs before each test"""
         db.session.query(Product).delete()  # clean up the last tests
         db.session.commit()
+        Product.load_indexes()
 
     def tearDown(self):
         """This runs after each test"""
@@ -334,4 +345,596 @@ class TestProductModel(unittest.TestCase):
         self.assertFalse(found_products[0].available)
 
 
-    
\ No newline at end of file
+    
+
+    def test_find_by_filters(self):
+        """It should Find Products matching every filter given"""
+        ProductFactory(name="Hat", category=Category.CLOTHS, available=True).create()
+        ProductFactory(name="Hat", category=Category.CLOTHS, available=False).create()
+        ProductFactory(name="Hat", category=Category.FOOD, available=True).create()
+        self.assertEqual(Product.find_by_filters().count(), 3)
+        self.assertEqual(Product.find_by_filters(name="Hat").count(), 3)
+        found = Product.find_by_filters(category=Category.CLOTHS, available=True).all()
+        self.assertEqual(len(found), 1)
+        self.assertEqual(found[0].category, Category.CLOTHS)
+        self.assertTrue(found[0].available)
+
+    def test_paginate(self):
+        """It should return Products one page at a time"""
+        products = ProductFactory.create_batch(5)
+        for product in products:
+            product.create()
+        ids = [product.id for product in products]
+        page, next_cursor, prev_cursor = Product.paginate(Product.query, 2)
+        self.assertEqual([product.id for product in page], ids[:2])
+        self.assertIsNotNone(next_cursor)
+        self.assertIsNone(prev_cursor)
+        page, next_cursor, prev_cursor = Product.paginate(Product.query, 2, next_cursor)
+        self.assertEqual([product.id for product in page], ids[2:4])
+        page, next_cursor, _ = Product.paginate(Product.query, 2, next_cursor)
+        self.assertEqual([product.id for product in page], ids[4:])
+        self.assertIsNone(next_cursor)
+        # walk back from the middle page
+        page, _, _ = Product.paginate(Product.query, 2, prev_cursor)
+        self.assertEqual([product.id for product in page], ids[:2])
+
+    def test_paginate_bad_cursor(self):
+        """It should not paginate with a cursor it did not create"""
+        self.assertRaises(DataValidationError, Product.paginate, Product.query, 2, "not-a-cursor")
+        # well formed tokens with values encode_cursor() never writes
+        crafted = [
+            ("id", [{}]), ("id", [None]), ("id", [[1]]), ("id", ["x"]),
+            ("price", ["NaN", "1"]), ("price", [{"a": 1}, "1"]), ("name", [["a"], "1"]),
+        ]
+        for sort, values in crafted:
+            token = base64.urlsafe_b64encode(json.dumps({"s": sort, "v": values, "d": "next"}).encode()).decode()
+            self.assertRaises(DataValidationError, Product.paginate, Product.query, 2, token, sort)
+
+    def test_create_many(self):
+        """It should Create many Products at once"""
+        products = ProductFactory.create_batch(5)
+        ids = Product.create_many(products)
+        self.assertEqual(len(ids), 5)
+        for product_id, product in zip(ids, products):
+            found = Product.find(product_id)
+            self.assertEqual(found.name, product.name)
+            self.assertEqual(found.category, product.category)
+        self.assertEqual(Product.create_many([]), [])
+
+    def test_update_many(self):
+        """It should Update many Products with the same changes"""
+        food = ProductFactory.create_batch(3, category=Category.FOOD, available=True)
+        tools = ProductFactory(category=Category.TOOLS, available=True)
+        ids = Product.create_many(food + [tools])
+        changed = Product.update_many({"available": False}, category=Category.FOOD)
+        self.assertEqual(changed, ids[:3])
+        self.assertEqual(len(Product.find_by_availability(False)), 3)
+        changed = Product.update_many({"price": Decimal("9.99")}, ids=[ids[0], ids[3], 0])
+        self.assertEqual(changed, [ids[0], ids[3]])
+        self.assertEqual(Product.find(ids[3]).price, Decimal("9.99"))
+        self.assertRaises(DataValidationError, Product.update_many, {"available": False})
+
+    def test_update_each(self):
+        """It should Update many Products with different changes"""
+        ids = Product.create_many(ProductFactory.create_batch(2))
+        changed = Product.update_each([
+            {"id": ids[0], "name": "Fedora"},
+            {"id": ids[1], "price": Decimal("5.50"), "available": False},
+            {"id": 0, "name": "Missing"},
+        ])
+        self.assertEqual(changed, ids)
+        db.session.expire_all()
+        self.assertEqual(Product.find(ids[0]).name, "Fedora")
+        self.assertEqual(Product.find(ids[1]).price, Decimal("5.50"))
+        self.assertFalse(Product.find(ids[1]).available)
+
+    def test_delete_many(self):
+        """It should Delete many Products at once"""
+        ids = Product.create_many(ProductFactory.create_batch(4, category=Category.TOOLS))
+        self.assertEqual(Product.delete_many(ids=ids[:2]), ids[:2])
+        self.assertEqual(Product.delete_many(category=Category.TOOLS), ids[2:])
+        self.assertEqual(Product.all(), [])
+        self.assertRaises(DataValidationError, Product.delete_many)
+
+    def test_bulk_insert(self):
+        """It should write many Products in chunks"""
+        rows = [ProductFactory(category=Category.FOOD).values() for _ in range(5)]
+        self.assertEqual(Product.bulk_insert(iter(rows), chunk_size=2), 5)
+        self.assertEqual(Product.bulk_insert([]), 0)
+        found = sorted((product.name, product.price) for product in Product.all())
+        self.assertEqual(found, sorted((row["name"], row["price"]) for row in rows))
+        self.assertEqual(len(Product.search(rows[0]["name"])), sum(row["name"] == rows[0]["name"] for row in rows))
+
+    def test_remove_all(self):
+        """It should remove every Product and never give their ids to new ones"""
+        ids = Product.create_many(ProductFactory.create_batch(3, name="Hat"))
+        self.assertEqual(len(Product.search("hat")), 3)
+        Product.remove_all()
+        self.assertEqual(Product.all(), [])
+        self.assertEqual(Product.search("hat"), [])
+        self.assertEqual(Product.facets()["count"], 0)
+        self.assertEqual(name_index.suggest("ha"), [])
+        product = ProductFactory(name="Hat")
+        product.create()
+        self.assertGreater(product.id, max(ids))
+        self.assertEqual([found.id for found in Product.search("hat")], [product.id])
+        product.delete()
+        self.assertEqual(Product.search("hat"), [])
+
+    def test_deserialize_reports_every_error(self):
+        """It should report the errors of every field at once"""
+        data = {"name": 1, "description": "Red", "price": "abc", "available": "yes"}
+        with self.assertRaises(DataValidationError) as context:
+            Product().deserialize(data)
+        message = str(context.exception)
+        for error in ("Invalid type for string [name]", "Invalid value for decimal [price]: abc",
+                      "Invalid type for boolean [available]", "Invalid product: missing category"):
+            self.assertIn(error, message)
+        with self.assertRaises(DataValidationError) as context:
+            Product().deserialize(None)
+        self.assertIn("body of request contained bad or no data", str(context.exception))
+
+    def test_deserialize_rejects_non_finite_and_long_values(self):
+        """It should reject prices that are not finite and strings longer than their column"""
+        for price in ("NaN", "sNaN", "Infinity", "-inf", float("nan")):
+            data = dict(ProductFactory().serialize(), price=price)
+            self.assertRaises(DataValidationError, Product().deserialize, data)
+            self.assertRaises(DataValidationError, Product.deserialize_changes, {"price": price})
+        for field, length in (("name", 100), ("description", 250)):
+            data = dict(ProductFactory().serialize(), **{field: "x" * length})
+            self.assertEqual(getattr(Product().deserialize(data), field), "x" * length)
+            data[field] += "x"
+            with self.assertRaises(DataValidationError) as context:
+                Product().deserialize(data)
+            self.assertIn(f"Invalid length for string [{field}]", str(context.exception))
+            self.assertRaises(DataValidationError, Product.deserialize_changes, {field: data[field]})
+
+    def test_validate_many(self):
+        """It should validate a batch of Products in one pass with the errors of each by index"""
+        items = [ProductFactory().serialize() for _ in range(4)]
+        del items[1]["name"]
+        items[3]["category"] = "INVALID"
+        items[3]["available"] = "true"
+        rows, errors = product_validator.validate_many(items)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual([error["index"] for error in errors], [1, 3])
+        self.assertEqual(errors[0]["errors"], ["Invalid product: missing name"])
+        self.assertEqual(len(errors[1]["errors"]), 2)
+        ids = Product.create_rows(rows)
+        self.assertEqual([Product.find(product_id).name for product_id in ids], [items[0]["name"], items[2]["name"]])
+
+    def test_deserialize_changes(self):
+        """It should deserialize a partial set of changes"""
+        changes = Product.deserialize_changes({"price": "1.50", "category": "FOOD"})
+        self.assertEqual(changes, {"price": Decimal("1.50"), "category": Category.FOOD})
+        for data in ({}, [], {"id": 1}, {"name": 1}, {"price": "abc"}, {"available": "yes"}, {"category": "INVALID"}):
+            self.assertRaises(DataValidationError, Product.deserialize_changes, data)
+
+    def test_find_is_cached(self):
+        """It should Find a Product from the cache until it is changed"""
+        product_cache.configure(enabled=True)
+        try:
+            product = ProductFactory()
+            product.create()
+            self.assertEqual(Product.find(product.id).name, product.name)
+            self.assertEqual(product_cache.stats()["misses"], 1)
+            db.session.expunge_all()
+            found = Product.find(product.id)
+            self.assertEqual(product_cache.stats()["hits"], 1)
+            self.assertEqual(found.name, product.name)
+            self.assertEqual(found.price, product.price)
+            # a product from the cache can still be changed
+            found.name = "Fedora"
+            found.update()
+            db.session.expunge_all()
+            self.assertEqual(Product.find(product.id).name, "Fedora")
+            Product.update_many({"name": "Bowler"}, ids=[product.id])
+            self.assertEqual(Product.find(product.id).name, "Bowler")
+            Product.find(product.id).delete()
+            self.assertIsNone(Product.find(product.id))
+        finally:
+            product_cache.configure(enabled=False)
+
+    def test_version_changes_on_update(self):
+        """It should change the version and etag of a Product whenever it changes"""
+        product = ProductFactory()
+        product.create()
+        self.assertEqual(product.version, 1)
+        etag = product.etag
+        list_etag = Product.etag_of(Product.all())
+        product.name = "Fedora"
+        product.update()
+        self.assertEqual(product.version, 2)
+        self.assertNotEqual(product.etag, etag)
+        self.assertNotEqual(Product.etag_of(Product.all()), list_etag)
+        Product.update_many({"available": True}, ids=[product.id])
+        Product.update_each([{"id": product.id, "name": "Bowler"}])
+        db.session.expire_all()
+        self.assertEqual(Product.find(product.id).version, 4)
+
+    def test_find_by_filters_price_range(self):
+        """It should Find Products within a price range"""
+        for price in ("5.00", "10.00", "25.00", "50.00", "75.00"):
+            ProductFactory(price=Decimal(price), category=Category.FOOD).create()
+        found = Product.find_by_filters(min_price=Decimal("10"), max_price=Decimal("50")).all()
+        self.assertEqual(sorted(product.price for product in found), [10, 25, 50])
+        found = Product.find_by_filters(category=Category.FOOD, min_price=Decimal("60")).all()
+        self.assertEqual([product.price for product in found], [75])
+
+    def test_find_by_price_range(self):
+        """It should Find Products between two prices"""
+        for price in ("5.00", "10.00", "25.00", "50.00", "75.00"):
+            ProductFactory(price=Decimal(price)).create()
+        found = Product.find_by_price_range("10", ' "50" ').all()
+        self.assertEqual(sorted(product.price for product in found), [10, 25, 50])
+        self.assertEqual(Product.find_by_price_range(max_price=Decimal("9.99")).count(), 1)
+        self.assertEqual(Product.find_by_price_range().count(), 5)
+
+    def test_paginate_sorted(self):
+        """It should page through Products in price order in both directions"""
+        prices = ["30.00", "10.00", "20.00", "10.00", "40.00"]
+        for price in prices:
+            ProductFactory(price=Decimal(price)).create()
+        for sort, expected in (("price", sorted(prices)), ("-price", sorted(prices, reverse=True))):
+            seen = []
+            page, cursor, _ = Product.paginate(Product.query, 2, sort=sort)
+            seen.extend(page)
+            while cursor:
+                page, cursor, back = Product.paginate(Product.query, 2, cursor, sort)
+                seen.extend(page)
+            self.assertEqual([product.price for product in seen], [Decimal(p) for p in expected])
+            # the last page links back to the one before
+            page, _, _ = Product.paginate(Product.query, 2, back, sort)
+            self.assertEqual(page, seen[2:4])
+            self.assertEqual(len(set(seen)), 5)
+        # a cursor only works with the sort it was made for
+        _, cursor, _ = Product.paginate(Product.query, 2, sort="price")
+        self.assertRaises(DataValidationError, Product.paginate, Product.query, 2, cursor, "name")
+
+    def test_sorted_by(self):
+        """It should sort Products by name and refuse unknown sorts"""
+        for name in ("Shirt", "Apple", "Hat"):
+            ProductFactory(name=name).create()
+        names = [product.name for product in Product.sorted_by(Product.query, "-name")]
+        self.assertEqual(names, ["Shirt", "Hat", "Apple"])
+        for sort in ("color", "--price", ""):
+            self.assertRaises(DataValidationError, Product.sort_keys, sort)
+
+    def test_search(self):
+        """It should Search Products by the words of their name and description"""
+        hat = ProductFactory(name="Fedora", description="A red felt hat")
+        shirt = ProductFactory(name="Shirt", description="A red shirt with a hat on it")
+        wrench = ProductFactory(name="Wrench", description="A heavy tool")
+        for product in (hat, shirt, wrench):
+            product.create()
+        self.assertEqual([p.id for p in Product.search("red")], sorted([hat.id, shirt.id]))
+        self.assertEqual([p.id for p in Product.search("HAT red")], [hat.id, shirt.id])
+        self.assertEqual([p.id for p in Product.search("fed")], [hat.id])
+        self.assertEqual([p.id for p in Product.search("shirt")], [shirt.id])
+        self.assertEqual(Product.search('" OR * -'), [])
+        self.assertEqual(len(Product.search("red", limit=1, offset=1)), 1)
+
+    def test_add_version_column(self):
+        """It should add the version column to a table made before it, at version 1"""
+        if db.engine.dialect.name != "sqlite":
+            self.skipTest("drops a column of the product table")
+        ProductFactory(name="Hat").create()
+        db.session.execute(db.text("ALTER TABLE product DROP COLUMN version"))
+        db.session.commit()
+        db.engine.dispose()
+        create_schema()
+        self.assertFalse(Product.add_version_column())
+        db.session.expunge_all()
+        self.assertEqual([product.version for product in Product.all()], [1])
+
+    def test_create_search_index(self):
+        """It should add the full text index to a table made before it, indexing its rows"""
+        if db.engine.dialect.name != "sqlite":
+            self.skipTest("drops the FTS5 table of SQLite")
+
+        def drop_search_index():
+            for statement in (
+                "DROP TRIGGER product_search_insert",
+                "DROP TRIGGER product_search_delete",
+                "DROP TRIGGER product_search_update",
+                "DROP TABLE product_search",
+            ):
+                db.session.execute(db.text(statement))
+            db.session.commit()
+
+        try:
+            drop_search_index()
+            ProductFactory(name="Hat", description="A felt hat").create()
+            create_schema()
+            self.assertEqual([product.name for product in Product.search("hat")], ["Hat"])
+            self.assertFalse(Product.create_search_index())
+            # the bulk statements add it before they drop and make its triggers again
+            drop_search_index()
+            Product.bulk_insert([ProductFactory.build(name="Fedora", description="A red felt hat").values()])
+            self.assertEqual(len(Product.search("hat")), 2)
+            drop_search_index()
+            Product.remove_all()
+            self.assertEqual(Product.search("hat"), [])
+        finally:
+            Product.create_search_index()
+
+    def test_search_follows_changes(self):
+        """It should keep the search index in sync with the Products"""
+        product = ProductFactory(name="Fedora", description="A red felt hat")
+        product.create()
+        product.description = "A blue felt hat"
+        product.update()
+        self.assertEqual(Product.search("red"), [])
+        self.assertEqual([p.id for p in Product.search("blue")], [product.id])
+        Product.update_many({"name": "Bowler"}, ids=[product.id])
+        self.assertEqual(Product.search("fedora"), [])
+        self.assertEqual(len(Product.search("bowler")), 1)
+        Product.delete_many(ids=[product.id])
+        self.assertEqual(Product.search("blue"), [])
+
+    def test_name_index_follows_changes(self):
+        """It should keep the name index in sync with the Products"""
+        hat = ProductFactory(name="Hat")
+        hat.create()
+        ids = Product.create_many([ProductFactory(name="Hammer"), ProductFactory(name="Wrench")])
+        self.assertEqual(name_index.suggest("ha"), ["Hammer", "Hat"])
+        hat.name = "Harp"
+        hat.update()
+        self.assertEqual(name_index.suggest("ha"), ["Hammer", "Harp"])
+        Product.update_many({"name": "Wrench set"}, ids=[ids[0]])
+        Product.update_each([{"id": ids[1], "name": "Spanner"}])
+        self.assertEqual(name_index.suggest("w"), ["Wrench set"])
+        Product.delete_many(ids=ids)
+        hat.delete()
+        self.assertEqual(len(name_index), 0)
+        ProductFactory(name="Hat").create()
+        name_index.load([])
+        Product.load_indexes()
+        self.assertEqual(name_index.suggest("h"), ["Hat"])
+
+    def test_facets(self):
+        """It should count the Products by category and availability"""
+        products = [
+            ProductFactory(category=Category.FOOD, available=True, price=Decimal("1.00")),
+            ProductFactory(category=Category.FOOD, available=False, price=Decimal("5.00")),
+            ProductFactory(category=Category.TOOLS, available=True, price=Decimal("9.00")),
+        ]
+        Product.create_many(products)
+        facets = Product.facets(available=True)
+        self.assertEqual(facets["count"], 2)
+        self.assertEqual(facets["category"][Category.FOOD], 1)
+        self.assertEqual(facets["category"][Category.TOOLS], 1)
+        self.assertEqual(facets["category"][Category.CLOTHS], 0)
+        self.assertEqual(facets["available"], {True: 2, False: 0})
+        self.assertEqual(Product.facets(category=Category.FOOD, available=False)["count"], 1)
+        # filters the bitmaps cannot answer are counted by the database
+        facets = Product.facets(category=Category.FOOD, max_price=Decimal("2.00"))
+        self.assertEqual(facets["count"], 1)
+        self.assertEqual(facets["available"], {True: 1, False: 0})
+        self.assertEqual(Product.facets(), Product.facets(min_price=Decimal("0")))
+
+    def test_bitmap_index_follows_changes(self):
+        """It should keep the bitmap index in sync with the Products"""
+        hat = ProductFactory(category=Category.CLOTHS, available=True)
+        hat.create()
+        ids = Product.create_many(ProductFactory.create_batch(4, category=Category.FOOD, available=False))
+        self.assertEqual(bitmap_index.ids(category=Category.FOOD), ids)
+        hat.category = Category.TOOLS
+        hat.update()
+        self.assertEqual(bitmap_index.ids(category=Category.TOOLS, available=True), [hat.id])
+        Product.update_many({"available": True}, ids=ids[:2])
+        Product.update_each([{"id": ids[2], "category": Category.TOOLS}])
+        self.assertEqual(bitmap_index.ids(category=Category.FOOD, available=True), ids[:2])
+        self.assertEqual(bitmap_index.ids(category=Category.TOOLS), sorted([hat.id, ids[2]]))
+        Product.update_many({"name": "Snack"}, ids=ids)
+        self.assertEqual(len(bitmap_index), 5)
+        Product.delete_many(ids=ids)
+        hat.delete()
+        self.assertEqual(len(bitmap_index), 0)
+        ProductFactory(category=Category.FOOD).create()
+        bitmap_index.clear()
+        Product.load_indexes()
+        self.assertEqual(bitmap_index.count(category=Category.FOOD), 1)
+
+    def test_indexes_follow_other_workers(self):
+        """It should rebuild the name and bitmap indexes once stale when other workers wrote"""
+        ProductFactory(name="Hat", category=Category.FOOD).create()
+        Product.load_indexes()
+        # a write by another worker is not seen by this one
+        db.session.execute(insert(Product).values(
+            name="Harp", description="Strings", price=Decimal("10.00"), available=True, category=Category.FOOD
+        ))
+        db.session.commit()
+        self.assertEqual(Product.facets(category=Category.FOOD)["count"], 1)
+        self.assertEqual(name_index.suggest("ha"), ["Hat"])
+        index_freshness.checked_at -= index_freshness.max_staleness
+        self.assertEqual(Product.facets(category=Category.FOOD)["count"], 2)
+        self.assertEqual(name_index.suggest("ha"), ["Harp", "Hat"])
+        checked_at = index_freshness.checked_at
+        Product.sync_indexes()
+        self.assertEqual(index_freshness.checked_at, checked_at)
+
+    def test_indexes_follow_writes_that_restore_the_fingerprint(self):
+        """It should rebuild the indexes when other workers undo the writes of this one"""
+        Product.load_indexes()
+        product = ProductFactory(name="Hat", category=Category.FOOD)
+        product.create()
+        self.assertEqual(Product.facets(category=Category.FOOD)["count"], 1)
+        # another worker deletes it, which brings back the fingerprint of the load
+        db.session.execute(delete(Product).where(Product.id == product.id))
+        db.session.commit()
+        index_freshness.checked_at -= index_freshness.max_staleness
+        self.assertEqual(Product.facets(category=Category.FOOD)["count"], 0)
+        self.assertEqual(name_index.suggest("ha"), [])
+
+    def test_indexes_drop_products_removed_by_other_workers(self):
+        """It should drop the cached copies of the Products other workers removed when it syncs"""
+        hat, cap = ProductFactory(name="Hat"), ProductFactory(name="Cap")
+        hat.create()
+        cap.create()
+        hat_id, cap_id = hat.id, cap.id
+        Product.load_indexes()
+        product_cache.configure(enabled=True)
+        try:
+            self.assertEqual(Product.find(hat_id).name, "Hat")
+            # another worker removes it, which this one only finds out at its next sync
+            db.session.execute(delete(Product).where(Product.id == hat_id))
+            db.session.commit()
+            db.session.expunge_all()
+            self.assertIsNotNone(product_cache.get(hat_id))
+            index_freshness.checked_at -= index_freshness.max_staleness
+            Product.sync_indexes()
+            self.assertIsNone(product_cache.get(hat_id))
+            self.assertIsNone(Product.find(hat_id))
+            self.assertEqual(Product.find(cap_id).name, "Cap")
+        finally:
+            product_cache.configure(enabled=False)
+
+    def test_indexes_first_build_waits(self):
+        """It should wait for the first build of the indexes, and only refresh them if no other thread does"""
+        ProductFactory(name="Hat").create()
+        name_index.load([])
+        index_freshness.checked_at = index_freshness.fingerprint = None
+
+        def sync():
+            with app.app_context():
+                Product.sync_indexes()
+
+        thread = threading.Thread(target=sync)
+        with index_freshness.lock:
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+        thread.join()
+        self.assertEqual(name_index.suggest("ha"), ["Hat"])
+        # a refresh is left to the thread that holds the lock
+        ProductFactory(name="Harp").create()
+        name_index.load([])
+        index_freshness.checked_at -= index_freshness.max_staleness
+        with index_freshness.lock:
+            Product.sync_indexes()
+        self.assertEqual(name_index.suggest("ha"), [])
+
+    def test_rows_serialize_like_products(self):
+        """It should serialize rows exactly like the Products they were read from"""
+        products = ProductFactory.create_batch(5)
+        for product in products:
+            product.create()
+        db.session.expunge_all()
+        rows = Product.sorted_by(Product.find_rows_by_filters(), "id").all()
+        self.assertEqual(len(rows), 5)
+        for row in rows:
+            self.assertNotIsInstance(row, Product)
+            self.assertEqual(Product.serialize_row(row), Product.find(row.id).serialize())
+        self.assertEqual(Product.etag_of(rows), Product.etag_of(Product.sorted_by(Product.query, "id").all()))
+
+    def test_find_rows_by_filters(self):
+        """It should find the rows of the Products matching the filters"""
+        ProductFactory(name="Hat", category=Category.CLOTHS, price=Decimal("10")).create()
+        ProductFactory(name="Hat", category=Category.CLOTHS, price=Decimal("30")).create()
+        ProductFactory(name="Hammer", category=Category.TOOLS, price=Decimal("20")).create()
+        rows = Product.find_rows_by_filters(category=Category.CLOTHS, max_price=Decimal("20")).all()
+        self.assertEqual([(row.name, row.price) for row in rows], [("Hat", Decimal("10"))])
+        rows, next_cursor, _ = Product.paginate(Product.find_rows_by_filters(), 2, sort="-price")
+        self.assertEqual([row.price for row in rows], [Decimal("30"), Decimal("20")])
+        self.assertIsNotNone(next_cursor)
+
+    def test_search_rows(self):
+        """It should Search rows ranked like Products"""
+        hat = ProductFactory(name="Fedora", description="A red felt hat")
+        shirt = ProductFactory(name="Shirt", description="A red shirt with a hat on it")
+        for product in (hat, shirt):
+            product.create()
+        self.assertEqual([row.id for row in Product.search_rows("HAT red")], [p.id for p in Product.search("HAT red")])
+        self.assertEqual(Product.search_rows("!!"), [])
+
+    def test_find_in_catalog(self):
+        """It should answer the find_by_* lookups from the catalog snapshot"""
+        catalog.configure(enabled=True, max_staleness=60)
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+            statements.append(statement)
+
+        try:
+            products = ProductFactory.create_batch(10)
+            Product.create_many(products)
+            Product.load_indexes()
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            product = products[0]
+            found = Product.find_by_name(product.name)
+            self.assertEqual(found.count(), len([p for p in products if p.name == product.name]))
+            self.assertEqual(len(Product.find_by_category(product.category)),
+                             len([p for p in products if p.category == product.category]))
+            self.assertEqual(len(Product.find_by_availability(product.available)),
+                             len([p for p in products if p.available == product.available]))
+            self.assertTrue(all(p.price == product.price for p in Product.find_by_price(str(product.price))))
+            # one query by id per lookup, and the Products are loaded whole
+            self.assertEqual(len(statements), 4)
+            self.assertEqual(sorted(p.serialize()["description"] for p in found),
+                             sorted(p.description for p in products if p.name == product.name))
+            self.assertEqual(len(statements), 4)
+            self.assertEqual(Product.find_by_name("No such name"), [])
+            self.assertEqual(len(statements), 4)
+            # the changes pending in the session are kept
+            found[0].description = "Changed"
+            self.assertEqual(Product.find_by_category(found[0].category)[0].description, "Changed")
+            db.session.rollback()
+            # a Product made by this process is in the snapshot with its version
+            hat = ProductFactory(name="Hat")
+            hat.create()
+            self.assertEqual(catalog.get(hat.id)[5], 1)
+            Product.create_many([ProductFactory(name="Cap")])
+            self.assertEqual(catalog.find(name="Cap")[0][5], 1)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+            catalog.configure(enabled=False)
+
+    def test_find_in_catalog_many_matches(self):
+        """It should leave the lookups with too many matches to the database"""
+        catalog.configure(enabled=True, max_staleness=60)
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+            statements.append(statement)
+
+        try:
+            products = ProductFactory.create_batch(6, available=True)
+            ids = Product.create_many(products)
+            Product.load_indexes()
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            with patch.object(service.catalog, "CATALOG_ID_LOOKUP_MAX", 5):
+                found = Product.find_by_availability(True)
+                self.assertEqual([p.id for p in found], sorted(ids))
+                self.assertEqual(len(statements), 1)
+                self.assertNotIn(" IN ", statements[0])
+                found = Product.find_by_name(products[0].name)
+                self.assertIn(" IN ", statements[1])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+            catalog.configure(enabled=False)
+
+    def test_catalog_follows_changes(self):
+        """It should keep the catalog snapshot fresh within its staleness bound"""
+        catalog.configure(enabled=True, max_staleness=60)
+        try:
+            Product.load_indexes()
+            hat = ProductFactory(name="Hat", available=True)
+            hat.create()
+            self.assertEqual(len(Product.find_by_name("Hat")), 1)
+            Product.update_many({"name": "Fedora"}, ids=[hat.id])
+            self.assertEqual(len(Product.find_by_name("Fedora")), 1)
+            # a write by another worker shows up at the next sync
+            db.session.execute(update(Product).values(available=False, version=Product.version + 1))
+            db.session.execute(insert(Product).values(
+                name="Fedora", description="A hat", price=Decimal("1.00"), available=True, category=Category.CLOTHS
+            ))
+            db.session.commit()
+            self.assertEqual(len(Product.find_by_name("Fedora")), 1)
+            Product.sync_catalog(force=True)
+            self.assertEqual(len(Product.find_by_name("Fedora")), 2)
+            self.assertEqual([p.name for p in Product.find_by_availability(False)], ["Fedora"])
+            Product.delete_many(ids=[hat.id])
+            self.assertEqual(len(Product.find_by_name("Fedora")), 1)
+        finally:
+            catalog.configure(enabled=False)
@@ -0,0 +1,37 @@
+"""
+Test cases for the Prefix Index
+"""
+from unittest import TestCase
+from service.common.prefix_index import PrefixIndex
+
+
+class TestPrefixIndex(TestCase):
+    """Prefix Index tests"""
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.load([(1, "Hat"), (2, "Hammer"), (3, "hat"), (4, "Hat"), (5, "Wrench")])
+
+    def test_suggest(self):
+        """It should suggest distinct names by prefix regardless of case"""
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.suggest("ha"), ["Hammer", "Hat"])
+        self.assertEqual(self.index.suggest("HAT"), ["Hat"])
+        self.assertEqual(self.index.suggest("h", limit=1), ["Hammer"])
+        self.assertEqual(self.index.suggest("x"), [])
+        self.assertEqual(self.index.suggest("wrenches"), [])
+
+    def test_add_and_remove(self):
+        """It should follow new, renamed and removed items"""
+        self.index.add(6, "Harp")
+        self.assertEqual(self.index.suggest("har"), ["Harp"])
+        self.index.add(2, "Wrench set")
+        self.assertEqual(self.index.suggest("ha"), ["Harp", "Hat"])
+        self.assertEqual(self.index.suggest("wrench"), ["Wrench", "Wrench set"])
+        self.index.remove(1)
+        self.index.remove(4)
+        self.assertEqual(self.index.suggest("hat"), ["hat"])
+        self.index.remove(3)
+        self.index.remove(99)
+        self.assertEqual(self.index.suggest("hat"), [])
+        self.assertEqual(len(self.index), 3)
@@ -0,0 +1,87 @@
+"""
+Test cases for the Query Log
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock
+from sqlalchemy import create_engine, text
+from service.common.query_log import QueryLog, redact
+
+
+class TestQueryLog(TestCase):
+    """Query log tests"""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.log = QueryLog(threshold=60)
+        self.log.instrument(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT)"))
+            conn.execute(text("INSERT INTO product (name) VALUES ('Hat'), ('Shoe')"))
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_redact(self):
+        """It should replace bound parameters by their types"""
+        self.assertEqual(redact({"name": "Hat", "id": 1}), {"name": "str", "id": "int"})
+        self.assertEqual(redact(("Hat", 1.5)), ["str", "float"])
+        self.assertEqual(redact(None), "NoneType")
+
+    def test_count_statements(self):
+        """It should count the statements and their time in a unit of work"""
+        self.assertEqual(self.log.current(), (0, 0.0))
+        self.log.start("GET /products")
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT * FROM product"))
+            conn.execute(text("SELECT * FROM product WHERE id = :id"), {"id": 1})
+        count, seconds = self.log.stop()
+        self.assertEqual(count, 2)
+        self.assertGreater(seconds, 0)
+        self.assertEqual(self.log.current(), (0, 0.0))
+        self.assertEqual(self.log.slow_queries(), [])
+
+    def test_slow_queries(self):
+        """It should keep the slow statements with redacted parameters and their plan"""
+        self.log.configure(threshold=0, size=2, explain=True)
+        self.log.start("GET /products")
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT * FROM product WHERE name = :name"), {"name": "secret"})
+            conn.execute(text("SELECT * FROM product WHERE id = :id"), {"id": 2})
+            conn.execute(text("SELECT count(*) FROM product"))
+        self.log.stop()
+        queries = self.log.slow_queries()
+        self.assertEqual(len(queries), 2)
+        self.assertIn("count(*)", queries[0]["statement"])
+        latest = queries[1]
+        self.assertEqual(latest["parameters"], ["int"])
+        self.assertEqual(latest["label"], "GET /products")
+        self.assertTrue(any("product" in line for line in latest["plan"]))
+        self.assertNotIn("secret", str(queries))
+        self.log.clear()
+        self.assertEqual(self.log.slow_queries(), [])
+
+    def test_failed_plan_keeps_the_transaction(self):
+        """It should run EXPLAIN in a savepoint so a failure does not abort the transaction"""
+        with self.engine.connect() as conn:
+            conn.execute(text("INSERT INTO product (name) VALUES ('Cap')"))
+            plan = self.log.plan(conn, "SELECT * FROM no_such_table", ())
+            self.assertTrue(plan[0].startswith("EXPLAIN failed"))
+            self.assertEqual(conn.execute(text("SELECT count(*) FROM product")).scalar(), 3)
+            conn.commit()
+        # what PostgreSQL is sent, where a failed statement aborts the transaction
+        conn = MagicMock()
+        conn.dialect.name = "postgresql"
+        conn.in_transaction.return_value = True
+        cursor = conn.connection.cursor.return_value
+        cursor.execute.side_effect = lambda sql, *args: sql.startswith("EXPLAIN") and 1 / 0
+        self.assertTrue(self.log.plan(conn, "SELECT 1", {})[0].startswith("EXPLAIN failed"))
+        self.assertEqual(
+            [call.args[0] for call in cursor.execute.call_args_list],
+            [
+                "SAVEPOINT query_log_explain",
+                "EXPLAIN SELECT 1",
+                "ROLLBACK TO SAVEPOINT query_log_explain",
+                "RELEASE SAVEPOINT query_log_explain",
+            ],
+        )
+        cursor.close.assert_called_once()
@@ -25,12 +25,19 @@ Test cases can be run with the following:
     nosetests --stop tests/test_service.py:TestProductService
 """
 import os
+import re
+import json
+import base64
 import logging
 from decimal import Decimal
 from unittest import TestCase
+from flask import jsonify
+from sqlalchemy import delete, event, update
 from service import app
 from service.common import status
-from service.models import db, init_db, Product , DataValidationError
+from service.models import db, init_db, create_schema, Product , DataValidationError, Category
+from service.indexes import product_cache, fragment_cache
+from service.common.query_log import query_log
 from tests.factories import ProductFactory
 
 # Disable all but critical errors during normal test run
@@ -58,8 +65,10 @@ class TestProductRoutes(TestCase):
         app.config["DEBUG"] = False
         # Set up the test database
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        app.config["PRODUCT_CACHE_ENABLED"] = False
         app.logger.setLevel(logging.CRITICAL)
         init_db(app)
+        create_schema()
 
     @classmethod
     def tearDownClass(cls):
@@ -71,6 +80,7 @@ class TestProductRoutes(TestCase):
         self.client = app.test_client()
         db.session.query(Product).delete()  # clean up the last tests
         db.session.commit()
+        Product.load_indexes()
 
     def tearDown(self):
         db.session.remove()
@@ -92,6 +102,12 @@ class TestProductRoutes(TestCase):
             products.append(test_product)
         return products
 
+    @staticmethod
+    def _links(response) -> dict:
+        """Returns the urls in the Link header of a response keyed by rel"""
+        links = re.findall(r'<([^>]*)>; rel="(\w+)"', response.headers.get("Link", ""))
+        return {rel: url for url, rel in links}
+
     ############################################################
     #  T E S T   C A S E S
     ############################################################
@@ -216,6 +232,45 @@ class TestProductRoutes(TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertIn("Product with id 0 was not found", response.get_json()["message"])
 
+    def test_update_and_delete_skip_the_cache(self):
+        """It should update and delete a Product from the database and not from a stale cached copy"""
+        product = ProductFactory(price=Decimal("10.00"))
+        product.create()
+        product_url = f"{BASE_URL}/{product.id}"
+        data = product.serialize()
+        product_cache.configure(enabled=True)
+        try:
+            self.assertEqual(self.client.get(product_url).status_code, status.HTTP_200_OK)
+            # another worker changes the price, so the cached copy of this one is stale
+            db.session.execute(update(Product).where(Product.id == product.id).values(price=Decimal("20.00")))
+            db.session.commit()
+            response = self.client.put(product_url, json=data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            db.session.expunge_all()
+            self.assertEqual(Product.find(data["id"], cached=False).price, Decimal("10.00"))
+            # another worker deletes it
+            self.assertEqual(self.client.get(product_url).status_code, status.HTTP_200_OK)
+            db.session.execute(delete(Product).where(Product.id == data["id"]))
+            db.session.commit()
+            self.assertEqual(self.client.delete(product_url).status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(self.client.put(product_url, json=data).status_code, status.HTTP_404_NOT_FOUND)
+        finally:
+            product_cache.configure(enabled=False)
+
+    def test_update_product_deleted_meanwhile(self):
+        """It should return 404 when the product is deleted while it is updated"""
+        product = ProductFactory()
+        product.create()
+
+        def delete_first(mapper, connection, target):  # pylint: disable=unused-argument
+            connection.execute(delete(Product.__table__).where(Product.__table__.c.id == target.id))
+
+        event.listen(Product, "before_update", delete_first, once=True)
+        data = product.serialize()
+        response = self.client.put(f"{BASE_URL}/{product.id}", json=data, content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+        self.assertIn(f"Product with id {product.id} was not found", response.get_json()["message"])
+
     def test_update_product_invalid_data(self):
         """It should return 400 when deserialization fails"""
         product = ProductFactory()
@@ -429,3 +484,495 @@ class TestProductRoutes(TestCase):
         self.assertEqual(len(data), 1)
         self.assertTrue(data[0]["available"])
 
+    def test_list_products_paginated(self):
+        """It should List Products one page at a time following the Link header"""
+        products = self._create_products(5)
+        response = self.client.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["id"] for item in response.get_json()], [p.id for p in products[:2]])
+        self.assertIn('rel="next"', response.headers["Link"])
+        self.assertNotIn('rel="prev"', response.headers["Link"])
+        seen = []
+        url = f"{BASE_URL}?limit=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(item["id"] for item in response.get_json())
+            url = self._links(response).get("next")
+        self.assertEqual(seen, [p.id for p in products])
+        # the last page links back to the one before it
+        response = self.client.get(self._links(response)["prev"])
+        self.assertEqual([item["id"] for item in response.get_json()], [p.id for p in products[2:4]])
+
+    def test_list_products_paginated_with_filter(self):
+        """It should keep the filter when following pagination links"""
+        for _ in range(3):
+            ProductFactory(category="FOOD").create()
+            ProductFactory(category="TOOLS").create()
+        response = self.client.get(BASE_URL, query_string="category=FOOD&limit=2")
+        data = response.get_json()
+        self.assertEqual(len(data), 2)
+        response = self.client.get(self._links(response)["next"])
+        data.extend(response.get_json())
+        self.assertEqual(len(data), 3)
+        self.assertTrue(all(item["category"] == "FOOD" for item in data))
+        self.assertNotIn("next", self._links(response))
+
+    def test_list_products_bad_page_request(self):
+        """It should not List Products with a bad limit or cursor"""
+        crafted = base64.urlsafe_b64encode(b'{"s":"id","v":[{}],"d":"next"}').decode()
+        for query_string in ("limit=0", "limit=abc", "limit=1000000", "cursor=bogus", f"cursor={crafted}"):
+            response = self.client.get(BASE_URL, query_string=query_string)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query_string)
+
+    def test_list_products_ndjson(self):
+        """It should Stream Products as NDJSON when asked for it"""
+        products = self._create_products(5)
+        chunk_size = app.config["STREAM_CHUNK_SIZE"]
+        app.config["STREAM_CHUNK_SIZE"] = 2
+        try:
+            response = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        finally:
+            app.config["STREAM_CHUNK_SIZE"] = chunk_size
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [p.id for p in products])
+
+    def test_list_products_stream(self):
+        """It should Stream Products as a JSON array with stream=1"""
+        for category in ("TOOLS", "CLOTHS", "FOOD"):
+            ProductFactory(category=category).create()
+        expected = self.client.get(BASE_URL).get_json()
+        for chunk_size in (1, 1000):
+            app.config["STREAM_CHUNK_SIZE"], original = chunk_size, app.config["STREAM_CHUNK_SIZE"]
+            try:
+                response = self.client.get(BASE_URL, query_string="stream=1")
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.get_json(), expected)
+                response = self.client.get(BASE_URL, query_string="stream=1&category=FOOD")
+                self.assertEqual([item["category"] for item in response.get_json()], ["FOOD"])
+            finally:
+                app.config["STREAM_CHUNK_SIZE"] = original
+
+    def test_list_products_stream_empty(self):
+        """It should Stream an empty listing"""
+        response = self.client.get(BASE_URL, query_string="stream=1")
+        self.assertEqual(response.get_json(), [])
+        response = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(response.get_data(as_text=True), "")
+
+    def test_create_products_batch(self):
+        """It should Create a batch of Products"""
+        products = ProductFactory.create_batch(3)
+        response = self.client.post(f"{BASE_URL}/batch", json=[p.serialize() for p in products])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.get_json()
+        self.assertEqual(data["count"], 3)
+        for product_id, product in zip(data["ids"], products):
+            found = self.client.get(f"{BASE_URL}/{product_id}").get_json()
+            self.assertEqual(found["name"], product.name)
+            self.assertEqual(found["description"], product.description)
+
+    def test_create_products_batch_with_bad_items(self):
+        """It should not Create any Product of a batch with bad items"""
+        good = ProductFactory().serialize()
+        no_name = ProductFactory().serialize()
+        del no_name["name"]
+        bad_category = dict(ProductFactory().serialize(), category="INVALID")
+        response = self.client.post(f"{BASE_URL}/batch", json=[good, no_name, good, bad_category, "junk"])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.get_json()["errors"]
+        self.assertEqual([error["index"] for error in errors], [1, 3, 4])
+        self.assertIn("missing name", errors[0]["message"])
+        self.assertEqual(self.client.get(BASE_URL).get_json(), [])
+
+    def test_create_products_batch_lists_every_error(self):
+        """It should list every error of each bad item of a batch"""
+        bad = dict(ProductFactory().serialize(), name=7, price="free", available="no")
+        response = self.client.post(f"{BASE_URL}/batch", json=[ProductFactory().serialize(), bad])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.get_json()["errors"]
+        self.assertEqual([error["index"] for error in errors], [1])
+        self.assertEqual(len(errors[0]["errors"]), 3)
+        self.assertIn("Invalid value for decimal [price]: free", errors[0]["message"])
+
+    def test_create_products_batch_rejects_non_finite_and_long_values(self):
+        """It should reject the items of a batch with a price that is not finite or a name too long"""
+        items = [
+            ProductFactory().serialize(),
+            dict(ProductFactory().serialize(), price="NaN"),
+            dict(ProductFactory().serialize(), price="Infinity"),
+            dict(ProductFactory().serialize(), name="x" * 101),
+        ]
+        response = self.client.post(f"{BASE_URL}/batch", json=items)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.get_json()["errors"]
+        self.assertEqual([error["index"] for error in errors], [1, 2, 3])
+        self.assertIn("Invalid value for decimal [price]: NaN", errors[0]["message"])
+        self.assertIn("Invalid length for string [name]", errors[2]["message"])
+        self.assertEqual(self.client.get(BASE_URL).get_json(), [])
+
+    def test_create_products_batch_bad_request(self):
+        """It should not Create a batch that is not a list or is too large"""
+        response = self.client.post(f"{BASE_URL}/batch", json={"name": "Hat"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        batch_size = app.config["BATCH_SIZE_MAX"]
+        app.config["BATCH_SIZE_MAX"] = 1
+        try:
+            response = self.client.post(f"{BASE_URL}/batch", json=[{}, {}])
+        finally:
+            app.config["BATCH_SIZE_MAX"] = batch_size
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"{BASE_URL}/batch", data="[]", content_type="text/plain")
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_update_products_batch(self):
+        """It should Update a batch of Products with different changes"""
+        products = self._create_products(3)
+        changes = [
+            {"id": products[0].id, "name": "Fedora"},
+            {"id": products[1].id, "price": "5.50", "available": False},
+        ]
+        response = self.client.patch(f"{BASE_URL}/batch", json=changes)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"count": 2, "ids": [products[0].id, products[1].id]})
+        self.assertEqual(self.client.get(f"{BASE_URL}/{products[0].id}").get_json()["name"], "Fedora")
+        found = self.client.get(f"{BASE_URL}/{products[1].id}").get_json()
+        self.assertEqual(Decimal(found["price"]), Decimal("5.50"))
+        self.assertFalse(found["available"])
+        found = self.client.get(f"{BASE_URL}/{products[2].id}").get_json()
+        self.assertEqual(found["name"], products[2].name)
+
+    def test_update_products_batch_with_bad_items(self):
+        """It should not Update any Product of a batch with bad items"""
+        product = self._create_products()[0]
+        changes = [{"id": product.id, "name": "Fedora"}, {"name": "No id"}, {"id": product.id, "color": "red"}]
+        response = self.client.patch(f"{BASE_URL}/batch", json=changes)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error["index"] for error in response.get_json()["errors"]], [1, 2])
+        self.assertEqual(self.client.get(f"{BASE_URL}/{product.id}").get_json()["name"], product.name)
+
+    def test_update_products_by_filter(self):
+        """It should Update every Product matching a filter"""
+        food = [ProductFactory(category="FOOD", available=True) for _ in range(2)]
+        tools = ProductFactory(category="TOOLS", available=True)
+        for product in food + [tools]:
+            product.create()
+        body = {"filter": {"category": "FOOD"}, "changes": {"available": False}}
+        response = self.client.patch(f"{BASE_URL}/batch", json=body)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"count": 2, "ids": [p.id for p in food]})
+        data = self.client.get(BASE_URL, query_string="available=false").get_json()
+        self.assertEqual([item["id"] for item in data], [p.id for p in food])
+        body = {"ids": [tools.id], "changes": {"price": "1.00"}}
+        response = self.client.patch(f"{BASE_URL}/batch", json=body)
+        self.assertEqual(response.get_json()["ids"], [tools.id])
+
+    def test_update_products_batch_bad_request(self):
+        """It should not Update a batch without a selection or valid changes"""
+        bodies = [
+            {"changes": {"available": False}},
+            {"filter": {}, "changes": {"available": False}},
+            {"filter": {"price": "1.00"}, "changes": {"available": False}},
+            {"ids": "1", "changes": {"available": False}},
+            {"ids": [1]},
+            {"ids": [1], "changes": {"id": 2}},
+        ]
+        for body in bodies:
+            response = self.client.patch(f"{BASE_URL}/batch", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_delete_products_batch(self):
+        """It should Delete a batch of Products by id or filter"""
+        products = [ProductFactory(category="TOOLS") for _ in range(3)]
+        for product in products:
+            product.create()
+        ProductFactory(category="FOOD").create()
+        ids = [product.id for product in products]
+        response = self.client.delete(f"{BASE_URL}/batch", json={"ids": [ids[0], ids[1], 0]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"count": 2, "ids": ids[:2]})
+        response = self.client.delete(f"{BASE_URL}/batch", json={"filter": {"category": "FOOD"}})
+        self.assertEqual(response.get_json()["count"], 1)
+        remaining = [item["id"] for item in self.client.get(BASE_URL).get_json()]
+        self.assertEqual(remaining, ids[2:])
+
+    def test_delete_products_batch_bad_request(self):
+        """It should not Delete a batch without a selection"""
+        for body in ([1, 2], {}, {"filter": {"name": 1}}):
+            response = self.client.delete(f"{BASE_URL}/batch", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_stats(self):
+        """It should return the cache counters"""
+        response = self.client.get("/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()["product_cache"]
+        for counter in ("hits", "misses", "evictions", "size"):
+            self.assertIn(counter, data)
+
+    def test_read_product_not_modified(self):
+        """It should not send a Product again when the client has its ETag"""
+        product = self._create_products()[0]
+        response = self.client.get(f"{BASE_URL}/{product.id}")
+        etag = response.headers["ETag"]
+        response = self.client.get(f"{BASE_URL}/{product.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+        # the tag changes when the product does
+        data = product.serialize()
+        data["name"] = "Fedora"
+        response = self.client.put(f"{BASE_URL}/{product.id}", json=data)
+        updated = response.headers["ETag"]
+        self.assertNotEqual(updated, etag)
+        response = self.client.get(f"{BASE_URL}/{product.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["name"], "Fedora")
+        self.assertEqual(response.headers["ETag"], updated)
+        response = self.client.get(f"{BASE_URL}/{product.id}", headers={"If-None-Match": updated})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_products_not_modified(self):
+        """It should not send a listing again when the client has its ETag"""
+        products = self._create_products(3)
+        response = self.client.get(BASE_URL, query_string="limit=2")
+        etag = response.headers["ETag"]
+        response = self.client.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn('rel="next"', response.headers["Link"])
+        # a change outside of the page does not change its tag
+        self.client.delete(f"{BASE_URL}/{products[2].id}")
+        response = self.client.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.delete(f"{BASE_URL}/{products[1].id}")
+        response = self.client.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_list_products_combined_filters(self):
+        """It should apply every filter given at once"""
+        ProductFactory(name="Hat", category="CLOTHS", available=True, price=Decimal("20")).create()
+        ProductFactory(name="Hat", category="CLOTHS", available=False, price=Decimal("20")).create()
+        ProductFactory(name="Hat", category="FOOD", available=True, price=Decimal("20")).create()
+        ProductFactory(name="Hat", category="CLOTHS", available=True, price=Decimal("80")).create()
+        ProductFactory(name="Shirt", category="CLOTHS", available=True, price=Decimal("20")).create()
+        response = self.client.get(BASE_URL, query_string="name=Hat&category=CLOTHS&available=true")
+        self.assertEqual(len(response.get_json()), 2)
+        response = self.client.get(BASE_URL, query_string="name=Hat&category=CLOTHS&available=true&max_price=50")
+        data = response.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual((data[0]["name"], data[0]["category"]), ("Hat", "CLOTHS"))
+        self.assertTrue(data[0]["available"])
+        response = self.client.get(BASE_URL, query_string="min_price=50")
+        self.assertEqual([Decimal(item["price"]) for item in response.get_json()], [80])
+
+    def test_list_products_bad_price(self):
+        """It should not List Products with a bad price range"""
+        for query_string in ("min_price=abc", "max_price=NaN", "category=HATS"):
+            response = self.client.get(BASE_URL, query_string=query_string)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query_string)
+
+    def test_list_products_sorted_by_price(self):
+        """It should List Products in a price range cheapest first"""
+        for price in ("60", "15", "45", "5", "30", "15"):
+            ProductFactory(price=Decimal(price)).create()
+        response = self.client.get(BASE_URL, query_string="min_price=10&max_price=50&sort=price")
+        self.assertEqual([Decimal(item["price"]) for item in response.get_json()], [15, 15, 30, 45])
+        prices = []
+        url = f"{BASE_URL}?min_price=10&max_price=50&sort=-price&limit=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            prices.extend(Decimal(item["price"]) for item in response.get_json())
+            url = self._links(response).get("next")
+        self.assertEqual(prices, [45, 30, 15, 15])
+
+    def test_list_products_bad_sort(self):
+        """It should not List Products with an unknown sort"""
+        response = self.client.get(BASE_URL, query_string="sort=color")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_products(self):
+        """It should Search Products one page at a time"""
+        for index in range(5):
+            ProductFactory(name=f"Hat {index}", description="A felt hat").create()
+        ProductFactory(name="Wrench", description="A heavy tool").create()
+        response = self.client.get(f"{BASE_URL}/search", query_string="q=felt&limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [item["name"] for item in response.get_json()]
+        self.assertNotIn("prev", self._links(response))
+        while "next" in self._links(response):
+            response = self.client.get(self._links(response)["next"])
+            names.extend(item["name"] for item in response.get_json())
+        self.assertEqual(sorted(names), [f"Hat {index}" for index in range(5)])
+        self.assertIn("prev", self._links(response))
+        response = self.client.get(f"{BASE_URL}/search", query_string="q=tool")
+        self.assertEqual([item["name"] for item in response.get_json()], ["Wrench"])
+
+    def test_search_products_bad_request(self):
+        """It should not Search without words or with a bad offset"""
+        for query_string in ("", "q=", "q=hat&offset=-1", "q=hat&limit=0"):
+            response = self.client.get(f"{BASE_URL}/search", query_string=query_string)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query_string)
+
+    def test_suggest_product_names(self):
+        """It should Suggest the names of Products that start with a prefix"""
+        for name in ("Hat", "hat", "Hammer", "Wrench"):
+            ProductFactory(name=name).create()
+        response = self.client.get(f"{BASE_URL}/suggest", query_string="prefix=HA")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), ["Hammer", "Hat"])
+        response = self.client.get(f"{BASE_URL}/suggest", query_string="prefix=h&limit=1")
+        self.assertEqual(response.get_json(), ["Hammer"])
+        for query_string in ("", "prefix=", "prefix=h&limit=0"):
+            response = self.client.get(f"{BASE_URL}/suggest", query_string=query_string)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query_string)
+
+    def test_count_product_facets(self):
+        """It should count the Products matching filters by category and availability"""
+        ProductFactory(category=Category.FOOD, available=True).create()
+        ProductFactory(category=Category.FOOD, available=False).create()
+        ProductFactory(category=Category.TOOLS, available=True).create()
+        response = self.client.get(f"{BASE_URL}/facets", query_string="available=true")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(data["category"]["FOOD"], 1)
+        self.assertEqual(data["category"]["TOOLS"], 1)
+        self.assertEqual(data["category"]["CLOTHS"], 0)
+        self.assertEqual(data["available"], {"true": 2, "false": 0})
+        response = self.client.get(f"{BASE_URL}/facets", query_string="category=food&name=nothing")
+        self.assertEqual(response.get_json()["count"], 0)
+        response = self.client.get(f"{BASE_URL}/facets", query_string="category=bogus")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_metrics(self):
+        """It should count the requests to each route in the Prometheus text format"""
+        product = self._create_products(1)[0]
+
+        def read_count(text: str, status_code: int) -> int:
+            series = f'http_requests_total{{method="GET",route="/products/<int:product_id>",status="{status_code}"}} '
+            for line in text.splitlines():
+                if line.startswith(series):
+                    return int(line[len(series):])
+            return 0
+
+        before = self.client.get("/metrics").get_data(as_text=True)
+        self.client.get(f"{BASE_URL}/{product.id}")
+        self.client.get(f"{BASE_URL}/{product.id + 1000}")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        text = response.get_data(as_text=True)
+        self.assertEqual(read_count(text, 200), read_count(before, 200) + 1)
+        self.assertEqual(read_count(text, 404), read_count(before, 404) + 1)
+        self.assertNotIn(f"/products/{product.id}", text)
+        self.assertIn('http_requests_in_flight{method="GET",route="/metrics"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/products/<int:product_id>"}', text)
+
+    def test_server_timing(self):
+        """It should send the number of statements and their time in the database"""
+        product = self._create_products(1)[0]
+        response = self.client.get(f"{BASE_URL}/{product.id}")
+        timing = response.headers["Server-Timing"]
+        self.assertTrue(timing.startswith("db;dur="))
+        self.assertRegex(timing, r'desc="([1-9][0-9]* queries|1 query)"')
+        response = self.client.get("/health")
+        self.assertIn('desc="0 queries"', response.headers["Server-Timing"])
+
+    def test_reset_products(self):
+        """It should remove every Product only when the reset endpoint is enabled"""
+        self._create_products(3)
+        response = self.client.post("/admin/reset")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 3)
+        app.config["RESET_ENABLED"] = True
+        try:
+            response = self.client.post("/admin/reset")
+        finally:
+            app.config["RESET_ENABLED"] = False
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(BASE_URL).get_json(), [])
+
+    def test_reset_products_then_create(self):
+        """It should never serve a Product removed by a reset for one created after it"""
+        old = self._create_products(3)
+        etags = {self.client.get(f"{BASE_URL}/{product.id}").headers["ETag"] for product in old}
+        self.client.get(BASE_URL)  # caches the encoding of every Product
+        stale = {product.id: fragment_cache.get(product.id) for product in old}
+        app.config["RESET_ENABLED"] = True
+        try:
+            self.assertEqual(self.client.post("/admin/reset").status_code, status.HTTP_204_NO_CONTENT)
+        finally:
+            app.config["RESET_ENABLED"] = False
+        # another worker still has the encodings cached from before the reset
+        for product_id, fragment in stale.items():
+            fragment_cache.set(product_id, fragment)
+        new = self._create_products(3)
+        self.assertTrue(min(product.id for product in new) > max(product.id for product in old))
+        for product in new:
+            response = self.client.get(f"{BASE_URL}/{product.id}")
+            self.assertEqual(response.get_json()["name"], product.name)
+            self.assertNotIn(response.headers["ETag"], etags)
+        listing = self.client.get(BASE_URL).get_json()
+        self.assertEqual([(item["id"], item["name"]) for item in listing], [(p.id, p.name) for p in new])
+
+    def test_slow_queries(self):
+        """It should list the slow statements with redacted parameters and clear them"""
+        product = self._create_products(1)[0]
+        self.client.delete("/admin/slow-queries")
+        query_log.configure(threshold=0, explain=True)
+        try:
+            self.client.get(BASE_URL, query_string={"name": product.name})
+        finally:
+            query_log.configure(threshold=app.config["SLOW_QUERY_THRESHOLD_MS"] / 1000, explain=False)
+        response = self.client.get("/admin/slow-queries")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["threshold_ms"], app.config["SLOW_QUERY_THRESHOLD_MS"])
+        self.assertGreater(len(data["queries"]), 0)
+        query = data["queries"][0]
+        self.assertEqual(query["label"], "GET /products")
+        self.assertIn("plan", query)
+        self.assertNotIn(product.name, str(data["queries"]))
+        response = self.client.delete("/admin/slow-queries")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get("/admin/slow-queries").get_json()["queries"], [])
+
+    def test_stats_pool(self):
+        """It should return the connection pool counters"""
+        self.client.get(BASE_URL)
+        response = self.client.get("/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()["pool"]
+        for counter in ("checkouts", "overflow_checkouts", "checked_out", "size", "wait_seconds"):
+            self.assertIn(counter, data)
+        self.assertGreater(data["checkouts"], 0)
+        self.assertEqual(data["size"], db.engine.pool.size())
+
+    def test_list_products_from_fragments(self):
+        """It should List Products from cached encodings exactly as jsonify would"""
+        products = self._create_products(3)
+        response = self.client.get(BASE_URL)
+        with app.test_request_context():
+            expected = jsonify([Product.find(product.id).serialize() for product in products]).get_data()
+        self.assertEqual(response.get_data(), expected)
+        hits = fragment_cache.stats()["hits"]
+        self.assertEqual(self.client.get(BASE_URL).get_data(), expected)
+        self.assertEqual(fragment_cache.stats()["hits"], hits + 3)
+
+    def test_fragments_follow_changes(self):
+        """It should not serve the encoding of an older version of a Product"""
+        product = self._create_products(1)[0]
+        self.client.get(f"{BASE_URL}/{product.id}")
+        data = product.serialize()
+        data["name"] = "Fedora"
+        self.client.put(f"{BASE_URL}/{product.id}", json=data)
+        self.assertEqual(self.client.get(BASE_URL).get_json()[0]["name"], "Fedora")
+        # a write by another worker only changes the version in the database
+        db.session.execute(update(Product).values(name="Bowler", version=Product.version + 1))
+        db.session.commit()
+        self.assertEqual(self.client.get(f"{BASE_URL}/search", query_string="q=bowler").get_json()[0]["name"], "Bowler")
+        self.assertEqual(self.client.get(BASE_URL).get_json()[0]["name"], "Bowler")
@@ -0,0 +1,57 @@
+"""
+Test cases for the table driven Validator
+"""
+from unittest import TestCase
+from service.common.validation import Validator
+
+
+def parse_positive(field: str, value) -> int:
+    """Returns a positive integer or raises ValueError"""
+    if not isinstance(value, int) or value <= 0:
+        raise ValueError(f"Invalid value for positive [{field}]: {value}")
+    return value
+
+
+class TestValidator(TestCase):
+    """Validator tests"""
+
+    def setUp(self):
+        self.validator = Validator(
+            {"name": str, "count": parse_positive, "active": bool}, missing="missing {}", invalid="not an object"
+        )
+
+    def test_valid(self):
+        """It should return the values of the fields and ignore the others"""
+        data = {"name": "Hat", "count": 2, "active": False, "id": 7}
+        self.assertEqual(self.validator.validate(data), {"name": "Hat", "count": 2, "active": False})
+        self.assertEqual(self.validator.fields, ("name", "count", "active"))
+
+    def test_every_error(self):
+        """It should report the errors of every field at once"""
+        values, errors = self.validator.check({"name": 1, "count": -1})
+        self.assertEqual(values, {})
+        self.assertEqual(
+            errors,
+            ["Invalid type for string [name]: <class 'int'>", "Invalid value for positive [count]: -1", "missing active"],
+        )
+        with self.assertRaises(ValueError) as context:
+            self.validator.validate({"name": 1, "count": -1})
+        self.assertEqual(str(context.exception), "; ".join(errors))
+        self.assertEqual(self.validator.check(["Hat"]), ({}, ["not an object"]))
+        self.assertEqual(self.validator.check(None), ({}, ["not an object"]))
+
+    def test_validate_many(self):
+        """It should check a list of items in one pass and list the errors by index"""
+        items = [
+            {"name": "Hat", "count": 1, "active": True},
+            {"name": "Hat", "count": 0, "active": "yes"},
+            "Hat",
+            {"name": "Shoes", "count": 3, "active": False},
+        ]
+        rows, errors = self.validator.validate_many(items)
+        self.assertEqual([row["name"] for row in rows], ["Hat", "Shoes"])
+        self.assertEqual([error["index"] for error in errors], [1, 2])
+        self.assertEqual(len(errors[0]["errors"]), 2)
+        self.assertEqual(errors[0]["message"], "; ".join(errors[0]["errors"]))
+        self.assertEqual(errors[1]["errors"], ["not an object"])
+        self.assertEqual(self.validator.validate_many([]), ([], []))